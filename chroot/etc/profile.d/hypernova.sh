@@ -10,3 +10,12 @@
 #
 
 export PATH="$PATH:/usr/local/hypernova/bin"
+
+# Tab completion for the client; see ClientCompleteAction
+if [ -n "$BASH_VERSION" ]; then
+    _hn_client() {
+        COMPREPLY=($(COMP_WORDS="${COMP_WORDS[*]}" COMP_CWORD="$COMP_CWORD" \
+                     hn-client complete 2>/dev/null))
+    }
+    complete -F _hn_client hn-client
+fi
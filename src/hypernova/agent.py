@@ -9,24 +9,80 @@
 #                    Luke Carrier <luke.carrier@tdm.info>
 #
 
+from concurrent.futures import ThreadPoolExecutor
+import configparser
 from http.server import HTTPServer, BaseHTTPRequestHandler
 from hypernova import modules
 import json
 import logging
 import logging.handlers
-from hypernova.libraries.configuration import ConfigurationFactory
+from hypernova.libraries.configuration import REQUIRED, \
+                                             ConfigurationFactory, \
+                                             ConfigurationSchema, LoadError, \
+                                             ValidationError
 from hypernova.libraries.debug import debug_setup
+from hypernova.libraries.eventloop import BufferedRequestHandlerMixIn, \
+                                          EventLoopHTTPServer
 from hypernova.libraries.gnupg import GPG
 from hypernova.libraries.proc import daemonise
+from hypernova.libraries.securityfilters import RESET_HEADER, \
+                                                SIGNED_HEADER, \
+                                                AuthenticationError, \
+                                                ResetRequiredError, \
+                                                get_security_filter
+from hypernova.libraries.stats import StageTimer, Stats
+from hypernova.libraries.threadpool import BoundedThreadPoolMixIn
 import os
+import select
+import signal
 import socket
 from socketserver import ThreadingMixIn
 import sys
+import threading
+import time
 
 # Log types, used within hypernova.agent.AgentRequestHandler
 LOG_MESSAGE = 1
 LOG_ERROR   = 2
 
+# Agent configuration schema
+#
+# Snapshots of the configuration are built to this schema and validated
+# against it as the configuration is loaded or reloaded, so request threads
+# read values which are already converted to their types.
+CONFIG_SCHEMA = ConfigurationSchema({
+    'concurrency': int,
+    'dns':         str,
+    'gpg': [
+        ('key_store',   str, None),
+        ('fingerprint', str, None),
+        ('pool_size',   int, 0),
+        ('queue_depth', int, 0),
+    ],
+    'logging': [
+        ('main_log',      str,  REQUIRED),
+        ('request_log',   str,  REQUIRED),
+        ('error_log',     str,  REQUIRED),
+        ('stage_timings', bool, False),
+    ],
+    'security': str,
+    'server': [
+        ('address',            str,  REQUIRED),
+        ('port',               int,  REQUIRED),
+        ('mode',               str,  'threading'),
+        ('daemon',             bool, False),
+        ('pid_file',           str,  None),
+        ('timeout',            int,  None),
+        ('keep_alive_timeout', int,  None),
+        ('workers',            int,  None),
+        ('max_queued',         int,  None),
+        ('max_connections',    int,  None),
+        ('batch_workers',      int,  4),
+        ('max_batch',          int,  1000),
+        ('preload_modules',    bool, False),
+    ],
+})
+
 class Agent:
     """
     HyperNova agent.
@@ -56,6 +112,7 @@ class Agent:
     _config = None
 
     _security_filter = None
+    _identity        = None
 
     def __init__(self, config_root_dir):
         """
@@ -90,7 +147,9 @@ class Agent:
         self._init_encryption()
         self._config_logging()
 
-        if self._config.getboolean('server', 'daemon'):
+        server = ConfigurationFactory.get_snapshot('hypernova').server
+
+        if server.daemon:
             keep_fds = []
             for (name, logger) in logging.Logger.manager.loggerDict.items():
                 for handler in logger.handlers:
@@ -100,21 +159,108 @@ class Agent:
             self._main_log.debug('retaining file descriptors %s' %(fd_str))
             daemonise(keep_fds=keep_fds)
 
-        try:
-            with open(self._config['server']['pid_file'], 'w') as f:
+        if server.pid_file:
+            with open(server.pid_file, 'w') as f:
                 f.write(str(os.getpid()))
-        except KeyError:
+        else:
             self._main_log.warn('cannot write PID; check server.pid_file value')
 
         self._init_modules()
 
-        addr = (self._config['server']['address'],
-                int(self._config['server']['port']))
-        self._server = AgentServer(addr, AgentRequestHandler, self._gpg)
+        try:
+            (server_class, handler_class) = SERVER_MODES[server.mode]
+        except KeyError:
+            self._main_log.critical('unsupported server mode %s'
+                                    %(server.mode))
+            sys.exit(78)
+
+        self._main_log.info('using %s server' %(server.mode))
+        self._server = server_class((server.address, server.port),
+                                    handler_class, self._security_filter,
+                                    self._identity)
+        if server.batch_workers:
+            self._server.batch_executor = \
+                    ThreadPoolExecutor(server.batch_workers)
+        self._init_settings()
+
+        # daemonise() ignores SIGHUP, so this must follow it
+        signal.signal(signal.SIGHUP, self._reload_config)
+
         self._main_log.info('entering server main loop')
         self._server.serve_forever()
         self._main_log.info('server exiting')
 
+    def _init_settings(self):
+        """
+        Apply the settings which may be changed by reloading the configuration.
+        """
+
+        snapshot = ConfigurationFactory.get_snapshot('hypernova')
+
+        self._server.request_timeout = snapshot.server.timeout
+        self._server.max_batch       = snapshot.server.max_batch
+        self._server.log_timings     = snapshot.logging.stage_timings
+        if snapshot.server.keep_alive_timeout is not None:
+            self._server.keep_alive_timeout = \
+                    snapshot.server.keep_alive_timeout
+        self._init_limits(snapshot)
+
+    def _reload_config(self, signum=None, frame=None):
+        """
+        Reload the configuration, on receipt of SIGHUP.
+
+        The new configuration and its snapshot replace the old in one step:
+        modules which read the snapshot as they handle requests (e.g. the dns
+        module's adapter settings) pick it up from their next request, and the
+        server's timeouts and limits are applied straight away. The address,
+        server mode, security settings, logs and worker threads are only set
+        at startup, and changes to them require a restart. If the new
+        configuration can't be loaded, or is invalid, the old one is kept.
+
+        Modules which failed to load are tried again on their next request.
+        """
+
+        self._main_log.info('reloading configuration')
+
+        try:
+            config = ConfigurationFactory.reload('hypernova', self._main_log)
+        except (LoadError, configparser.Error, IOError, OSError) as e:
+            self._main_log.error('failed to reload configuration; keeping the '
+                                 'current configuration (%s)' %(e))
+            return
+
+        self._config = config
+        self._init_settings()
+        modules.clear_failures()
+
+    def _init_limits(self, snapshot):
+        """
+        Apply the server's limits.
+
+        In the pool and event loop modes, server.workers sets the number of
+        worker threads and server.max_queued the number of connections (pool)
+        or requests (event loop) which may wait for one. When the pool's queue
+        is full, new connections are turned away with a signed 503 response;
+        the event loop instead stops reading until it catches up, and holds no
+        more than server.max_connections connections open.
+
+        In all modes, the concurrency section caps the number of requests for
+        a module (e.g. site = 4) or action (e.g. site.deploy = 2) executed at
+        once; requests beyond the cap receive a 503 response.
+        """
+
+        for option in ('workers', 'max_queued', 'max_connections'):
+            value = getattr(snapshot.server, option)
+            if value is not None and hasattr(self._server, option):
+                setattr(self._server, option, value)
+
+        if 'concurrency' in snapshot:
+            self._server.set_concurrency_limits(snapshot.concurrency)
+        else:
+            self._server.set_concurrency_limits({})
+
+        self._server.prepare_busy_response()
+
     def _init_config(self, config_root_dir):
         """
         Initialise configuration values.
@@ -124,12 +270,13 @@ class Agent:
 
         self._main_log.info('loading configuration from directory %s'
                             %(config_root_dir))
-        self._config = ConfigurationFactory.get('hypernova',
-                                                root_dir=config_root_dir,
-                                                log=self._main_log)
-
-        if not self._config:
-            self._main_log.critical('loading configuration failed')
+        try:
+            self._config = ConfigurationFactory.get('hypernova',
+                                                    root_dir=config_root_dir,
+                                                    log=self._main_log,
+                                                    schema=CONFIG_SCHEMA)
+        except ValidationError as e:
+            self._main_log.critical('loading configuration failed: %s' %(e))
             sys.exit(78)
 
     def _init_encryption(self):
@@ -138,22 +285,51 @@ class Agent:
 
         Here, we initialise a support encryption system which we will use as a
         filter for all traffic which passes through the agent. The design is
-        modular to enable easily switching between different technologies.
+        modular to enable easily switching between different technologies; the
+        filter is selected with the security.filter configuration value.
+
+        Setting gpg.pool_size enables a bounded pool of GPG workers shared by
+        all request threads; gpg.queue_depth limits the number of operations
+        waiting on them.
         """
 
-        self._gpg = GPG.get_gpg(gnupghome=self._config['gpg']['key_store'],
-                                          instancename='hn-agent')
+        snapshot = ConfigurationFactory.get_snapshot('hypernova')
+
+        if 'security' in snapshot:
+            filter_options = snapshot.security
+        else:
+            filter_options = {}
+        filter_name = filter_options.get('filter', 'gnupg')
+
+        if filter_name == 'null':
+            self._main_log.warn('null security filter in use; traffic will be '
+                                'neither encrypted nor authenticated')
+            self._security_filter = get_security_filter(filter_name)
+            return
+
+        if 'gpg' not in snapshot or not snapshot.gpg.key_store:
+            self._main_log.error('no GPG key store configured; aborting')
+            sys.exit(78)
+
+        self._gpg = GPG.get_gpg(gnupghome=snapshot.gpg.key_store,
+                                instancename='hn-agent',
+                                pool_size=snapshot.gpg.pool_size,
+                                queue_depth=snapshot.gpg.queue_depth)
         gpg_secrets = self._gpg.list_keys(True)
 
         for key in gpg_secrets:
-            if key['fingerprint'] == self._config['gpg']['fingerprint']:
-                self._gpg._secret_key = key
+            if key['fingerprint'] == snapshot.gpg.fingerprint:
+                self._identity = key['fingerprint']
                 break
 
-        if not hasattr(self._gpg, '_secret_key'):
+        if not self._identity:
             self._main_log.error('no GPG private key configured; aborting')
             sys.exit(78)
 
+        self._main_log.info('using security filter %s' %(filter_name))
+        self._security_filter = get_security_filter(filter_name, self._gpg,
+                                                    filter_options)
+
     def _init_logging(self):
         """
         Initialise logs.
@@ -190,18 +366,20 @@ class Agent:
 
         self._main_log.info('redirecting logging output to files')
 
+        paths = ConfigurationFactory.get_snapshot('hypernova').logging
+
         self._main_log_handler = logging.handlers.RotatingFileHandler(
-            self._config['logging']['main_log'], mode='a')
+            paths.main_log, mode='a')
         self._main_log_handler.setFormatter(self._main_log_formatter)
         self._main_log.addHandler(self._main_log_handler)
 
         self._req_log_handler = logging.handlers.RotatingFileHandler(
-            self._config['logging']['request_log'], mode='a')
+            paths.request_log, mode='a')
         self._req_log_handler.setFormatter(self._main_log_formatter)
         self._req_log.addHandler(self._req_log_handler)
 
         self._err_log_handler = logging.handlers.RotatingFileHandler(
-            self._config['logging']['error_log'], mode='a')
+            paths.error_log, mode='a')
         self._err_log_handler.setFormatter(self._main_log_formatter)
         self._err_log.addHandler(self._err_log_handler)
 
@@ -214,53 +392,301 @@ class Agent:
         initialisation methods of each of the modules it has loaded. This
         facilitates loading custom configuration directly from the configuration
         files.
+
+        Modules are imported when they're first dispatched to, unless
+        server.preload_modules is set, and are initialised as they're imported.
+        """
+
+        modules.load_hooks.append(self._init_module)
+
+        if ConfigurationFactory.get_snapshot('hypernova').server.preload_modules:
+            for module_name in sorted(modules.MODULES):
+                modules.get_module(module_name)
+
+    def _init_module(self, module_name, module):
+        """
+        Initialise a module as it's imported.
+        """
+
+        self._main_log.info('initialising module %s (imported in %.1fms)'
+                            %(module_name,
+                              modules.load_times[module_name] * 1000))
+        if not hasattr(module, '_agent_init'):
+            self._main_log.debug('module %s had no initialiser (_agent_init)'
+                                 %(module_name))
+            return
+
+        module._agent_init(self._config)
+
+
+class AgentServerMixIn:
+    """
+    Agent server state.
+
+    Shared by the agent's HTTP servers, regardless of how they schedule
+    requests; for details of the execution workflow used to serve each
+    request, see the AgentRequestHandler class.
+    """
+
+    # Seconds a connection may sit idle (e.g. between keep-alive requests)
+    # before it's closed, and (if set) the time a served connection may wait
+    # for its next request, during which keep_alive() is polled
+    request_timeout    = None
+    keep_alive_timeout = None
+
+    # Batched requests
+    #
+    # The maximum number of requests accepted in a single batch, and the
+    # executor used to dispatch parallel batches (if None, batches are always
+    # dispatched in order).
+    max_batch      = 1000
+    batch_executor = None
+
+    # Concurrency caps
+    #
+    # Semaphores limiting the number of requests for a module or action which
+    # may execute at once, keyed by lowercase module or module.action name.
+    concurrency = {}
+
+    # Pre-signed response for requests turned away before they're read
+    busy_response = None
+
+    # Append the time spent in each stage of a request to its log line?
+    log_timings = False
+
+    def __init__(self, server_address, RequestHandlerClass, security_filter,
+                 identity, bind_and_activate=True):
+        """
+        Initialise the server.
+
+        The security filter and our identity within it are shared by all of
+        the request handlers.
+        """
+
+        self.security_filter = security_filter
+        self.identity        = identity
+
+        super().__init__(server_address, RequestHandlerClass,
+                         bind_and_activate)
+
+    def keep_alive(self):
+        """
+        Decide whether a served connection may wait for another request.
+        """
+
+        return True
+
+    def set_concurrency_limits(self, limits):
+        """
+        Set the concurrency caps.
+
+        limits maps module or module.action names to the number of such
+        requests which may execute at once; those without a (positive) limit
+        are unlimited.
         """
 
-        for module_name in modules.__all__:
-            self._main_log.info('initialising module %s' %(module_name))
-            module = getattr(modules, module_name)
-            if not hasattr(module, '_agent_init'):
-                self._main_log.warn('module %s had no initialiser (_agent_init)'
-                                    %(module_name))
+        self.concurrency = {}
+        for (name, limit) in limits.items():
+            if int(limit) > 0:
+                self.concurrency[name.lower()] = \
+                        threading.BoundedSemaphore(int(limit))
+
+    def admit(self, module_name, action):
+        """
+        Reserve capacity to execute an action.
+
+        Returns the semaphores which must be passed to release() once the
+        action has completed. Raises a DispatchError if either the module or
+        the action is at capacity; we never wait for capacity to free up.
+        """
+
+        acquired = []
+        for name in (module_name, '%s.%s' %(module_name, action)):
+            slot = self.concurrency.get(name.lower())
+            if not slot:
                 continue
 
-            module._agent_init(self._config)
+            if not slot.acquire(False):
+                self.release(acquired)
+                raise DispatchError(503, 'Too many concurrent requests')
+
+            acquired.append(slot)
+
+        return acquired
+
+    def release(self, slots):
+        """
+        Release capacity reserved by admit().
+        """
+
+        for slot in slots:
+            slot.release()
+
+    def prepare_busy_response(self):
+        """
+        Sign the response sent to requests turned away for lack of capacity.
+
+        We can't decrypt requests we don't have the capacity to serve, so we
+        can't address an encrypted response to their senders. Instead, the same
+        response is signed once, up front, so that rejecting a request costs no
+        more than a write; clients verify the signature to be sure that the 503
+        came from us. Since the response is identical every time, replaying it
+        gains an attacker nothing.
+        """
+
+        response = modules.AgentRequestHandlerBase._format_response({}, False,
+                                                                    503, '')
+        response = modules.serialise(response)
+
+        try:
+            response = self.security_filter.sign(response, self.identity, None)
+            signed = True
+        except AuthenticationError as e:
+            logging.getLogger('hn-error').error('unable to sign busy '
+                                                'response: %s' %(e))
+            signed = False
 
+        body = bytes(response, 'UTF-8')
+        head = 'HTTP/1.1 503 Service Unavailable\r\n' \
+               'Content-Type: application/json\r\n' \
+               'Connection: close\r\n' \
+               'Content-Length: %d\r\n' %(len(body))
+        if signed:
+            head += '%s: 1\r\n' %(SIGNED_HEADER)
 
-class AgentServer(ThreadingMixIn, HTTPServer):
+        self.busy_response = bytes(head + '\r\n', 'ASCII') + body
+
+
+class AgentServer(AgentServerMixIn, ThreadingMixIn, HTTPServer):
     """
     Agent multi-threaded HTTP server.
 
-    The HyperNova agent executes each operation in its own thread to increase
+    The HyperNova agent executes each connection in its own thread to increase
     performance, scalability and stability. In doing so, the server is always
     free to open new connections with clients, since all requests are
     non-blocking.
+    """
+
+    # Overridden from ThreadingMixIn
+    #
+    # Idle keep-alive connections mustn't prevent the agent from exiting.
+    daemon_threads = True
 
-    For details of the execution workflow used to serve each request, see the
-    AgentRequestHandler class.
+
+class PoolAgentServer(AgentServerMixIn, BoundedThreadPoolMixIn, HTTPServer):
+    """
+    Agent thread pool HTTP server.
+
+    Connections are served by a fixed number of worker threads, with a bounded
+    queue of connections waiting for them. Connections which arrive when the
+    queue is full receive an immediate (signed) 503 response.
+
+    Each worker serves a connection for its lifetime, so an idle keep-alive
+    connection holds on to its worker. To keep idle connections from
+    starving those with work to do, a served connection gives up its worker
+    (and is closed) as soon as other connections are waiting for one, and
+    otherwise waits no more than server.keep_alive_timeout seconds for its
+    next request.
     """
 
-    pass
+    keep_alive_timeout = 2
+
+    def keep_alive(self):
+        """
+        Decide whether a served connection may wait for another request.
+        """
+
+        # Overridden from AgentServerMixIn
+
+        return not self.connections_waiting()
+
+    def reject_request(self, request, client_address):
+        """
+        Send the busy response.
+        """
+
+        # Overridden from BoundedThreadPoolMixIn
+
+        logging.getLogger('hn-error').error('[%s:%d] no capacity; returning '
+                                            '503' %(client_address[0],
+                                                    client_address[1]))
+
+        if self.busy_response:
+            try:
+                request.sendall(self.busy_response)
+            except socket.error:
+                pass
+
+
+class EventLoopAgentServer(AgentServerMixIn, EventLoopHTTPServer):
+    """
+    Agent event loop HTTP server.
+
+    Connections are multiplexed on a single thread, with complete requests
+    executed on a fixed number of worker threads. Where the agent has to hold
+    many (mostly idle) keep-alive connections open, this keeps the number of
+    threads constant; see EventLoopHTTPServer for details.
+    """
+
+    def error_response(self, code, message):
+        """
+        Assemble a JSON response for errors raised before a request reaches its
+        handler.
+        """
+
+        # Overridden from EventLoopHTTPServer
+
+        response = modules.AgentRequestHandlerBase._format_response({}, False,
+                                                                    code, '')
+        body = bytes(modules.serialise(response), 'UTF-8')
+        head = 'HTTP/1.1 %d %s\r\nContent-Type: application/json\r\n' \
+               'Connection: close\r\nContent-Length: %d\r\n\r\n' \
+               %(code, message, len(body))
+
+        return bytes(head, 'ASCII') + body
 
 
 class AgentRequestHandler(BaseHTTPRequestHandler):
     """
     Agent request handler.
 
-    This class is instantiated once per request, and is active only during the
-    lifetime of this request.
+    This class is instantiated once per connection, and is active only during
+    the lifetime of this connection. Clients may keep the connection alive and
+    send any number of requests (possibly pipelined) over it, as per HTTP/1.1;
+    each is served in turn by handle_one_request().
     """
 
+    # Overridden from BaseHTTPRequestHandler
+    #
+    # Enables persistent connections, and sends responses without waiting on
+    # the client to acknowledge the headers.
+    protocol_version        = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
     _log = None
     _err = None
 
+    # The peer which sent the request, as identified by the security filter
+    #
+    # Until the request has been authenticated, responses can't be encrypted
+    # and are sent in the clear.
+    peer          = None
+    authenticated = False
+
+    # Timings for the request being served, and its response status
+    timer       = None
+    status_code = None
+
+    # Seconds between checks on whether an idle keep-alive connection should
+    # give up its worker
+    KEEP_ALIVE_INTERVAL = 0.1
+
     def __init__(self, request, client_address, server):
         """
         Initialise the request.
 
-        Initialises the logger and GPG interface in preparation for handling the
-        request. This enables us to write any debugging information to the log
-        and retain key metadata to save resources with larger GPG keyrings.
+        Initialises the loggers in preparation for handling the request. This
+        enables us to write any debugging information to the log.
         """
 
         # Overridden from BaseHTTPRequestHandler
@@ -270,10 +696,22 @@ class AgentRequestHandler(BaseHTTPRequestHandler):
         self._log = logging.getLogger('hn-request')
         self._err = logging.getLogger('hn-error')
 
-        self._gpg = GPG.get_gpg(instancename='hn-agent')
-
         super().__init__(request, client_address, server)
 
+    def setup(self):
+        """
+        Prepare the connection.
+        """
+
+        # Overridden from StreamRequestHandler
+        #
+        # Apply the server's idle timeout to the socket, so that idle
+        # keep-alive connections don't hold on to their threads forever.
+
+        self.timeout = self.server.request_timeout
+        self.served  = False
+        super().setup()
+
     def handle_one_request(self):
         """
         Serve a single request.
@@ -284,121 +722,341 @@ class AgentRequestHandler(BaseHTTPRequestHandler):
         # By overriding the method, we're able to use custom HTTP methods in
         # module request handlers without defining the methods in this class.
 
+        # Once a request has been served, the server decides whether the
+        # connection may wait for another
+        if self.served and not self.await_request():
+            self.close_connection = 1
+            return
+
         try:
             self.raw_requestline = self.rfile.readline(65537)
 
-            if len(self.raw_requestline) > 65536:
-                self.requestline = ''
-                self.request_version = ''
-                self.command = ''
-                self.send_error(414, 'Request entity too large')
-                return
-
             if not self.raw_requestline:
                 self.close_connection = 1
                 return
 
-            if not self.parse_request():
-                return
+            self.served = True
 
-            # We will *always* return JSON from this point onward
-            self.send_header('Content-Type', 'application/json');
+            # Time from the arrival of the request line, so that idle time
+            # between keep-alive requests isn't counted
+            self.timer = StageTimer('read')
+
+            self.module_name = None
+            self.action      = None
+            self.status_code = None
 
-            # Ensure the request has a body
-            #
-            # To ensure security, the action to perform is ascertained based
-            # upon the action value in the JSON body of the request. If this is
-            # not set, there's no point wasting CPU cycles trying to decrypt it.
             try:
-                length = int(self.headers.get('Content-Length'))
-                raw = self.rfile.read(length)
-            except TypeError:
-                self.log_error('Content-Length not set; assuming no parameters')
-                self.send_error(400, 'No parameters')
-                return
+                self.serve_one_request()
+            finally:
+                self.record_request()
 
-            # Verify signature trustworthiness and decrypt parameters
-            #
-            # The body of the request will be an ASCII-armored PGP message. In
-            # order to read it we must do two things:
-            #
-            # * ensure that the content within the body was signed by a trusted
-            #   keypair present in our keyring; and
-            # * successfully decrypt the output using the server's private key.
-            #
-            # Only when both criteria are met can we be sure that the request
-            # came from an authorised machine.
-            self.clear = self._gpg.decrypt(raw)
-            if str(self.clear) == '':
-                self.log_error('decrypted request body empty; potential ' \
-                               'authentication failure')
-                self.send_error(403, 'Access denied')
-                return
+        except socket.timeout as e:
+            self.log_error('request timed out (%r)', e)
+            self.close_connection = 1
+            return
 
-            if not hasattr(self.clear, 'fingerprint'):
-                self.log_error('data unsigned or signing key not in local ' \
-                               'key store')
-                self.send_error(403, 'Access denied')
-                return
+    def await_request(self):
+        """
+        Wait for the next request on a connection that's been served.
 
-            # Decode the parameters
-            try:
-                params = json.loads(str(self.clear))
-            except ValueError:
-                self.log_error('failed to interpret parameters as JSON')
-                self.send_error(400, 'Invalid parameters')
-                return
+        Returns False if the connection should be closed instead, either
+        because the server needs its worker for waiting connections or
+        because server.keep_alive_timeout expired first.
+        """
 
-            # Establish the action to perform
-            #
-            # The action parameter in the request is passed in the form:
-            #
-            #     module.submodule.action
-            #
-            # Submodule support is not yet part of the agent, but is likely to
-            # be incorporated very soon and will enable cleaner namespacing of
-            # actions.
-            try:
-                (self.module_name, self.action) = params['action'].rsplit('.',
-                                                                          1)
-            except ValueError:
-                self.send_error(400, 'Action not namespaced')
+        timeout = self.server.keep_alive_timeout
+        if timeout is None:
+            return True
 
-            try:
-                module = getattr(modules, self.module_name)
-                handler = getattr(module, 'AgentRequestHandler')
-            except (AttributeError, KeyError):
-                self.send_error(501, 'Unsupported module')
-                return
+        # A pipelined request may already have been read into the buffer,
+        # where select() can't see it
+        self.connection.settimeout(0)
+        try:
+            buffered = self.rfile.peek(1)
+        finally:
+            self.connection.settimeout(self.timeout)
+        if buffered:
+            return True
+
+        deadline = time.time() + timeout
+        while self.server.keep_alive():
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+
+            (readable, writable, exceptional) = select.select(
+                    [self.connection], [], [],
+                    min(remaining, self.KEEP_ALIVE_INTERVAL))
+            if readable:
+                return True
+
+        return False
+
+    def serve_one_request(self):
+        """
+        Serve a single request, once its request line has been read.
+        """
 
-            try:
-                method = getattr(handler, 'do_' + self.action.lower())
-            except AttributeError:
-                self.send_error(405, 'Unsupported method')
-                return
+        if len(self.raw_requestline) > 65536:
+            self.requestline = ''
+            self.request_version = ''
+            self.command = ''
+            self.close_connection = 1
+            self.send_error(414, 'Request entity too large')
+            return
+
+        if not self.parse_request():
+            return
+
+        self.peer          = None
+        self.authenticated = False
+
+        # Ensure the request has a body
+        #
+        # To ensure security, the action to perform is ascertained based upon
+        # the action value in the JSON body of the request. If this is not set,
+        # there's no point wasting CPU cycles trying to decrypt it.
+        try:
+            length = int(self.headers.get('Content-Length'))
+            raw = str(self.rfile.read(length), 'UTF-8')
+        except TypeError:
+            # We can't tell where the body ends, and thus where the next
+            # request begins
+            self.log_error('Content-Length not set; assuming no parameters')
+            self.close_connection = 1
+            self.send_error(400, 'No parameters')
+            return
+
+        # Verify signature trustworthiness and decrypt parameters
+        #
+        # The body of the request will have been encrypted by the client's
+        # security filter (for the GPG filter, an ASCII-armored PGP message). In
+        # order to read it we must do two things:
+        #
+        # * ensure that the content within the body was signed by a trusted
+        #   peer; and
+        # * successfully decrypt the output using the server's private key.
+        #
+        # Only when both criteria are met can we be sure that the request came
+        # from an authorised machine. The filter handles both, raising an
+        # AuthenticationError if either fails.
+        self.timer.stage('decrypt')
+        try:
+            (clear, self.peer) = self.server.security_filter.decrypt(
+                    raw, None, self.server.identity)
+            self.authenticated = True
+        except AuthenticationError as e:
+            self.log_error('%s', e)
+
+            # Tell the client when it's safe to try again afresh; the request
+            # was refused without being carried out
+            headers = {}
+            if isinstance(e, ResetRequiredError):
+                headers[RESET_HEADER] = '1'
+
+            self.send_error(403, 'Access denied', headers=headers)
+            return
 
-            # Perform the action
-            if 'parameters' not in params:
-                params['parameters'] = {}
+        # Decode the parameters
+        self.timer.stage('decode')
+        try:
+            params = json.loads(clear)
+        except ValueError:
+            self.log_error('failed to interpret parameters as JSON')
+            self.send_error(400, 'Invalid parameters')
+            return
 
-            self.send_response(200, 'OK')
+        # Batches carry a list of requests in place of a single action
+        if 'batch' in params:
+            self.handle_batch(params)
+            return
 
-            # Handle all exceptions
-            #
-            # http://wiki.python.org/moin/HandlingExceptions#line-26
+        self.timer.stage('dispatch')
+        try:
+            (self.module_name, self.action, handler, method) = \
+                    self.resolve(params.get('action'))
+            slots = self.server.admit(self.module_name, self.action)
+        except DispatchError as e:
+            self.send_error(e.code, e.message)
+            return
+
+        # Perform the action
+        if 'parameters' not in params:
+            params['parameters'] = {}
+
+        # Handle all exceptions
+        #
+        # http://wiki.python.org/moin/HandlingExceptions#line-26
+        self.timer.stage('module')
+        try:
+            # The capacity is released before we respond, so that it's free
+            # for any request the client sends once it has the response
             try:
                 response = method(params['parameters'])
-                self.send_preformatted_response(response)
-            except Exception as e:
-                self.send_error(500, 'Module execution failure')
-                self.log_exception(e)
-                return
+            finally:
+                self.server.release(slots)
+        except Exception as e:
+            self.send_error(500, 'Module execution failure')
+            self.log_exception(e)
+            return
 
-        except socket.timeout as e:
-            self.log_error('request timed out (%r)', e)
-            self.close_connection = 1
+        self.send_preformatted_response(response)
+
+    def record_request(self):
+        """
+        Log a request and record its timings, once its response has been sent.
+
+        If server.log_timings is set, the time spent in each stage is appended
+        to the log line as stage=milliseconds fields.
+        """
+
+        if self.status_code is None:
+            return
+
+        self.timer.stop()
+
+        if self.module_name == 'batch':
+            name = 'batch'
+            message = 'batch of %s - %i' %(self.action, self.status_code)
+        elif self.module_name:
+            name = '%s.%s' %(self.module_name, self.action.lower())
+            message = '%s.%s - %i' %(self.module_name, self.action,
+                                     self.status_code)
+        else:
+            # Turned away before we knew what was being asked of us
+            name    = 'unresolved'
+            message = None
+
+        Stats.record(name, self.timer)
+
+        if message:
+            if self.server.log_timings:
+                message += ' ' + self.timer.format()
+            self.log_message('%s', message)
+
+    def resolve(self, action):
+        """
+        Find the handler method for an action.
+
+        Returns a tuple containing the module name, action name, the module's
+        request handler class and the method itself. Raises a DispatchError
+        with the appropriate HTTP status if the action can't be served.
+        """
+
+        # Establish the action to perform
+        #
+        # The action parameter in the request is passed in the form:
+        #
+        #     module.submodule.action
+        #
+        # Submodule support is not yet part of the agent, but is likely to be
+        # incorporated very soon and will enable cleaner namespacing of
+        # actions.
+        try:
+            (module_name, action) = action.rsplit('.', 1)
+        except (AttributeError, ValueError):
+            raise DispatchError(400, 'Action not namespaced')
+
+        # Modules are imported (and initialised) as they're first dispatched
+        # to, so their failures surface here rather than at startup
+        try:
+            module = modules.get_module(module_name)
+            handler = getattr(module, 'AgentRequestHandler')
+        except (AttributeError, KeyError):
+            raise DispatchError(501, 'Unsupported module')
+        except Exception as e:
+            self.log_error('%s', e)
+            self.log_exception(e)
+            raise DispatchError(500, 'Module failed to load')
+
+        try:
+            method = getattr(handler, 'do_' + action.lower())
+        except AttributeError:
+            raise DispatchError(405, 'Unsupported method')
+
+        return (module_name, action, handler, method)
+
+    def handle_batch(self, params):
+        """
+        Serve a batch of requests.
+
+        Each request in the batch is dispatched exactly as if it had been sent
+        on its own, but all of the results are returned in a single response,
+        in the order they were requested. If the parallel parameter is set,
+        the requests are dispatched concurrently on the server's batch
+        executor; otherwise they're dispatched in order.
+
+        Only those actions a module lists in its batch_actions attribute may
+        be batched.
+        """
+
+        requests = params['batch']
+
+        if not isinstance(requests, list):
+            self.log_error('batch is not a list of requests')
+            self.send_error(400, 'Invalid parameters')
             return
 
+        if len(requests) > self.server.max_batch:
+            self.send_error(413, 'Batch too large')
+            return
+
+        (self.module_name, self.action) = ('batch', '%d' %(len(requests)))
+
+        self.timer.stage('module')
+        executor = self.server.batch_executor
+        if params.get('parallel') and executor:
+            results = list(executor.map(self.dispatch_batched, requests))
+        else:
+            results = [self.dispatch_batched(r) for r in requests]
+
+        successful = all(r['status']['successful'] for r in results)
+        response = modules.AgentRequestHandlerBase._format_response(
+                {'results': results}, successful)
+
+        self.send_preformatted_response(response)
+
+    def dispatch_batched(self, request):
+        """
+        Dispatch a single request within a batch.
+
+        Errors are returned as failed results rather than HTTP errors, since
+        they apply only to this request.
+        """
+
+        try:
+            if not isinstance(request, dict):
+                raise DispatchError(400, 'Invalid parameters')
+
+            (module_name, action, handler, method) = \
+                    self.resolve(request.get('action'))
+
+            if action.lower() not in handler.batch_actions:
+                raise DispatchError(405, 'Action not batchable')
+
+            slots = self.server.admit(module_name, action)
+        except DispatchError as e:
+            self.log_error('batched request failed: %d: %s', e.code, e.message)
+            return modules.AgentRequestHandlerBase._format_response(
+                    {}, False, e.code, e.message)
+
+        # Each batched request's execution time is recorded against its own
+        # action, as well as against the batch as a whole
+        timer = StageTimer('module')
+        try:
+            return method(request.get('parameters', {}))
+        except Exception as e:
+            self.log_error('batched request %s.%s failed', module_name, action)
+            self.log_exception(e)
+            return modules.AgentRequestHandlerBase._format_response(
+                    {}, False, 500, 'Module execution failure')
+        finally:
+            self.server.release(slots)
+
+            timer.stop()
+            Stats.record('%s.%s' %(module_name, action.lower()), timer,
+                         total=False)
+
     def log_error(self, format, *args):
         """
         Write an error to the log.
@@ -442,18 +1100,21 @@ class AgentRequestHandler(BaseHTTPRequestHandler):
         # Overridden from BaseHTTPRequestHandler.
         #
         # Don't display the HTTP request line in the log, since it's useless to
-        # us. If possible, log the module and action, else log a warning.
+        # us. The module, action and status are logged by record_request() once
+        # the response has been written, so that its timings are complete.
 
-        if hasattr(self, 'module_name') and hasattr(self, 'action'):
-            self.log_message("%s.%s - %i", self.module_name, self.action, code)
+        self.status_code = code
 
-    def send_error(self, code, message=None, exception=None):
+    def send_error(self, code, message=None, exception=None, headers={}):
 
         # Overridden from BaseHTTPRequestHandler
         #
         # In order to ensure consistency and stability in client applications,
         # we must format the data we're sending to the client in JSON at all
         # times. By default, HTTP-style errors are returned by instances.
+        #
+        # Errors only close the connection where we've lost track of the
+        # request stream; otherwise the client may carry on using it.
 
         try:
             shortmsg, longmsg = self.responses[code]
@@ -471,30 +1132,93 @@ class AgentRequestHandler(BaseHTTPRequestHandler):
         self.log_error('returning %d: %s', code, message)
         self.log_exception(exception)
 
-        self.send_response(code, message)
-        self.send_header('Content-Type', self.error_content_type)
-        self.send_header('Connection', 'close')
-        self.end_headers()
-
         response = modules.AgentRequestHandlerBase._format_response({}, False,
                                                                     code, '')
 
-        self.send_preformatted_response(response)
+        headers = dict(headers)
+        if self.close_connection:
+            headers['Connection'] = 'close'
+
+        self.send_preformatted_response(response, code, message, headers)
 
-    def send_preformatted_response(self, response):
+    def send_preformatted_response(self, response, code=200, message='OK',
+                                   headers={}):
         """
         Encrypt, encode and send a pre-formatted response.
+
+        Responses to authenticated requests are encrypted for the peer which
+        sent them. We've no way of addressing anybody else, so responses to
+        unauthenticated requests (which will always be errors) are sent in the
+        clear.
         """
 
-        self.end_headers()
+        self.timer.stage('encode')
         response = modules.serialise(response)
-        response = self._gpg.encrypt(response,
-                                     self.clear.fingerprint,
-                                     sign=self._gpg._secret_key['fingerprint'])
-        self.wfile.write(bytes(str(response), 'UTF-8'))
+        if self.authenticated:
+            self.timer.stage('encrypt')
+            try:
+                response = self.server.security_filter.encrypt(
+                        response, self.server.identity, self.peer)
+            except AuthenticationError as e:
+                self.log_error('unable to encrypt response: %s', e)
+                self.authenticated = False
+                self.send_error(500, 'Response encryption failure')
+                return
+        response = bytes(response, 'UTF-8')
+
+        self.timer.stage('write')
+        self.send_response(code, message)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', len(response))
+        for (name, value) in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+
+        self.wfile.write(response)
         self.wfile.flush()
 
 
+class EventLoopAgentRequestHandler(BufferedRequestHandlerMixIn,
+                                  AgentRequestHandler):
+    """
+    Agent request handler for the event loop server.
+
+    Instantiated once per request, rather than once per connection; the event
+    loop reads the request and writes the response on our behalf.
+    """
+
+    pass
+
+
+class DispatchError(Exception):
+    """
+    Dispatch error.
+
+    Thrown when a request can't be routed to a module's handler; carries the
+    HTTP status code and message to return.
+    """
+
+    def __init__(self, code, message):
+        """
+        Initialise values.
+        """
+
+        super().__init__(code, message)
+
+        self.code    = code
+        self.message = message
+
+
+# Server modes
+#
+# Maps server.mode values to the server and request handler classes which
+# implement them.
+SERVER_MODES = {
+    'eventloop': (EventLoopAgentServer, EventLoopAgentRequestHandler),
+    'pool':      (PoolAgentServer,      AgentRequestHandler),
+    'threading': (AgentServer,          AgentRequestHandler),
+}
+
 # Execute the agent application.
 #
 # If the module file was the entry point for execution, instantiate the agent
@@ -9,16 +9,61 @@
 #                    Luke Carrier <luke.carrier@tdm.info>
 #
 
+# Taken before anything else is imported, for --profile-startup
+import time
+STARTED = time.time()
+
 import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import configparser
+import fnmatch
+import functools
+from http.client import HTTPException
 from hypernova.libraries.gnupg import GPG
 from hypernova.libraries.client import Client
 from hypernova.libraries.configuration import ConfigurationFactory, LoadError
 from hypernova import modules
+from hypernova.modules import ClientRequestBuilderBase
+import json
 import os
+import shlex
+import socket
 import sys
+import tempfile
+import threading
 from  hypernova.libraries.debug import debug_setup
 
+class LazyArgumentParser(argparse.ArgumentParser):
+    """
+    An argument parser which is initialised only when it's used.
+
+    A subparser is added for every action and module so that they're all
+    listed in the help, but initialising a module's subparser means importing
+    the module. init is called with the parser the first time it's asked to
+    parse arguments, i.e. once argparse has found its action or module on the
+    command line.
+    """
+
+    def __init__(self, *args, init=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._init = init
+
+    def initialise(self):
+        """
+        Initialise the parser, if it hasn't been already.
+        """
+
+        if self._init:
+            (init, self._init) = (self._init, None)
+            init(self)
+
+        return self
+
+    def parse_known_args(self, args=None, namespace=None):
+        self.initialise()
+        return super().parse_known_args(args, namespace)
+
+
 class ClientActionBase:
     """
     Base class for all actions within the client.
@@ -112,6 +157,8 @@ class ClientConfigAction(ClientActionBase):
                     self._servers.add_section(self._args.name)
                     self._servers.set(self._args.name, 'addr',   "%s:%s" %(addr, port))
                     self._servers.set(self._args.name, 'pubkey', key_fingerprint)
+                    if self._args.groups:
+                        self._servers.set(self._args.name, 'groups', self._args.groups)
                 except configparser.DuplicateSectionError:
                     print('Failed: a node with the specified name already exists', file=sys.stderr)
                     sys.exit(64)
@@ -124,6 +171,7 @@ class ClientConfigAction(ClientActionBase):
                     print(name)
                     print('    Address:', node.get('addr'))
                     print('Fingerprint:', node.get('pubkey'))
+                    print('     Groups:', node.get('groups', ''))
                     print(' ')
 
             elif self._args.config_node_action == 'rm':
@@ -137,6 +185,7 @@ class ClientConfigAction(ClientActionBase):
                     print(self._args.name)
                     print('    Address:', node['addr'])
                     print('Fingerprint:', node['pubkey'])
+                    print('     Groups:', node.get('groups', ''))
                 except IndexError:
                     print('Failed: no server exists with the specified name')
                     sys.exit(64)
@@ -163,6 +212,8 @@ class ClientConfigAction(ClientActionBase):
         # Arguments for the above subparsers
         for spa in ['name', 'addr', 'pubkey']:
             ClientConfigAction._arg_parsers['config_node_add'].add_argument(spa)
+        ClientConfigAction._arg_parsers['config_node_add'].add_argument(
+                '--groups', help='comma-separated list of groups')
         ClientConfigAction._arg_parsers['config_node_rm'].add_argument('name')
         ClientConfigAction._arg_parsers['config_node_show'].add_argument('name')
 
@@ -181,77 +232,546 @@ class ClientRequestAction(ClientActionBase):
 
         super().__init__(cli_args, config_dir)
 
+        nodes = [(name, self._get_node(name))
+                 for name in self._get_node_names(cli_args.node)]
+        for (name, node) in nodes:
+            self._get_keys(node)
+
+        (request_builder, self._response_formatter) = \
+                self._get_module_handlers(cli_args.request_module,
+                                          cli_args.request_action)
+
+        self._output_lock   = threading.Lock()
+        self._prefix_output = len(nodes) > 1
+
+        client   = self._get_client(nodes[0][1], cli_args.gpg_dir)
+        requests = self._get_requests(request_builder(cli_args, client))
+
+        if len(nodes) == 1:
+            sys.exit(self._query_node(nodes[0][0], nodes[0][1], requests))
+
+        # Every node is sent the same requests, and the results are printed as
+        # each node responds
+        requests    = list(requests)
+        exit_status = 0
+        with ThreadPoolExecutor(max(cli_args.parallel, 1)) as executor:
+            futures = dict((executor.submit(self._query_node, name, node,
+                                            requests), name)
+                           for (name, node) in nodes)
+
+            for future in as_completed(futures):
+                try:
+                    status = future.result()
+                except Exception as e:
+                    status = 69
+                    self._print_result(futures[future], status,
+                                       'Failed: %s' %(e))
+
+                exit_status = max(exit_status, status)
+
+        sys.exit(exit_status)
+
+    def _get_node_names(self, spec):
+        """
+        Find the names of the nodes matching a specification.
+
+        The specification is a comma-separated list of node names, glob
+        patterns (e.g. web*) and groups (e.g. @web). A node's groups are listed
+        in the groups option of its section in servers.ini.
+        """
+
+        sections = self._servers.sections()
+        names    = []
+
+        for pattern in spec.split(','):
+            pattern = pattern.strip()
+
+            if pattern.startswith('@'):
+                matched = [name for name in sections
+                           if pattern[1:] in self._get_groups(name)]
+            elif any(char in pattern for char in '*?['):
+                matched = fnmatch.filter(sections, pattern)
+            else:
+                matched = [pattern]
+
+            if not matched:
+                print('Failed: no servers match %s' %(pattern),
+                      file=sys.stderr)
+                sys.exit(64)
+
+            for name in matched:
+                if name not in names:
+                    names.append(name)
+
+        return names
+
+    def _get_groups(self, name):
+        """
+        Get the groups a node belongs to.
+        """
+
+        groups = self._servers[name].get('groups', '')
+        return [group.strip() for group in groups.split(',') if group.strip()]
+
+    def _query_node(self, name, node, requests):
+        """
+        Send requests to a node, printing the result of each.
+
+        Requests are sent and their responses printed one at a time, so that
+        builders generating several can stream their input. Returns the exit
+        status.
+        """
+
+        client = self._get_client(node, self._args.gpg_dir, self._args.timeout)
+        keys   = self._get_keys(node)
+
+        exit_status = 0
+        for request in requests:
+            try:
+                response = client.query(request, *keys)
+            except (HTTPException, ValueError, socket.error) as e:
+                self._print_result(name, 69, 'Failed: could not query the '
+                                             'node (%s)' %(e))
+                return 69
+
+            result = self._response_formatter(self._args, response)
+            (status, output) = self._interpret_result(self._args.request_module,
+                                                      result)
+
+            self._print_result(name, status, output, response)
+            exit_status = max(exit_status, status)
+
+        return exit_status
+
+    def _print_result(self, name, status, output, response=None):
+        """
+        Print the result of a request, as formatted text or a JSON line.
+
+        When querying several nodes, each line of text is prefixed with the
+        name of the node.
+        """
+
+        with self._output_lock:
+            if self._args.output_format == 'jsonl':
+                print(json.dumps({
+                    'node':     name,
+                    'status':   status,
+                    'output':   output,
+                    'response': response,
+                }))
+            elif self._prefix_output:
+                if not output:
+                    output = 'Failed' if status else 'OK'
+
+                for line in str(output).split("\n"):
+                    print('%s: %s' %(name, line))
+            else:
+                print(output)
+
+            sys.stdout.flush()
+
+    def _get_node(self, name):
+        """
+        Find a node's configuration by its name.
+        """
+
         try:
-            node = self._servers[cli_args.node]
+            return self._servers[name]
         except KeyError:
             print('Failed: no server exists with the specified name',
                   file=sys.stderr)
             sys.exit(64)
 
+    def _get_client(self, node, gpg_dir, timeout=None):
+        """
+        Get a client for a node, timing out after timeout seconds without a
+        response.
+        """
+
+        if self._config.has_section('security'):
+            security_options = self._config['security']
+        else:
+            security_options = {}
+        security_filter = security_options.get('filter', 'gnupg')
+
         (host, sep, port) = node['addr'].partition(':')
-        client = Client(host, port, cli_args.gpg_dir)
+        return Client(host, port, gpg_dir, security_filter, security_options,
+                      timeout=timeout)
 
-        module             = getattr(modules, cli_args.request_module)
-        RequestBuilder     = getattr(module, 'ClientRequestBuilder')
-        request_builder    = getattr(RequestBuilder,
-                                     'do_' + cli_args.request_action)
-        ResponseFormatter  = getattr(module, 'ClientResponseFormatter')
-        response_formatter = getattr(ResponseFormatter,
-                                     'do_' + cli_args.request_action)
+    def _get_keys(self, node):
+        """
+        Get the client and node key fingerprints.
+        """
 
-        request  = request_builder(cli_args, client)
         try:
-            keys     = (self._config['client']['privkey'], node['pubkey'])
+            return (self._config['client']['privkey'], node['pubkey'])
         except KeyError:
             print("Failed: no private key configured")
             sys.exit(1)
-        response = client.query(request, *keys)
 
-        result = response_formatter(cli_args, response)
+    def _get_module_handlers(self, module_name, action):
+        """
+        Get the request builder and response formatter for an action.
+        """
+
+        module             = modules.get_module(module_name)
+        RequestBuilder     = getattr(module, 'ClientRequestBuilder')
+        request_builder    = getattr(RequestBuilder, 'do_' + action)
+        ResponseFormatter  = getattr(module, 'ClientResponseFormatter')
+        response_formatter = getattr(ResponseFormatter, 'do_' + action)
+
+        return (request_builder, response_formatter)
+
+    def _get_requests(self, built):
+        """
+        Get the requests returned by a request builder.
+
+        Builders usually return a single request, but may return an iterable
+        of them (e.g. to split a large amount of input across several).
+        """
+
+        if isinstance(built, dict):
+            return [built]
+
+        return built
+
+    def _interpret_result(self, module_name, result):
+        """
+        Interpret the result of a response formatter.
+
+        Returns a tuple containing the exit status and the output to print.
+        """
 
         # len() raises TypeErrors on NoneType descendants
         try:
             items  = len(result)
         except TypeError:
-            print(self.RESPONSE_FORMATTER_ERROR %(cli_args.request_module))
-            sys.exit(69)
+            return (69, self.RESPONSE_FORMATTER_ERROR %(module_name))
 
         if isinstance(result, str) or items == 1:
-            print(result)
-            sys.exit(0)
+            return (0, result)
         elif items == 2:
-            print(result[1])
-            sys.exit(result[0])
+            return (result[0], result[1])
+        else:
+            return (69, self.RESPONSE_FORMATTER_ERROR %(module_name))
+
+    def init_subparser(subparser):
+
+        gpg_dir = os.path.join(os.getenv('HOME'), '.hypernova', 'gpg')
+        subparser.add_argument('--gpg-dir', dest='gpg_dir', default=gpg_dir)
+        subparser.add_argument('--parallel', type=int, default=16,
+                               help='maximum number of nodes to query at once')
+        subparser.add_argument('--timeout', type=float,
+                               help='seconds to wait for a node to accept the '
+                                    'connection, or for each part of its '
+                                    'response, before giving up on it')
+        subparser.add_argument('--format', dest='output_format',
+                               default='text', choices=['jsonl', 'text'])
+
+        subparser.add_argument('node', help='node name, glob or @group; '
+                                            'separate several with commas')
+
+        ClientRequestAction.init_module_subparsers(subparser)
+
+        return subparser
+
+    def init_module_subparsers(subparser):
+        """
+        Add a subparser for each module's actions.
+
+        The subparsers are lazy: a module is only imported, and its subparser
+        initialised, once it's been named on the command line.
+        """
+
+        subparser_factory = subparser.add_subparsers(
+                dest='request_module', parser_class=LazyArgumentParser)
+
+        for module in sorted(modules.MODULES):
+            ClientRequestAction._arg_parsers['request_' + module] = \
+                    subparser_factory.add_parser(module, init=functools.partial(
+                            ClientRequestAction.init_module_subparser, module))
+
+        return subparser
+
+    def init_module_subparser(module, module_subparser):
+        """
+        Initialise the subparser for a module's actions.
+        """
+
+        try:
+            Klass = getattr(modules.get_module(module), 'ClientRequestBuilder')
+        except AttributeError:
+            print('Error: module %s contains no interface definition'
+                  %(module), file=sys.stderr)
+            sys.exit(64)
+
+        module_subparser_factory = \
+                module_subparser.add_subparsers(dest='request_action')
+        Klass.init_subparser(module_subparser, module_subparser_factory)
+
+        return module_subparser
+
+
+class ClientBatchAction(ClientRequestAction):
+    """
+    Batch request action handler.
+
+    Reads a file of requests, one per line, and sends them all to the node in a
+    single batch. Each line is either a request as it would be given to the
+    request action (module, action and its arguments), or a JSON object with
+    action and parameters keys which is sent verbatim. Blank lines and those
+    beginning with # are ignored.
+    """
+
+    def __init__(self, cli_args, config_dir):
+
+        ClientActionBase.__init__(self, cli_args, config_dir)
+
+        node   = self._get_node(cli_args.node)
+        client = self._get_client(node, cli_args.gpg_dir)
+
+        line_parser = argparse.ArgumentParser(prog='batch')
+        ClientRequestAction.init_module_subparsers(line_parser)
+
+        if cli_args.file == '-':
+            lines = sys.stdin.readlines()
         else:
-            print(self.RESPONSE_FORMATTER_ERROR %(cli_args.request_module))
+            with open(cli_args.file, 'r') as f:
+                lines = f.readlines()
+
+        requests   = []
+        formatters = []
+        for line in lines:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+
+            if line.startswith('{'):
+                requests.append(json.loads(line))
+                formatters.append(None)
+                continue
+
+            line_args = line_parser.parse_args(shlex.split(line))
+            (request_builder, response_formatter) = \
+                    self._get_module_handlers(line_args.request_module,
+                                              line_args.request_action)
+            for request in self._get_requests(request_builder(line_args,
+                                                              client)):
+                requests.append(request)
+                formatters.append((line_args, response_formatter))
+
+        request = ClientRequestBuilderBase._format_batch_request(
+                requests, cli_args.parallel)
+        response = client.query(request, *self._get_keys(node))
+
+        try:
+            results = response['response']['results']
+        except (KeyError, TypeError):
+            print('Failed: the batch was rejected (%s)'
+                  %(response['status']['error_code']), file=sys.stderr)
             sys.exit(69)
 
+        exit_status = 0
+        for (request, formatter, result) in zip(requests, formatters, results):
+            if formatter:
+                (line_args, response_formatter) = formatter
+                (status, output) = self._interpret_result(
+                        line_args.request_module,
+                        response_formatter(line_args, result))
+            else:
+                status = 0 if result['status']['successful'] else 69
+                output = json.dumps(result)
+
+            if output:
+                print(output)
+            exit_status = max(exit_status, status)
+
+        sys.exit(exit_status)
 
     def init_subparser(subparser):
 
         gpg_dir = os.path.join(os.getenv('HOME'), '.hypernova', 'gpg')
         subparser.add_argument('--gpg-dir', dest='gpg_dir', default=gpg_dir)
+        subparser.add_argument('--parallel', action='store_true',
+                               help='allow the agent to run requests '
+                                    'concurrently')
 
         subparser.add_argument('node')
+        subparser.add_argument('file', help='file of requests, or - for stdin')
+
+        return subparser
 
-        subparser_factory = subparser.add_subparsers(dest='request_module')
 
-        for module in modules.__all__:
-            pymodule = getattr(modules, module)
+class ClientCompleteAction(ClientActionBase):
+    """
+    Shell completion action.
 
+    Prints the words which could complete the command line being typed, one
+    per line. The command line is read from the COMP_WORDS and COMP_CWORD
+    environment variables, as set by bash's programmable completion (see
+    etc/profile.d/hypernova.sh).
+
+    Describing every command means importing every module, so the description
+    (the command table) is cached in the configuration directory. It's rebuilt
+    only when the client or one of its modules is modified.
+    """
+
+    TABLE_FILE = 'commands.json'
+
+    def __init__(self, cli_args, config_dir):
+
+        super().__init__(cli_args, config_dir)
+
+        words = os.getenv('COMP_WORDS', '').split()
+        try:
+            current = int(os.getenv('COMP_CWORD', len(words)))
+        except ValueError:
+            current = len(words)
+
+        # The first word is the name of the client itself, and the word being
+        # completed is missing if it's empty
+        word = words[current] if current < len(words) else ''
+        tree = self._get_table()['commands']
+        for candidate in self._complete(tree, words[1:current], word):
+            print(candidate)
+
+    def _complete(self, tree, preceding, word):
+        """
+        Find the candidates for a word, given the words preceding it.
+        """
+
+        (node, position, option) = (tree, 0, None)
+
+        for w in preceding:
+            if option:
+                option = None
+            elif w.startswith('-'):
+                # Options which take a value are described by their choices
+                # (if any), flags by None
+                if node['options'].get(w) is not None:
+                    option = w
+            elif position < len(node['positionals']) \
+                    and node['positionals'][position][0] == node['commands_dest'] \
+                    and w in node['commands']:
+                (node, position) = (node['commands'][w], 0)
+            else:
+                position += 1
+
+        if option:
+            candidates = node['options'][option]
+        elif word.startswith('-'):
+            candidates = node['options'].keys()
+        elif position < len(node['positionals']):
+            (dest, candidates) = node['positionals'][position]
+            if dest == 'node':
+                candidates = self._get_node_candidates()
+        else:
+            candidates = []
+
+        return sorted(c for c in candidates if c.startswith(word))
+
+    def _get_node_candidates(self):
+        """
+        Get the names of the nodes and their groups.
+        """
+
+        candidates = set()
+        for name in self._servers.sections():
+            candidates.add(name)
+            for group in self._servers[name].get('groups', '').split(','):
+                if group.strip():
+                    candidates.add('@' + group.strip())
+
+        return candidates
+
+    def _get_table(self):
+        """
+        Get the command table, rebuilding it if it's stale.
+        """
+
+        path   = os.path.join(self._config_dir, self.TABLE_FILE)
+        mtimes = ClientCompleteAction._get_source_mtimes()
+
+        try:
+            with open(path, 'r') as f:
+                table = json.load(f)
+            if table['mtimes'] == mtimes:
+                return table
+        except (IOError, ValueError, KeyError, TypeError):
+            pass
+
+        table = {
+            'mtimes':   mtimes,
+            'commands': ClientCompleteAction._describe_parser(
+                    SimpleClientInterface.build_parser()),
+        }
+
+        # Failing to cache the table only makes the next completion slower
+        try:
+            (fd, temp_path) = tempfile.mkstemp(prefix='.commands.',
+                                               dir=self._config_dir)
+            with os.fdopen(fd, 'w') as f:
+                json.dump(table, f)
+            os.rename(temp_path, path)
+        except (IOError, OSError):
+            pass
+
+        return table
+
+    def _get_source_mtimes():
+        """
+        Get the modification times of the client and its modules, keyed by
+        path.
+        """
+
+        # Modules live alongside the package's __init__, one file apiece
+        module_dir = os.path.dirname(modules.__file__)
+        paths      = [__file__] + [os.path.join(module_dir, name + '.py')
+                                   for name in sorted(modules.MODULES)]
+
+        mtimes = {}
+        for path in paths:
             try:
-                Klass = getattr(pymodule, 'ClientRequestBuilder')
-                ClientRequestAction._arg_parsers['request_' + module] = \
-                    module_subparser = subparser_factory.add_parser(module)
-                module_subparser_factory = \
-                        module_subparser.add_subparsers(dest='request_action')
-                Klass.init_subparser(module_subparser, module_subparser_factory)
+                mtimes[path] = os.stat(path).st_mtime
+            except OSError:
+                mtimes[path] = None
 
-            except AttributeError:
-                print('Error: module %s contains no interface definition'
-                      %(module), file=sys.stderr)
+        return mtimes
 
-        return subparser
+    def _describe_parser(parser):
+        """
+        Describe a parser's options, positional arguments and commands (i.e.
+        subparsers), and those of its subparsers, as the command table.
+        """
+
+        if isinstance(parser, LazyArgumentParser):
+            parser.initialise()
+
+        tree = {
+            'options':       {},
+            'positionals':   [],
+            'commands':      {},
+            'commands_dest': None,
+        }
+
+        # argparse offers no public means of listing a parser's arguments
+        for action in parser._actions:
+            choices = list(action.choices or [])
+
+            if action.option_strings:
+                for option in action.option_strings:
+                    tree['options'][option] = None if action.nargs == 0 \
+                                                   else choices
+            elif action.nargs == argparse.PARSER:
+                tree['commands'] = dict(
+                        (name, ClientCompleteAction._describe_parser(sp))
+                        for (name, sp) in action.choices.items())
+                tree['commands_dest'] = action.dest
+                tree['positionals'].append([action.dest, sorted(choices)])
+            else:
+                tree['positionals'].append([action.dest, choices])
+
+        return tree
 
 
 class SimpleClientInterface:
@@ -260,8 +780,10 @@ class SimpleClientInterface:
     """
 
     actions = {
-        'config':  ClientConfigAction,
-        'request': ClientRequestAction,
+        'batch':    ClientBatchAction,
+        'complete': ClientCompleteAction,
+        'config':   ClientConfigAction,
+        'request':  ClientRequestAction,
     }
 
     _arg_parsers = {}
@@ -272,26 +794,55 @@ class SimpleClientInterface:
     _config_file  = ''
     _servers_file = ''
 
+    PROFILE_FMT = "Startup profile:\n* Imports: %.1fms\n" \
+                  "* Configuration: %.1fms\n* Argument parsing: %.1fms\n" \
+                  "* Modules: %s\n* Total: %.1fms"
+
     def __init__(self, config_dir=None):
         """
         Perform the action.
         """
 
+        self._timings = [('imports', time.time())]
+
         if config_dir:
             self._config_dir = os.path.abspath(config_dir)
         else:
             self._config_dir = os.path.join(os.getenv('HOME'), '.hypernova')
 
         self._init_config()
+        self._timings.append(('config', time.time()))
+
         self._parse_args()
+        self._timings.append(('args', time.time()))
 
     def execute(self):
         """
         Run the action.
         """
 
+        if self.args.profile_startup:
+            self._print_startup_profile()
+
         self.actions[self.args.action](self.args, self._config_dir)
 
+    def _print_startup_profile(self):
+        """
+        Print the time taken by each stage of startup, from the moment the
+        client began importing its dependencies, to stderr.
+        """
+
+        stages = [STARTED] + [t for (stage, t) in self._timings]
+        (imports, config, args) = [(b - a) * 1000
+                                   for (a, b) in zip(stages, stages[1:])]
+
+        loaded = ', '.join('%s %.1fms' %(name, t * 1000)
+                           for (name, t) in sorted(modules.load_times.items()))
+
+        print(self.PROFILE_FMT %(imports, config, args, loaded or 'none',
+                                 (stages[-1] - STARTED) * 1000),
+              file=sys.stderr)
+
     def _init_config(self):
         """
         Load the client's configuration.
@@ -338,15 +889,32 @@ class SimpleClientInterface:
         Parse arguments.
         """
 
-        self._arg_parsers['__main__'] = argparse.ArgumentParser(
+        self.args = SimpleClientInterface.build_parser().parse_args()
+
+    def build_parser():
+        """
+        Build the argument parser.
+
+        Only the subparsers for the chosen action (and for request, the chosen
+        module) are initialised, when argparse reaches them, so parsing a
+        command imports at most the one module it names.
+        """
+
+        arg_parsers = SimpleClientInterface._arg_parsers
+
+        arg_parsers['__main__'] = argparse.ArgumentParser(
                 description='command line client for the HyperNova agent')
-        self.subparser_factory = self._arg_parsers['__main__'].add_subparsers(dest='action')
+        arg_parsers['__main__'].add_argument(
+                '--profile-startup', dest='profile_startup',
+                action='store_true', help='print the time taken to start up')
+        subparser_factory = arg_parsers['__main__'].add_subparsers(
+                dest='action', parser_class=LazyArgumentParser)
 
-        for (action, Klass) in self.actions.items():
-            self._arg_parsers[action] = self.subparser_factory.add_parser(action)
-            Klass.init_subparser(self._arg_parsers[action])
+        for (action, Klass) in sorted(SimpleClientInterface.actions.items()):
+            arg_parsers[action] = subparser_factory.add_parser(
+                    action, init=Klass.init_subparser)
 
-        self.args = self._arg_parsers['__main__'].parse_args()
+        return arg_parsers['__main__']
 
 
 if __name__ == '__main__':
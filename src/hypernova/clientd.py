@@ -0,0 +1,265 @@
+#!/usr/bin/env python3.2
+
+#
+# HyperNova server management framework
+#
+# Client daemon
+#
+# Copyright (c) 2012 TDM Ltd
+#                    Luke Carrier <luke.carrier@tdm.info>
+#
+
+"""
+Keeps a client running in the background, serving commands forwarded by the
+thin front end (see hypernova.thinclient) over a Unix socket in the client's
+configuration directory.
+
+Whatever the client would otherwise set up afresh for each command is kept
+warm between them: the imported modules, the GPG instances and session state
+held by the security filters, and pooled connections to the agents. The
+configuration is re-read for every command.
+
+Commands are run one at a time, since they share the process's working
+directory, environment and standard streams. A request to several nodes is
+still sent to them in parallel.
+"""
+
+import argparse
+from hypernova import client, thinclient
+from hypernova.libraries.configuration import ConfigurationFactory
+from hypernova.libraries.proc import daemonise
+import io
+import json
+import os
+import signal
+import socket
+import socketserver
+import sys
+import time
+import traceback
+
+class ClientDaemonStream(io.TextIOBase):
+    """
+    Text stream which sends whatever's written to it to the front end.
+
+    Output is buffered until the stream is flushed, or until BUFFER_SIZE
+    characters have been written.
+    """
+
+    BUFFER_SIZE = 8192
+
+    def __init__(self, wfile, name):
+        """
+        Initialise values.
+        """
+
+        self._wfile  = wfile
+        self._name   = name
+        self._buffer = []
+        self._size   = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._buffer.append(data)
+        self._size += len(data)
+
+        if self._size >= self.BUFFER_SIZE:
+            self.flush()
+
+        return len(data)
+
+    def flush(self):
+        if self._buffer:
+            frame = json.dumps({
+                'stream': self._name,
+                'data':   ''.join(self._buffer),
+            })
+            (self._buffer, self._size) = ([], 0)
+
+            self._wfile.write(bytes(frame + "\n", 'UTF-8'))
+
+        self._wfile.flush()
+
+
+class ClientDaemonRequestHandler(socketserver.StreamRequestHandler):
+    """
+    Runs a command sent by the front end.
+
+    The command is sent as a single line of JSON, containing the arguments
+    and the front end's working directory and environment. Its output is sent
+    back as lines of JSON, each containing the name of a stream and some data,
+    followed by a line containing the exit status.
+    """
+
+    def handle(self):
+        try:
+            request = json.loads(str(self.rfile.readline(), 'UTF-8'))
+            (argv, cwd, env) = (list(request['argv']), request['cwd'],
+                                dict(request['env']))
+        except (ValueError, KeyError, TypeError):
+            return
+
+        stdout = ClientDaemonStream(self.wfile, 'stdout')
+        stderr = ClientDaemonStream(self.wfile, 'stderr')
+
+        # The front end may have gone away (e.g. the user pressed ^C)
+        try:
+            status = self.server.run_command(argv, cwd, env, stdout, stderr)
+
+            stdout.flush()
+            stderr.flush()
+            self.wfile.write(bytes(json.dumps({'exit': status}) + "\n",
+                                   'UTF-8'))
+        except (IOError, socket.error):
+            pass
+
+
+class ClientDaemon(socketserver.UnixStreamServer):
+    """
+    Client daemon server.
+    """
+
+    # Names of the configurations loaded by the client
+    CONFIGS = ['hypernova', 'hypernova.servers']
+
+    def __init__(self, config_dir):
+        """
+        Listen on the socket in the configuration directory.
+
+        The socket is only accessible to the user running the daemon.
+        """
+
+        self.config_dir  = config_dir
+        self.socket_path = os.path.join(config_dir, thinclient.SOCKET_FILE)
+
+        self._rm_stale_socket()
+
+        umask = os.umask(0o177)
+        try:
+            super().__init__(self.socket_path, ClientDaemonRequestHandler)
+        finally:
+            os.umask(umask)
+
+    def _rm_stale_socket(self):
+        """
+        Remove the socket left behind by a daemon which didn't exit cleanly.
+
+        Raises ClientDaemonRunningError if another daemon is listening on it.
+        """
+
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.socket_path)
+        except socket.error:
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+        else:
+            raise ClientDaemonRunningError()
+        finally:
+            sock.close()
+
+    def run_command(self, argv, cwd, env, stdout, stderr):
+        """
+        Run a command as though it were given on the command line, in the
+        specified working directory and environment, and writing to the
+        specified streams.
+
+        Returns the command's exit status.
+        """
+
+        saved     = (sys.argv, sys.stdin, sys.stdout, sys.stderr)
+        saved_env = dict(os.environ)
+
+        # Pick up any changes made to the configuration since the last command
+        for name in self.CONFIGS:
+            ConfigurationFactory.published.pop(name, None)
+
+        # Everything was imported long ago
+        client.STARTED = time.time()
+
+        try:
+            (sys.argv, sys.stdin, sys.stdout, sys.stderr) = \
+                    (['hn-client'] + argv, io.StringIO(), stdout, stderr)
+
+            os.chdir(cwd)
+            os.environ.clear()
+            os.environ.update(env)
+
+            client.SimpleClientInterface(self.config_dir).execute()
+            status = 0
+        except SystemExit as e:
+            status = self._get_exit_status(e.code)
+        except Exception:
+            traceback.print_exc()
+            status = 1
+        finally:
+            (sys.argv, sys.stdin, sys.stdout, sys.stderr) = saved
+            os.chdir('/')
+            os.environ.clear()
+            os.environ.update(saved_env)
+
+        return status
+
+    def _get_exit_status(self, code):
+        """
+        Get the exit status for a SystemExit code, as the interpreter would.
+        """
+
+        if code is None:
+            return 0
+        elif isinstance(code, int):
+            return code
+
+        print(code, file=sys.stderr)
+        return 1
+
+    def serve(self, detach=False):
+        """
+        Serve commands until terminated, removing the socket on exit.
+        """
+
+        if detach:
+            daemonise(keep_fds=[self.fileno()])
+
+        # Treat termination as an interrupt, so the socket is removed
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+
+        try:
+            self.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.server_close()
+            os.unlink(self.socket_path)
+
+
+class ClientDaemonRunningError(Exception):
+    """
+    Another daemon is already serving the configuration directory.
+    """
+
+    pass
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+            description='client daemon for the HyperNova agent')
+    parser.add_argument('-d', '--detach', action='store_true',
+                        help='detach from the terminal')
+    args = parser.parse_args()
+
+    config_dir = thinclient.get_config_dir()
+    if not os.path.isdir(config_dir):
+        print('Failed: %s does not exist; run hn-client to create it'
+              %(config_dir), file=sys.stderr)
+        sys.exit(78)
+
+    try:
+        server = ClientDaemon(config_dir)
+    except ClientDaemonRunningError:
+        print('Failed: a client daemon is already running', file=sys.stderr)
+        sys.exit(64)
+
+    server.serve(args.detach)
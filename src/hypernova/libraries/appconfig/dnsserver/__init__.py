@@ -9,6 +9,16 @@
 #                    Luke Carrier <luke.carrier@tdm.info>
 #
 
+from collections import Counter, OrderedDict
+import datetime
+import threading
+
+# Server instances, keyed by adapter name and arguments
+#
+# See get_authoritative_server().
+_servers      = {}
+_servers_lock = threading.Lock()
+
 class ServerBase:
     """
     DNS server base class.
@@ -24,6 +34,18 @@ class ServerBase:
 
         self._not_implemented()
 
+    def get_zone_page(self, domain, filters=None, after=None, limit=None):
+        """
+        Find a zone, populating its records attribute with only those records
+        matching the filters.
+
+        See Zone.page() for details of the arguments and the return value.
+        Adapters should override this to perform the filtering in the server
+        where they can; the default implementation retrieves the whole zone.
+        """
+
+        return self.get_zone(domain).page(filters, after, limit)
+
     def _not_implemented(self):
         """
         Feature not implemented.
@@ -55,6 +77,29 @@ class AuthoritativeServerBase(ServerBase):
 
         self._not_implemented()
 
+    def begin_changes(self, zone):
+        """
+        Begin a set of changes to a zone's records.
+
+        Returns a ChangeSet; records added to and removed from it are written
+        to the server together when it's committed.
+        """
+
+        return ChangeSet(self, zone)
+
+    def commit_changes(self, changes):
+        """
+        Apply a set of changes, as returned by begin_changes().
+
+        Removals are applied before additions, and the zone's SOA serial is
+        bumped (see next_serial()) once for the whole set. The removed records
+        and the new serial are stored in the change set's removed and serial
+        attributes, and the serial returned. Adapters should apply the changes
+        atomically.
+        """
+
+        self._not_implemented()
+
     def add_zone(self, zone):
         """
         Add a zone.
@@ -73,6 +118,27 @@ class AuthoritativeServerBase(ServerBase):
 
         self._not_implemented()
 
+    def rm_records(self, zone, filters):
+        """
+        Remove all records matching the filters, returning them.
+
+        filters may contain an id, a name, an rtype and content, all of which
+        must match exactly. SOA records are never removed. Adapters should override
+        this to remove the records atomically; the default implementation
+        retrieves the whole zone and removes the matching records one by one.
+        """
+
+        if isinstance(zone, str):
+            zone = self.get_zone(zone)
+        else:
+            zone = self.get_zone(zone.domain)
+
+        records = zone.find(**filters)
+        for r in records:
+            self.rm_record(zone, r)
+
+        return records
+
     def rm_soa_record(self, zone, record):
         """
         Remove an SOA record.
@@ -87,9 +153,106 @@ class AuthoritativeServerBase(ServerBase):
 
         self._not_implemented()
 
+    def import_zone(self, zone, replace=False):
+        """
+        Add a zone along with its SOA record and all of its records.
+
+        If replace is set, an existing zone with the same domain has all of its
+        records replaced; otherwise DuplicateZoneError is raised. Adapters
+        should apply the changes atomically.
+        """
+
+        self._not_implemented()
+
+class ChangeSet:
+    """
+    Set of changes to a zone's records.
+
+    See AuthoritativeServerBase.begin_changes() for details.
+    """
+
+    def __init__(self, server, zone):
+        """
+        Initialise values.
+        """
+
+        self.server = server
+        self.domain = zone if isinstance(zone, str) else zone.domain
+
+        # Records to add, filters (as for rm_records()) to remove, and the
+        # records the zone should be left with (see sync_records())
+        self.additions = []
+        self.removals  = []
+        self.desired   = None
+
+        # Results, populated on commit
+        self.removed = []
+        self.serial  = None
+
+    def add_record(self, record):
+        """
+        Add a record.
+        """
+
+        self.additions.append(record)
+
+    def rm_records(self, filters):
+        """
+        Remove all records matching the filters.
+        """
+
+        self.removals.append(filters)
+
+    def sync_records(self, records):
+        """
+        Bring the zone's records into line with records, once any other
+        changes have been applied.
+
+        Only the records which differ are removed and added. The difference is
+        found by the adapter as the change set is committed, against the zone
+        as it stands within the same transaction (or lock), so no change made
+        in the meantime can be duplicated or lost. Once committed, the records
+        removed and added are included in removed and additions.
+        """
+
+        self.desired = list(records)
+
+    def diff(self, current):
+        """
+        Find the records to remove from, and add to, a zone's current records
+        to bring them into line with those passed to sync_records().
+
+        For use by adapters' commit_changes(). Returns a tuple containing the
+        records to remove and those to add, having included them in removed
+        and additions.
+        """
+
+        if self.desired is None:
+            return ([], [])
+
+        (removals, additions) = diff_records(current, self.desired)
+        self.removed.extend(removals)
+        self.additions.extend(additions)
+
+        return (removals, additions)
+
+    def commit(self):
+        """
+        Apply the changes, returning the zone's new serial.
+        """
+
+        return self.server.commit_changes(self)
+
+
 class Zone:
     """
     DNS zone.
+
+    Records are indexed by name, by name and type, by content and by ID, so
+    that lookups with find() don't have to scan the whole zone. The indexes are
+    maintained by add_record() and rm_record(); records must not be renamed or
+    otherwise have their indexed attributes changed while they're part of a
+    zone.
     """
 
     # Domain name
@@ -102,11 +265,8 @@ class Zone:
     # SOA
     soa_record = None
 
-    # Resource records
-    records = []
-
     def __init__(self, new_domain=None, new_ttl=None, new_origin=None,
-                 new_soa_record=None, new_records=[]):
+                 new_soa_record=None, new_records=None):
         """
         Initialise values.
         """
@@ -115,23 +275,183 @@ class Zone:
         self.ttl        = new_ttl
         self.origin     = new_origin
         self.soa_record = new_soa_record
-        self.records    = new_records
+        self.records    = new_records or []
 
-    def filter_records_for(self, filters):
+    def from_encodable(encodable):
         """
-        Filter associated records for matches.
+        Rebuild a zone from the representation returned by to_encodable().
+        """
+
+        soa_record = encodable.get('soa_record')
+        if soa_record is not None:
+            soa_record = SoaRecord(**dict(('new_%s' %(k), v)
+                                          for (k, v) in soa_record.items()))
+
+        records = [Record(**dict(('new_%s' %(k), v) for (k, v) in r.items()))
+                   for r in encodable.get('records', [])]
+
+        return Zone(encodable['domain'], encodable.get('ttl'),
+                    encodable.get('origin'), soa_record, records)
+
+    def _get_records(self):
+        """
+        Get all associated records, in the order they were added.
         """
 
-        def matches(record):
-            for key, value in filters.items():
-                if getattr(record, key) != value:
-                    return False
+        return list(self._records.values())
+
+    def _set_records(self, records):
+        """
+        Replace all associated records.
+        """
 
-            return True
+        # Records keyed by identity, so that they can be removed in constant
+        # time without losing their order
+        self._records = OrderedDict()
 
-        matches.filters = filters
+        self._by_name      = {}
+        self._by_name_type = {}
+        self._by_content   = {}
+        self._by_id        = {}
 
-        return list(r for r in self.records if matches(r))
+        for record in records:
+            self.add_record(record)
+
+    records = property(_get_records, _set_records)
+
+    def __iter__(self):
+        """
+        Iterate over all associated records, in the order they were added.
+
+        Unlike records, this doesn't copy them, so the zone mustn't be changed
+        during iteration.
+        """
+
+        return iter(self._records.values())
+
+    def __len__(self):
+        """
+        Count the associated records.
+        """
+
+        return len(self._records)
+
+    def _indexes(self, record):
+        """
+        Get the indexes a record belongs in, along with its key in each.
+        """
+
+        return ((self._by_name,      record.name),
+                (self._by_name_type, (record.name, record.rtype)),
+                (self._by_content,   record.content))
+
+    def add_record(self, record):
+        """
+        Associate a record with the zone.
+        """
+
+        self._records[id(record)] = record
+        for (index, key) in self._indexes(record):
+            index.setdefault(key, []).append(record)
+
+        if record.id is not None:
+            self._by_id[record.id] = record
+
+    def rm_record(self, record):
+        """
+        Disassociate a record from the zone.
+
+        Raises KeyError if the record isn't associated with the zone.
+        """
+
+        del self._records[id(record)]
+        for (index, key) in self._indexes(record):
+            matches = index[key]
+            matches.remove(record)
+            if not matches:
+                del index[key]
+
+        if self._by_id.get(record.id) is record:
+            del self._by_id[record.id]
+
+    def find(self, **filters):
+        """
+        Find associated records with the specified attribute values.
+
+        Lookups by ID, name (and optionally type) or content use the indexes;
+        any remaining filters are then applied to the matching records.
+        """
+
+        if 'rtype' in filters:
+            filters['rtype'] = Record.get_type_index(filters['rtype'])
+
+        if 'id' in filters:
+            records = [self._by_id[filters['id']]] \
+                      if filters['id'] in self._by_id else []
+        elif 'name' in filters and 'rtype' in filters:
+            records = self._by_name_type.get((filters['name'],
+                                              filters['rtype']), [])
+        elif 'name' in filters:
+            records = self._by_name.get(filters['name'], [])
+        elif 'content' in filters:
+            records = self._by_content.get(filters['content'], [])
+        else:
+            records = self._records.values()
+
+        return [r for r in records
+                if all(getattr(r, k) == v for (k, v) in filters.items())]
+
+    def page(self, filters=None, after=None, limit=None):
+        """
+        Get a page of records matching the filters.
+
+        filters may contain a name, an rtype and a content prefix. Records are
+        returned in order of their IDs, starting after the ID in after, and at
+        most limit are returned. Returns a tuple containing a copy of the zone
+        with only the matching records, and the cursor to pass as after to get
+        the next page (None if this is the last).
+
+        Records which haven't been stored have no ID. If any of them match,
+        the records are paged through in the order they were added instead,
+        and the cursor is the number of records preceding the next page.
+        """
+
+        filters = dict(filters or {})
+        prefix  = filters.pop('content', None)
+
+        records = self.find(**filters)
+        if prefix:
+            records = [r for r in records if r.content.startswith(prefix)]
+
+        by_id = all(r.id is not None for r in records)
+        if by_id:
+            records.sort(key=lambda r: r.id)
+            if after is not None:
+                records = [r for r in records if r.id > after]
+            offset = 0
+        else:
+            offset  = after or 0
+            records = records[offset:]
+
+        cursor = None
+        if limit is not None and len(records) > limit:
+            records = records[:limit]
+            cursor  = records[-1].id if by_id else offset + limit
+
+        zone = Zone(self.domain, self.ttl, self.origin, self.soa_record,
+                    records)
+        zone.id = getattr(self, 'id', None)
+
+        return (zone, cursor)
+
+    def filter_records_for(self, filters):
+        """
+        Filter associated records for matches.
+
+        See find() for details.
+        """
+
+        return self.find(**filters)
 
     def to_encodable(self):
         """
@@ -146,14 +466,24 @@ class Zone:
             'domain':     self.domain,
             'ttl':        self.ttl,
             'origin':     self.origin,
-            'soa_record': self.soa_record.to_encodable(),
-            'records':    [r.to_encodable() for r in self.records],
+            'soa_record': self.soa_record and self.soa_record.to_encodable(),
+            'records':    [r.to_encodable() for r in self._records.values()],
         }
 
 
 class Record:
     """
     DNS record.
+
+    Zones may contain a great many records, so attributes are held in slots
+    rather than a per-instance dictionary. The attributes are:
+
+      * name: the fully qualified name of the record
+      * rtype: the record type, as an index into RECORD_TYPES
+      * content: the record data
+      * ttl: the time to live, in seconds
+      * priority: the priority of MX and SRV records, None otherwise
+      * id: the server's identifier for the record, if it has been stored
     """
 
     # Resource record types
@@ -164,31 +494,36 @@ class Record:
         'mx',
         'soa',
         'txt',
+        'ns',
+        'ptr',
+        'srv',
     ]
 
-    # All records
-    name    = ''
-    rtype   = 0
-    content = ''
-    ttl     = 0
-
-    # MX records only
-    priority = None
+    __slots__ = ('name', 'rtype', 'content', 'ttl', 'priority', 'id')
 
     def __init__(self, new_name='', new_rtype=None, new_content=None, new_ttl=0,
-                 new_priority=None):
+                 new_priority=None, new_id=None):
         """
         Initialise values.
         """
 
-        if isinstance(new_rtype, str):
-            rtype = Record.RECORD_TYPES.index(new_rtype.lower())
-
         self.name     = new_name
-        self.rtype    = new_rtype
+        self.rtype    = Record.get_type_index(new_rtype)
         self.content  = new_content
         self.ttl      = new_ttl
         self.priority = new_priority
+        self.id       = new_id
+
+    def get_type_index(rtype):
+        """
+        Normalise a record type, which may be given by name, to its index in
+        RECORD_TYPES.
+        """
+
+        if isinstance(rtype, str):
+            rtype = Record.RECORD_TYPES.index(rtype.lower())
+
+        return rtype
 
     def to_encodable(self):
         """
@@ -201,33 +536,26 @@ class Record:
             'content':  self.content,
             'ttl':      self.ttl,
             'priority': self.priority,
+            'id':       self.id,
         }
 
 
 class SoaRecord:
     """
     SOA (start of authority) record.
+
+    Attributes are held in slots, like those of Record. They are:
+
+      * primary_ns: the hostname of the primary nameserver (the MNAME field);
+        this must always be set as the primary nameserver for the zone (the
+        only server upon which the records are modified)
+      * responsible_person: the email address of the person or group
+        immediately responsible for the technical administration of the zone
+      * serial, refresh, retry, expire and min_ttl: parameters
     """
 
-    # Hostname of primary nameserver.
-    #
-    # The MNAME field of a record; this must always must be set as the primary
-    # nameserver for the zone (the only server upon which the records are
-    # modified).
-    primary_ns = ''
-
-    # Support contact.
-    #
-    # The email address of the person or group immediately responsible for the
-    # technical administration of the zone.
-    responsible_person = ''
-
-    # Parameters
-    serial  = 0
-    refresh = 0
-    retry   = 0
-    expire  = 0
-    min_ttl = 0
+    __slots__ = ('primary_ns', 'responsible_person', 'serial', 'refresh',
+                 'retry', 'expire', 'min_ttl')
 
     def __init__(self, new_primary_ns='', new_responsible_person='',
                  new_serial=0, new_refresh=0, new_retry=0, new_expire=0,
@@ -304,13 +632,87 @@ class ServerCommunicationError(Exception):
     pass
 
 
+def diff_records(current, desired):
+    """
+    Compare two sets of records.
+
+    Returns a tuple containing the records in current which aren't in desired,
+    and those in desired which aren't in current. Records are compared by value
+    (name, type, content, TTL and priority) using a hash of each, so this takes
+    linear time; duplicate records are counted.
+    """
+
+    def key(record):
+        return (record.name, record.rtype, record.content, int(record.ttl or 0),
+                record.priority)
+
+    wanted  = Counter(key(r) for r in desired)
+    present = Counter(key(r) for r in current)
+
+    removals = []
+    for r in current:
+        k = key(r)
+        if wanted[k]:
+            wanted[k] -= 1
+        else:
+            removals.append(r)
+
+    additions = []
+    for r in desired:
+        k = key(r)
+        if present[k]:
+            present[k] -= 1
+        else:
+            additions.append(r)
+
+    return (removals, additions)
+
+def next_serial(serial, today=None):
+    """
+    Get the SOA serial to follow serial after a change to a zone.
+
+    Serials take the conventional YYYYMMDDnn form, where nn is incremented for
+    each change made in a day. Serials already ahead of (or not in) this form
+    are simply incremented.
+    """
+
+    if today is None:
+        today = datetime.date.today()
+
+    return max(int(serial) + 1, int(today.strftime('%Y%m%d')) * 100)
+
 def get_authoritative_server(adapter, *args, **kwargs):
     """
     Get a DNS server by its adapter name, and initialise it with the arguments
     in args.
+
+    Servers are cached: all callers passing the same adapter name and arguments
+    share a single instance for the life of the process, so adapters must be
+    thread safe.
+
+    If a non-zero cache_ttl keyword argument is given, the server is wrapped in
+    a CachingAuthoritativeServer which caches zones for that many seconds, up to
+    a total of cache_size records.
     """
 
-    module_name = "hypernova.libraries.appconfig.dnsserver.%s" %(adapter)
-    module = __import__(module_name, fromlist=['AuthoritativeServer'])
-    Klass = getattr(module, 'AuthoritativeServer')
-    return Klass(*args, **kwargs)
+    key = (adapter, args, tuple(sorted(kwargs.items())))
+
+    with _servers_lock:
+        if key not in _servers:
+            cache_ttl  = int(kwargs.pop('cache_ttl', 0))
+            cache_size = int(kwargs.pop('cache_size', 100000))
+
+            module_name = "hypernova.libraries.appconfig.dnsserver.%s" %(adapter)
+            module = __import__(module_name, fromlist=['AuthoritativeServer'])
+            Klass = getattr(module, 'AuthoritativeServer')
+            server = Klass(*args, **kwargs)
+
+            if cache_ttl:
+                from hypernova.libraries.appconfig.dnsserver.cache import \
+                        CachingAuthoritativeServer, ZoneCache
+                server = CachingAuthoritativeServer(
+                        server, ZoneCache(cache_size, cache_ttl))
+
+            _servers[key] = server
+
+        return _servers[key]
@@ -0,0 +1,389 @@
+#!/usr/bin/env python3.2
+
+#
+# HyperNova server management framework
+#
+# BIND (master file) adapter for DNS management
+#
+# Copyright (c) 2012 TDM Ltd
+#                    Luke Carrier <luke.carrier@tdm.info>
+#
+
+"""
+A DNS server backed by a directory of RFC 1035 master files, one per zone, as
+served by BIND (or NSD, or PowerDNS's bind backend).
+
+A few things:
+
+  * Zones are parsed once and kept in memory, so edits don't require a full
+    re-parse. The file is re-read only if its modification time changes, i.e.
+    if somebody edits it by hand.
+  * Files are replaced atomically: the zone is written to a temporary file in
+    the same directory, which is then renamed over the original. The server
+    never sees a half-written zone.
+  * If write_delay is set, edits made within that many seconds of each other
+    are written (and the server reloaded) together. Until then, they're only
+    visible through this adapter.
+  * reload_command is run after each write, with %(domain)s replaced by the
+    domain of the zone, e.g. "rndc reload %(domain)s".
+  * Comments and the formatting of hand-written files are not preserved.
+"""
+
+from hypernova.libraries.appconfig import dnsserver as dns
+from hypernova.libraries.appconfig.dnsserver import zonefile
+import errno
+import itertools
+import os
+import shlex
+import subprocess
+import tempfile
+import threading
+
+class AuthoritativeServer(dns.AuthoritativeServerBase):
+
+    # Name of the file containing each zone, relative to zone_dir
+    FILE_NAME = '%s.zone'
+
+    def __init__(self, zone_dir, reload_command=None, write_delay=0):
+        """
+        Initialise values.
+        """
+
+        self.zone_dir       = zone_dir
+        self.reload_command = reload_command
+        self.write_delay    = float(write_delay)
+
+        # (zone, file modification time) tuples, keyed by domain, and the
+        # domains with changes yet to be written
+        self._zones = {}
+        self._dirty = set()
+        self._timer = None
+
+        self._lock       = threading.RLock()
+        self._record_ids = itertools.count(1)
+
+    def _path(self, domain):
+        """
+        Get the path to the file containing a zone.
+        """
+
+        if not domain or '/' in domain or domain.startswith('.'):
+            raise dns.InvalidZoneError('invalid domain %s' %(domain))
+
+        return os.path.join(self.zone_dir, self.FILE_NAME %(domain))
+
+    def _domain(self, zone):
+        """
+        Get the domain of a zone, given a Zone object or a domain.
+        """
+
+        return zone if isinstance(zone, str) else zone.domain
+
+    def _get_zone(self, zone):
+        """
+        Get the stored zone for a domain or Zone object, reading its file if
+        it isn't in memory or has been changed by something else.
+
+        Must be called with the lock held.
+        """
+
+        domain = self._domain(zone)
+        path   = self._path(domain)
+        cached = self._zones.get(domain)
+
+        # Changes not yet written take precedence over the file
+        if cached and domain in self._dirty:
+            return cached[0]
+
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise dns.ServerCommunicationError(str(e))
+
+            self._zones.pop(domain, None)
+            self._dirty.discard(domain)
+            raise dns.NonexistentZoneError()
+
+        if cached and cached[1] == mtime:
+            return cached[0]
+
+        with open(path) as f:
+            stored = zonefile.parse(f.read(), domain)
+        stored.records = [self._copy_record(r, stored) for r in stored.records]
+        stored.id = domain
+
+        self._zones[domain] = (stored, mtime)
+        return stored
+
+    def _copy_record(self, record, zone):
+        """
+        Copy a record to be stored in a zone, assigning it an ID.
+
+        IDs are only unique for the life of the process. Records without a TTL
+        are given the zone's default, just as they would be were the file read
+        back, so that what's in memory matches what's on disk.
+        """
+
+        ttl = record.ttl
+        if ttl is None:
+            ttl = zone.ttl if zone.ttl is not None else zone.soa_record.min_ttl
+
+        return dns.Record(record.name, record.rtype, record.content, ttl,
+                          record.priority, next(self._record_ids))
+
+    def _store_zone(self, zone):
+        """
+        Store a new copy of a zone, to be written.
+
+        Must be called with the lock held.
+        """
+
+        if not zone.soa_record:
+            raise dns.InvalidZoneError('no SOA record')
+
+        stored = dns.Zone(zone.domain, zone.ttl, zone.origin, zone.soa_record,
+                          [self._copy_record(r, zone) for r in zone.records])
+        stored.id = zone.id = zone.domain
+
+        self._zones[zone.domain] = (stored, None)
+        self._changed(zone.domain)
+
+    def _changed(self, domain):
+        """
+        Write a changed zone, immediately or after the write delay.
+
+        Must be called with the lock held.
+        """
+
+        self._dirty.add(domain)
+
+        if not self.write_delay:
+            self.flush()
+        elif not self._timer:
+            self._timer = threading.Timer(self.write_delay, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def flush(self):
+        """
+        Write all changed zones, and reload the server.
+        """
+
+        with self._lock:
+            if self._timer:
+                self._timer.cancel()
+                self._timer = None
+
+            (dirty, self._dirty) = (self._dirty, set())
+            for domain in sorted(dirty):
+                if domain in self._zones:
+                    self._write(domain)
+
+        for domain in sorted(dirty):
+            self._reload(domain)
+
+    def _write(self, domain):
+        """
+        Atomically replace a zone's file.
+
+        Must be called with the lock held.
+        """
+
+        path = self._path(domain)
+        zone = self._zones[domain][0]
+
+        (fd, temp_path) = tempfile.mkstemp(prefix='.%s.' %(domain),
+                                           dir=self.zone_dir)
+        try:
+            with os.fdopen(fd, 'w') as f:
+                for line in zonefile.render(zone):
+                    f.write(line + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+            os.chmod(temp_path, 0o644)
+            os.rename(temp_path, path)
+        except:
+            os.unlink(temp_path)
+            raise
+
+        self._zones[domain] = (zone, os.stat(path).st_mtime)
+
+    def _reload(self, domain):
+        """
+        Run the reload command, if there is one.
+        """
+
+        if not self.reload_command:
+            return
+
+        cmd = shlex.split(self.reload_command %{'domain': domain})
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE)
+        (stdout, stderr) = proc.communicate()
+
+        if proc.returncode != 0:
+            raise dns.ServerCommunicationError(
+                    stderr.decode(errors='replace').strip())
+
+    def add_record(self, zone, record):
+        """
+        See the documentation for AuthoritativeServerBase.add_record() for
+        details.
+        """
+
+        with self._lock:
+            stored = self._get_zone(zone)
+            record = self._copy_record(record, stored)
+            stored.add_record(record)
+            self._changed(self._domain(zone))
+
+        return record.id
+
+    def add_soa_record(self, zone, soa_record):
+        """
+        See the documentation for AuthoritativeServerBase.add_soa_record() for
+        details.
+        """
+
+        with self._lock:
+            self._get_zone(zone).soa_record = soa_record
+            self._changed(self._domain(zone))
+
+    def rm_record(self, zone, record):
+        """
+        See the documentation for AuthoritativeServerBase.rm_record() for
+        details.
+        """
+
+        self.rm_records(zone, {'name':    record.name,
+                               'rtype':   record.rtype,
+                               'content': record.content})
+
+    def rm_records(self, zone, filters):
+        """
+        See the documentation for AuthoritativeServerBase.rm_records() for
+        details.
+        """
+
+        with self._lock:
+            stored  = self._get_zone(zone)
+            records = stored.find(**filters)
+            for r in records:
+                stored.rm_record(r)
+
+            if records:
+                self._changed(stored.domain)
+
+        return records
+
+    def commit_changes(self, changes):
+        """
+        See the documentation for AuthoritativeServerBase.commit_changes() for
+        details.
+
+        The changes are written to the file together.
+        """
+
+        with self._lock:
+            stored = self._get_zone(changes.domain)
+            if not stored.soa_record:
+                raise dns.InvalidZoneError('no SOA record')
+
+            additions = [self._copy_record(r, stored)
+                         for r in changes.additions]
+
+            changes.removed = []
+            for filters in changes.removals:
+                for r in stored.find(**filters):
+                    stored.rm_record(r)
+                    changes.removed.append(r)
+            for r in additions:
+                stored.add_record(r)
+
+            (removals, sync_additions) = changes.diff(stored)
+            for r in removals:
+                stored.rm_record(r)
+            for r in sync_additions:
+                stored.add_record(self._copy_record(r, stored))
+
+            soa = stored.soa_record
+            if changes.removed or changes.additions:
+                soa = dns.SoaRecord(soa.primary_ns, soa.responsible_person,
+                                    dns.next_serial(soa.serial), soa.refresh,
+                                    soa.retry, soa.expire, soa.min_ttl)
+                stored.soa_record = soa
+                self._changed(stored.domain)
+
+        changes.serial = int(soa.serial)
+        return changes.serial
+
+    def add_zone(self, zone):
+        """
+        See the documentation for AuthoritativeServerBase.add_zone() for
+        details.
+        """
+
+        with self._lock:
+            if zone.domain in self._zones \
+                    or os.path.exists(self._path(zone.domain)):
+                raise dns.DuplicateZoneError()
+
+            self._store_zone(zone)
+
+        return zone.id
+
+    def import_zone(self, zone, replace=False):
+        """
+        See the documentation for AuthoritativeServerBase.import_zone() for
+        details.
+        """
+
+        with self._lock:
+            if not replace and (zone.domain in self._zones
+                                or os.path.exists(self._path(zone.domain))):
+                raise dns.DuplicateZoneError()
+
+            self._store_zone(zone)
+
+        return zone.id
+
+    def rm_zone(self, zone):
+        """
+        See the documentation for AuthoritativeServerBase.rm_zone() for
+        details.
+        """
+
+        domain = self._domain(zone)
+
+        with self._lock:
+            self._get_zone(domain)
+
+            os.unlink(self._path(domain))
+            del self._zones[domain]
+            self._dirty.discard(domain)
+
+        self._reload(domain)
+
+    def get_zone(self, domain):
+        """
+        See the documentation for ServerBase.get_zone() for details.
+        """
+
+        with self._lock:
+            stored = self._get_zone(domain)
+
+            zone = dns.Zone(stored.domain, stored.ttl, stored.origin,
+                            stored.soa_record, stored.records)
+            zone.id = stored.id
+
+        return zone
+
+    def get_zone_page(self, domain, filters=None, after=None, limit=None):
+        """
+        See the documentation for ServerBase.get_zone_page() for details.
+        """
+
+        with self._lock:
+            return self._get_zone(domain).page(filters, after, limit)
@@ -0,0 +1,309 @@
+#!/usr/bin/env python3.2
+
+#
+# HyperNova server management framework
+#
+# Read-through zone cache for DNS servers
+#
+# Copyright (c) 2012 TDM Ltd
+#                    Luke Carrier <luke.carrier@tdm.info>
+#
+
+"""
+Cache zones retrieved from a DNS server, so that repeated get_zone() calls
+don't have to go back to the database.
+
+CachingAuthoritativeServer wraps another adapter, serving get_zone() from a
+ZoneCache and invalidating a zone whenever it's changed through the wrapper.
+Changes made by other means (e.g. directly in the database, or by another
+agent) become visible when the cached copy expires.
+
+Cached zones are shared between all callers, and must be treated as read-only.
+"""
+
+from collections import OrderedDict
+from hypernova.libraries.appconfig import dnsserver as dns
+import threading
+import time
+
+class ZoneCache:
+    """
+    LRU zone cache.
+
+    Zones expire ttl seconds after they're stored. The size of the cache is
+    capped at max_records records (a rough proxy for memory use); when it's
+    exceeded, the least recently used zones are evicted.
+    """
+
+    def __init__(self, max_records=100000, ttl=60):
+        """
+        Initialise values.
+        """
+
+        self.max_records = max_records
+        self.ttl         = ttl
+
+        # (zone, record count, expiry time) tuples keyed by domain, the most
+        # recently used last
+        self._zones   = OrderedDict()
+        self._records = 0
+
+        # Incremented when a zone is invalidated (or the whole cache cleared),
+        # so that a zone loaded before a write isn't stored after it
+        self._generations = {}
+        self._epoch       = 0
+
+        self.hits      = 0
+        self.misses    = 0
+        self.evictions = 0
+
+        self._lock = threading.Lock()
+
+    def get(self, domain):
+        """
+        Get a cached zone, or None if it isn't cached or has expired.
+        """
+
+        with self._lock:
+            entry = self._zones.get(domain)
+
+            if entry and entry[2] > time.time():
+                self._zones.move_to_end(domain)
+                self.hits += 1
+                return entry[0]
+
+            if entry:
+                self._remove(domain)
+            self.misses += 1
+
+    def begin(self, domain):
+        """
+        Get a token to pass to put() when storing a zone about to be loaded.
+        """
+
+        with self._lock:
+            return (self._epoch, self._generations.get(domain, 0))
+
+    def put(self, domain, zone, token):
+        """
+        Store a zone, unless it has been invalidated since begin() was called.
+        """
+
+        count = len(zone) + 1
+        if count > self.max_records:
+            return
+
+        with self._lock:
+            if token != (self._epoch, self._generations.get(domain, 0)):
+                return
+
+            if domain in self._zones:
+                self._remove(domain)
+
+            self._zones[domain] = (zone, count, time.time() + self.ttl)
+            self._records += count
+
+            while self._records > self.max_records:
+                self._remove(next(iter(self._zones)))
+                self.evictions += 1
+
+    def invalidate(self, domain):
+        """
+        Discard a zone.
+        """
+
+        with self._lock:
+            self._generations[domain] = self._generations.get(domain, 0) + 1
+            if domain in self._zones:
+                self._remove(domain)
+
+    def clear(self):
+        """
+        Discard all zones, returning the number discarded.
+        """
+
+        with self._lock:
+            count = len(self._zones)
+
+            self._epoch += 1
+            self._generations.clear()
+            self._zones.clear()
+            self._records = 0
+
+        return count
+
+    def stats(self):
+        """
+        Get the cache's size and hit/miss counters.
+        """
+
+        with self._lock:
+            return {
+                'zones':     len(self._zones),
+                'records':   self._records,
+                'hits':      self.hits,
+                'misses':    self.misses,
+                'evictions': self.evictions,
+            }
+
+    def _remove(self, domain):
+        """
+        Remove a zone.
+
+        Must be called with the lock held.
+        """
+
+        (zone, count, expires) = self._zones.pop(domain)
+        self._records -= count
+
+
+class CachingAuthoritativeServer(dns.AuthoritativeServerBase):
+    """
+    Authoritative DNS server wrapper, caching zones retrieved from another.
+    """
+
+    def __init__(self, server, cache):
+        """
+        Initialise values.
+        """
+
+        self.server = server
+        self.cache  = cache
+
+    def _domain(self, zone):
+        """
+        Get the domain of a zone, given a Zone object or a domain.
+        """
+
+        return zone if isinstance(zone, str) else zone.domain
+
+    def get_zone(self, domain):
+        """
+        See the documentation for ServerBase.get_zone() for details.
+        """
+
+        zone = self.cache.get(domain)
+
+        if zone is None:
+            token = self.cache.begin(domain)
+            zone  = self.server.get_zone(domain)
+            self.cache.put(domain, zone, token)
+
+        return zone
+
+    def get_zone_page(self, domain, filters=None, after=None, limit=None):
+        """
+        See the documentation for ServerBase.get_zone_page() for details.
+
+        Pages are taken from the cached zone if there is one. Otherwise the
+        request is passed on to the server, which can usually filter the
+        records more efficiently than loading the whole zone into the cache.
+        """
+
+        if not filters and after is None and limit is None:
+            return (self.get_zone(domain), None)
+
+        zone = self.cache.get(domain)
+        if zone is not None:
+            return zone.page(filters, after, limit)
+
+        return self.server.get_zone_page(domain, filters, after, limit)
+
+    def add_record(self, zone, record):
+        """
+        See the documentation for AuthoritativeServerBase.add_record() for
+        details.
+        """
+
+        try:
+            return self.server.add_record(zone, record)
+        finally:
+            self.cache.invalidate(self._domain(zone))
+
+    def add_soa_record(self, zone, soa_record):
+        """
+        See the documentation for AuthoritativeServerBase.add_soa_record() for
+        details.
+        """
+
+        try:
+            return self.server.add_soa_record(zone, soa_record)
+        finally:
+            self.cache.invalidate(self._domain(zone))
+
+    def add_zone(self, zone):
+        """
+        See the documentation for AuthoritativeServerBase.add_zone() for
+        details.
+        """
+
+        try:
+            return self.server.add_zone(zone)
+        finally:
+            self.cache.invalidate(self._domain(zone))
+
+    def import_zone(self, zone, replace=False):
+        """
+        See the documentation for AuthoritativeServerBase.import_zone() for
+        details.
+        """
+
+        try:
+            return self.server.import_zone(zone, replace)
+        finally:
+            self.cache.invalidate(self._domain(zone))
+
+    def rm_record(self, zone, record):
+        """
+        See the documentation for AuthoritativeServerBase.rm_record() for
+        details.
+        """
+
+        try:
+            return self.server.rm_record(zone, record)
+        finally:
+            self.cache.invalidate(self._domain(zone))
+
+    def commit_changes(self, changes):
+        """
+        See the documentation for AuthoritativeServerBase.commit_changes() for
+        details.
+        """
+
+        try:
+            return self.server.commit_changes(changes)
+        finally:
+            self.cache.invalidate(changes.domain)
+
+    def rm_records(self, zone, filters):
+        """
+        See the documentation for AuthoritativeServerBase.rm_records() for
+        details.
+        """
+
+        try:
+            return self.server.rm_records(zone, filters)
+        finally:
+            self.cache.invalidate(self._domain(zone))
+
+    def rm_soa_record(self, zone, record):
+        """
+        See the documentation for AuthoritativeServerBase.rm_soa_record() for
+        details.
+        """
+
+        try:
+            return self.server.rm_soa_record(zone, record)
+        finally:
+            self.cache.invalidate(self._domain(zone))
+
+    def rm_zone(self, zone):
+        """
+        See the documentation for AuthoritativeServerBase.rm_zone() for
+        details.
+        """
+
+        try:
+            return self.server.rm_zone(zone)
+        finally:
+            self.cache.invalidate(self._domain(zone))
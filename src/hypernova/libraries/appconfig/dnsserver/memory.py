@@ -0,0 +1,236 @@
+#!/usr/bin/env python3.2
+
+#
+# HyperNova server management framework
+#
+# In-memory adapter for DNS management
+#
+# Copyright (c) 2012 TDM Ltd
+#                    Luke Carrier <luke.carrier@tdm.info>
+#
+
+"""
+A stand-in DNS server which keeps its zones in memory, for testing and
+benchmarking the DNS module without a database.
+
+Zones are shared between all instances in the process, and are lost when it
+exits. The adapter mirrors the PowerDNS adapter's behaviour: zones are returned
+as snapshots, and removing a record removes all records with the same name,
+type and content.
+"""
+
+from hypernova.libraries.appconfig import dnsserver as dns
+import itertools
+import threading
+
+class AuthoritativeServer(dns.AuthoritativeServerBase):
+
+    # Zones, keyed by domain
+    zones = {}
+
+    _lock    = threading.Lock()
+    _next_id = 1
+
+    # Record IDs, unique across all zones
+    _record_ids = itertools.count(1)
+
+    def __init__(self, **options):
+        """
+        Initialise the server.
+
+        The adapter has no configuration; options are accepted (and ignored) so
+        that it can stand in for any other adapter.
+        """
+
+        pass
+
+    def _get_zone(self, zone):
+        """
+        Find the stored zone for a domain or Zone object.
+
+        Must be called with the lock held.
+        """
+
+        domain = zone if isinstance(zone, str) else zone.domain
+
+        try:
+            return AuthoritativeServer.zones[domain]
+        except KeyError:
+            raise dns.NonexistentZoneError()
+
+    def _copy_record(self, record):
+        """
+        Copy a record to be stored, assigning it an ID.
+
+        The copy ensures that changes to the caller's record don't affect the
+        stored zone.
+        """
+
+        return dns.Record(record.name, record.rtype, record.content,
+                          record.ttl, record.priority,
+                          next(AuthoritativeServer._record_ids))
+
+    def add_record(self, zone, record):
+        """
+        See the documentation for AuthoritativeServerBase.add_record() for
+        details.
+        """
+
+        record = self._copy_record(record)
+
+        with AuthoritativeServer._lock:
+            self._get_zone(zone).add_record(record)
+
+        return record.id
+
+    def add_soa_record(self, zone, soa_record):
+        """
+        See the documentation for AuthoritativeServerBase.add_soa_record() for
+        details.
+        """
+
+        with AuthoritativeServer._lock:
+            self._get_zone(zone).soa_record = soa_record
+
+    def rm_record(self, zone, record):
+        """
+        See the documentation for AuthoritativeServerBase.rm_record() for
+        details.
+        """
+
+        with AuthoritativeServer._lock:
+            stored = self._get_zone(zone)
+            for r in stored.find(name=record.name, rtype=record.rtype,
+                                 content=record.content):
+                stored.rm_record(r)
+
+    def rm_records(self, zone, filters):
+        """
+        See the documentation for AuthoritativeServerBase.rm_records() for
+        details.
+        """
+
+        with AuthoritativeServer._lock:
+            stored  = self._get_zone(zone)
+            records = stored.find(**filters)
+            for r in records:
+                stored.rm_record(r)
+
+        return records
+
+    def commit_changes(self, changes):
+        """
+        See the documentation for AuthoritativeServerBase.commit_changes() for
+        details.
+        """
+
+        additions = [self._copy_record(r) for r in changes.additions]
+
+        with AuthoritativeServer._lock:
+            stored = self._get_zone(changes.domain)
+            if not stored.soa_record:
+                raise dns.InvalidZoneError('no SOA record')
+
+            changes.removed = []
+            for filters in changes.removals:
+                for r in stored.find(**filters):
+                    stored.rm_record(r)
+                    changes.removed.append(r)
+            for r in additions:
+                stored.add_record(r)
+
+            (removals, sync_additions) = changes.diff(stored)
+            for r in removals:
+                stored.rm_record(r)
+            for r in sync_additions:
+                stored.add_record(self._copy_record(r))
+
+            # Replace, rather than modify, the SOA record; snapshots returned
+            # by get_zone() share it
+            soa = stored.soa_record
+            if changes.removed or changes.additions:
+                soa = dns.SoaRecord(soa.primary_ns, soa.responsible_person,
+                                    dns.next_serial(soa.serial), soa.refresh,
+                                    soa.retry, soa.expire, soa.min_ttl)
+                stored.soa_record = soa
+
+        changes.serial = int(soa.serial)
+        return changes.serial
+
+    def add_zone(self, zone):
+        """
+        See the documentation for AuthoritativeServerBase.add_zone() for
+        details.
+        """
+
+        with AuthoritativeServer._lock:
+            if zone.domain in AuthoritativeServer.zones:
+                raise dns.DuplicateZoneError()
+
+            zone.id = AuthoritativeServer._next_id
+            AuthoritativeServer._next_id += 1
+
+            stored = dns.Zone(zone.domain, zone.ttl, zone.origin,
+                              zone.soa_record,
+                              [self._copy_record(r) for r in zone.records])
+            stored.id = zone.id
+            AuthoritativeServer.zones[zone.domain] = stored
+
+        return zone.id
+
+    def import_zone(self, zone, replace=False):
+        """
+        See the documentation for AuthoritativeServerBase.import_zone() for
+        details.
+        """
+
+        stored = dns.Zone(zone.domain, zone.ttl, zone.origin, zone.soa_record,
+                          [self._copy_record(r) for r in zone.records])
+
+        with AuthoritativeServer._lock:
+            existing = AuthoritativeServer.zones.get(zone.domain)
+
+            if existing and not replace:
+                raise dns.DuplicateZoneError()
+            elif existing:
+                stored.id = existing.id
+            else:
+                stored.id = AuthoritativeServer._next_id
+                AuthoritativeServer._next_id += 1
+
+            AuthoritativeServer.zones[zone.domain] = stored
+
+        zone.id = stored.id
+        return zone.id
+
+    def rm_zone(self, zone):
+        """
+        See the documentation for AuthoritativeServerBase.rm_zone() for
+        details.
+        """
+
+        with AuthoritativeServer._lock:
+            stored = self._get_zone(zone)
+            del AuthoritativeServer.zones[stored.domain]
+
+    def get_zone(self, domain):
+        """
+        See the documentation for ServerBase.get_zone() for details.
+        """
+
+        with AuthoritativeServer._lock:
+            stored = self._get_zone(domain)
+
+            zone = dns.Zone(stored.domain, stored.ttl, stored.origin,
+                            stored.soa_record, list(stored.records))
+            zone.id = stored.id
+
+        return zone
+
+    def get_zone_page(self, domain, filters=None, after=None, limit=None):
+        """
+        See the documentation for ServerBase.get_zone_page() for details.
+        """
+
+        with AuthoritativeServer._lock:
+            return self._get_zone(domain).page(filters, after, limit)
@@ -22,43 +22,25 @@ A few things:
     more than likely a bad thing that should be rectified in the future.
 """
 
-from hypernova.libraries.appconfig import dnsserver as dns
+from contextlib import contextmanager
+from hypernova.libraries.appconfig.dnsserver import sql
+from hypernova.libraries.connectionpool import ConnectionPool
 import oursql
 
-class AuthoritativeServer(dns.AuthoritativeServerBase):
+class AuthoritativeServer(sql.SqlAuthoritativeServerBase):
 
     credentials = {}
 
-    SELECT_ZONE = "SELECT `id`, `name` " \
-                  "FROM `domains` " \
-                  "WHERE `name` = ? " \
-                  "LIMIT 1"
+    integrity_errors = (oursql.IntegrityError,)
 
-    SELECT_ZONE_RECORDS = "SELECT `name`, `type`, `content`, `ttl`, `prio` " \
-                          "FROM `records` " \
-                          "WHERE `domain_id` = ?"
-
-    INSERT_RECORD = "INSERT INTO `records` (`domain_id`, `name`, `type`, `content`, `ttl`, `prio`) " \
-                    "VALUES (?, ?, ?, ?, ?, ?)"
-
-    INSERT_ZONE = "INSERT INTO `domains` (`name`, `type`) " \
-                  "VALUES (?, ?)"
-
-    DELETE_ZONE = "DELETE FROM `domains` " \
-                  "WHERE `id` = ?"
-
-    DELETE_RECORDS_ASSOCIATED_WITH_DOMAIN = "DELETE FROM `records` " \
-                                            "WHERE `domain_id` = ?"
-
-    DELETE_RECORD = "DELETE FROM `records` " \
-                    "WHERE `domain_id` = ? " \
-                    "AND `name` = ? " \
-                    "AND `type` = ? " \
-                    "AND `content` = ?"
-
-    def __init__(self, host, username, password, db):
+    def __init__(self, host, username, password, db, pool_size=8,
+                 pool_idle_time=300):
         """
-        Initialise the connection.
+        Initialise the connection pool.
+
+        Connections are shared by all instances using the same credentials. At
+        most pool_size are opened, and those idle for more than pool_idle_time
+        seconds are closed.
         """
 
         self.credentials = {
@@ -68,177 +50,35 @@ class AuthoritativeServer(dns.AuthoritativeServerBase):
             'db':     db,
         }
 
-    def _soa_content(self, soa_record):
-        """
-        Concatenate the attributes of an SOA record.
-        """
-
-        return ' '.join((soa_record.primary_ns,
-                         soa_record.responsible_person,
-                         str(soa_record.serial),
-                         str(soa_record.refresh),
-                         str(soa_record.retry),
-                         str(soa_record.expire),
-                         str(soa_record.min_ttl)))
+        self.pool = ConnectionPool.get_pool(
+                ('powerdns', host, username, password, db), self._connect,
+                max_size=int(pool_size), max_idle_time=int(pool_idle_time),
+                check=self._ping, broken=(oursql.InterfaceError,
+                                          oursql.OperationalError))
 
-    def add_record(self, zone, record):
+    def _connect(self):
         """
-        See the documentation for AuthoritativeServerBase.add_record() for
-        details.
+        Open a new connection.
         """
 
-        db = oursql.connect(**self.credentials)
+        return oursql.connect(**self.credentials)
 
-        try:
-            if not hasattr(zone, 'id'):
-                with db as cursor:
-                    cursor.execute(self.SELECT_ZONE, (zone.domain,))
-                    zone.id = cursor.fetchone()[0]
-
-            with db as cursor:
-                cursor.execute(self.INSERT_RECORD, (zone.id,
-                                                    record.name,
-                                                    record.rtype.upper(),
-                                                    record.content,
-                                                    record.ttl,
-                                                    record.priority))
-        finally:
-            db.close()
-
-        return cursor.lastrowid
-
-    def add_soa_record(self, zone, soa_record):
+    def _ping(self, db):
         """
-        See the documentation for AuthoritativeServerBase.add_soa_record() for
-        details.
+        Ensure a pooled connection is still alive.
         """
 
-        db = oursql.connect(**self.credentials)
-
-        try:
-            if not hasattr(zone, 'id'):
-                with db as cursor:
-                    cursor.execute(self.SELECT_ZONE, (zone.domain,))
-                    zone.id = cursor.fetchone()[0]
+        db.ping()
 
-            with db as cursor:
-                cursor.execute(self.INSERT_RECORD, (zone.id,
-                                                    zone.domain,
-                                                    'SOA',
-                                                    self._soa_content(soa_record),
-                                                    None,
-                                                    None))
-        finally:
-            db.close()
-
-    def rm_record(self, zone, record):
-        """
-        See the documentation for AuthoritativeServerBase.rm_record() for
-        details.
+    @contextmanager
+    def _transaction(self, read_only=False):
         """
+        Get a cursor on a pooled connection, within a transaction.
 
-        db = oursql.connect(**self.credentials)
-
-        try:
-            if not hasattr(zone, 'id'):
-                with db as cursor:
-                    cursor.execute(self.SELECT_ZONE, (zone.domain,))
-                    zone.id = cursor.fetchone()[0]
-
-            rtype = dns.Record.RECORD_TYPES[record.rtype]
-            with db as cursor:
-                cursor.execute(self.DELETE_RECORD, (zone.id,
-                                                    record.name,
-                                                    rtype,
-                                                    record.content))
-
-        finally:
-            db.close()
-
-    def add_zone(self, zone):
-        """
-        See the documentation for AuthoritativeServerBase.add_zone() for
-        details.
+        The transaction is committed when the with block completes, or rolled
+        back if it raises.
         """
 
-        db = oursql.connect(**self.credentials)
-
-        try:
+        with self.pool.connection() as db:
             with db as cursor:
-                cursor.execute(self.INSERT_ZONE, (zone.domain, 'NATIVE'))
-        except oursql.IntegrityError:
-            raise dns.DuplicateZoneError()
-        finally:
-            db.close()
-
-        self.add_soa_record(zone, zone.soa_record)
-
-        zone.id = cursor.lastrowid
-        return cursor.lastrowid
-
-    def rm_zone(self, zone):
-        """
-        See the documentation for AuthorititativeServerBase.rm_zone() for
-        details.
-        """
-
-        db = oursql.connect(**self.credentials)
-
-        if isinstance(zone, str):
-            zone = self.get_zone(zone)
-
-        with db as cursor:
-            cursor.execute(self.DELETE_ZONE, (zone.id,))
-
-        with db as cursor:
-            cursor.execute(self.DELETE_RECORDS_ASSOCIATED_WITH_DOMAIN, (zone.id,))
-
-    def get_zone(self, main_domain):
-        """
-        See the documentation for ServerBase.get_zone() for details.
-
-        Known quirks:
-
-          * PowerDNS doesn't support directives, as implemented by BIND. As a
-            result, the ttl and origin fields of each zone are always set to
-            None.
-          * The comment field PowerDNS adds to records is _not_ supported by
-            this libary. Inserted rows won't contain this field, and there's a
-            chance that modifications will alter it.
-        """
-
-        db = oursql.connect(**self.credentials)
-
-        try:
-            cursor = db.cursor(oursql.DictCursor)
-            cursor.execute(self.SELECT_ZONE, [main_domain,])
-            zone_meta = cursor.fetchone()
-            cursor.close()
-
-            cursor = db.cursor()
-            try:
-                cursor.execute(self.SELECT_ZONE_RECORDS, [zone_meta['id'],])
-            except TypeError:
-                raise dns.NonexistentZoneError()
-
-            records = []
-            for r in cursor:
-                # Normalise the record type with a numerical value for easier
-                # processing later
-                r = list(r)
-                r[1] = dns.Record.RECORD_TYPES.index(r[1].lower())
-
-                if r[1] == dns.Record.RECORD_TYPES.index('soa'):
-                    soa_record = dns.SoaRecord(*r[2].split())
-                else:
-                    records.append(dns.Record(*r))
-            cursor.close()
-
-        finally:
-            db.close()
-
-        zone = dns.Zone(zone_meta['name'],
-                        new_soa_record=soa_record, new_records=records)
-        zone.id = zone_meta['id']
-
-        return zone
+                yield cursor
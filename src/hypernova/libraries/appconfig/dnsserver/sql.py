@@ -0,0 +1,483 @@
+#!/usr/bin/env python3.2
+
+#
+# HyperNova server management framework
+#
+# Common base for DNS adapters using the PowerDNS SQL schema
+#
+# Copyright (c) 2012 TDM Ltd
+#                    Luke Carrier <luke.carrier@tdm.info>
+#
+
+"""
+The queries and logic shared by the adapters storing zones in the PowerDNS
+schema. Subclasses provide the connections (see _transaction()) and may
+override individual queries where their database's dialect differs.
+"""
+
+from hypernova.libraries.appconfig import dnsserver as dns
+
+class SqlAuthoritativeServerBase(dns.AuthoritativeServerBase):
+    """
+    Authoritative DNS server storing zones in the PowerDNS schema.
+    """
+
+    # Exceptions raised by the database driver on constraint violations
+    integrity_errors = ()
+
+    SELECT_ZONE = "SELECT `id`, `name` " \
+                  "FROM `domains` " \
+                  "WHERE `name` = ? " \
+                  "LIMIT 1"
+
+    SELECT_ZONE_RECORDS = "SELECT `id`, `name`, `type`, `content`, `ttl`, `prio` " \
+                          "FROM `records` " \
+                          "WHERE `domain_id` = ?"
+
+    SELECT_SOA_RECORD = "SELECT `content` " \
+                        "FROM `records` " \
+                        "WHERE `domain_id` = ? " \
+                        "AND `type` = 'SOA' " \
+                        "LIMIT 1"
+
+    SELECT_SOA_RECORD_FOR_UPDATE = "SELECT `id`, `content` " \
+                                   "FROM `records` " \
+                                   "WHERE `domain_id` = ? " \
+                                   "AND `type` = 'SOA' " \
+                                   "LIMIT 1 " \
+                                   "FOR UPDATE"
+
+    UPDATE_RECORD_CONTENT = "UPDATE `records` " \
+                            "SET `content` = ? " \
+                            "WHERE `id` = ?"
+
+    # Conditions appended to SELECT_ZONE_RECORDS and
+    # DELETE_RECORDS_ASSOCIATED_WITH_DOMAIN by get_zone_page() and rm_records()
+    FILTER_NOT_SOA        = " AND `type` != 'SOA'"
+    FILTER_ID             = " AND `id` = ?"
+    FILTER_NAME           = " AND `name` = ?"
+    FILTER_TYPE           = " AND `type` = ?"
+    FILTER_CONTENT        = " AND `content` = ?"
+    FILTER_CONTENT_PREFIX = " AND `content` LIKE ?"
+    FILTER_AFTER          = " AND `id` > ?"
+    ORDER_BY_ID           = " ORDER BY `id`"
+    LIMIT                 = " LIMIT ?"
+    FOR_UPDATE            = " FOR UPDATE"
+
+    INSERT_RECORD = "INSERT INTO `records` (`domain_id`, `name`, `type`, `content`, `ttl`, `prio`) " \
+                    "VALUES (?, ?, ?, ?, ?, ?)"
+
+    INSERT_RECORDS_VALUES = ", (?, ?, ?, ?, ?, ?)"
+
+    # Maximum number of rows per multi-row INSERT statement
+    INSERT_RECORDS_CHUNK = 500
+
+    INSERT_ZONE = "INSERT INTO `domains` (`name`, `type`) " \
+                  "VALUES (?, ?)"
+
+    DELETE_ZONE = "DELETE FROM `domains` " \
+                  "WHERE `id` = ?"
+
+    DELETE_RECORDS_ASSOCIATED_WITH_DOMAIN = "DELETE FROM `records` " \
+                                            "WHERE `domain_id` = ?"
+
+    DELETE_RECORD = "DELETE FROM `records` " \
+                    "WHERE `domain_id` = ? " \
+                    "AND `name` = ? " \
+                    "AND `type` = ? " \
+                    "AND `content` = ?"
+
+    def _transaction(self, read_only=False):
+        """
+        Get a context manager yielding a cursor within a transaction.
+
+        The transaction should be committed when the with block completes, or
+        rolled back if it raises. read_only is a hint that nothing will be
+        written.
+        """
+
+        self._not_implemented()
+
+    def _zone_id(self, cursor, zone):
+        """
+        Get the ID of a zone, looking it up if we don't already know it.
+        """
+
+        if not hasattr(zone, 'id'):
+            cursor.execute(self.SELECT_ZONE, (zone.domain,))
+            row = cursor.fetchone()
+            if not row:
+                raise dns.NonexistentZoneError()
+            zone.id = row[0]
+
+        return zone.id
+
+    def _rtype_name(self, rtype):
+        """
+        Get the name PowerDNS uses for a record type, given its name or index.
+        """
+
+        if not isinstance(rtype, str):
+            rtype = dns.Record.RECORD_TYPES[rtype]
+
+        return rtype.upper()
+
+    def _filter_records(self, filters, content_prefix=False):
+        """
+        Build the conditions and parameters matching records against filters.
+
+        filters may contain an id, a name, an rtype and content, which is
+        matched as a prefix if content_prefix is set. SOA records never match.
+        """
+
+        filters = filters or {}
+        conditions = self.FILTER_NOT_SOA
+        params     = []
+
+        if filters.get('id') is not None:
+            conditions += self.FILTER_ID
+            params.append(filters['id'])
+        if filters.get('name') is not None:
+            conditions += self.FILTER_NAME
+            params.append(filters['name'])
+        if filters.get('rtype') is not None:
+            conditions += self.FILTER_TYPE
+            params.append(self._rtype_name(
+                    dns.Record.get_type_index(filters['rtype'])))
+        if content_prefix and filters.get('content'):
+            conditions += self.FILTER_CONTENT_PREFIX
+            params.append(self._escape_like(filters['content']) + '%')
+        elif not content_prefix and filters.get('content') is not None:
+            conditions += self.FILTER_CONTENT
+            params.append(filters['content'])
+
+        return (conditions, params)
+
+    def _build_record(self, row):
+        """
+        Build a Record from a row selected with SELECT_ZONE_RECORDS.
+        """
+
+        (record_id, name, rtype, content, ttl, priority) = row
+        return dns.Record(name, rtype, content, ttl, priority, record_id)
+
+    def _escape_like(self, value):
+        """
+        Escape the wildcard characters in a value for use in a LIKE pattern.
+        """
+
+        for char in ('\\', '%', '_'):
+            value = value.replace(char, '\\' + char)
+
+        return value
+
+    def _soa_content(self, soa_record):
+        """
+        Concatenate the attributes of an SOA record.
+        """
+
+        return ' '.join((soa_record.primary_ns,
+                         soa_record.responsible_person,
+                         str(soa_record.serial),
+                         str(soa_record.refresh),
+                         str(soa_record.retry),
+                         str(soa_record.expire),
+                         str(soa_record.min_ttl)))
+
+    def add_record(self, zone, record):
+        """
+        See the documentation for AuthoritativeServerBase.add_record() for
+        details.
+        """
+
+        with self._transaction() as cursor:
+            cursor.execute(self.INSERT_RECORD, (self._zone_id(cursor, zone),
+                                                record.name,
+                                                self._rtype_name(record.rtype),
+                                                record.content,
+                                                record.ttl,
+                                                record.priority))
+
+        return cursor.lastrowid
+
+    def add_soa_record(self, zone, soa_record):
+        """
+        See the documentation for AuthoritativeServerBase.add_soa_record() for
+        details.
+        """
+
+        with self._transaction() as cursor:
+            self._insert_soa_record(cursor, zone, soa_record)
+
+    def _insert_soa_record(self, cursor, zone, soa_record):
+        """
+        Insert an SOA record within an existing transaction.
+        """
+
+        cursor.execute(self.INSERT_RECORD, (self._zone_id(cursor, zone),
+                                            zone.domain,
+                                            'SOA',
+                                            self._soa_content(soa_record),
+                                            None,
+                                            None))
+
+    def rm_record(self, zone, record):
+        """
+        See the documentation for AuthoritativeServerBase.rm_record() for
+        details.
+        """
+
+        with self._transaction() as cursor:
+            cursor.execute(self.DELETE_RECORD, (self._zone_id(cursor, zone),
+                                                record.name,
+                                                self._rtype_name(record.rtype),
+                                                record.content))
+
+    def add_zone(self, zone):
+        """
+        See the documentation for AuthoritativeServerBase.add_zone() for
+        details.
+
+        The zone and its SOA record are inserted in a single transaction.
+        """
+
+        try:
+            with self._transaction() as cursor:
+                cursor.execute(self.INSERT_ZONE, (zone.domain, 'NATIVE'))
+                zone.id = cursor.lastrowid
+
+                self._insert_soa_record(cursor, zone, zone.soa_record)
+        except self.integrity_errors:
+            raise dns.DuplicateZoneError()
+
+        return zone.id
+
+    def import_zone(self, zone, replace=False):
+        """
+        See the documentation for AuthoritativeServerBase.import_zone() for
+        details.
+
+        The zone, its SOA record and its records are written in a single
+        transaction, with the records inserted several hundred rows at a time.
+        """
+
+        try:
+            with self._transaction() as cursor:
+                cursor.execute(self.SELECT_ZONE, (zone.domain,))
+                zone_meta = cursor.fetchone()
+
+                if zone_meta and not replace:
+                    raise dns.DuplicateZoneError()
+                elif zone_meta:
+                    zone.id = zone_meta[0]
+                    cursor.execute(self.DELETE_RECORDS_ASSOCIATED_WITH_DOMAIN,
+                                   (zone.id,))
+                else:
+                    cursor.execute(self.INSERT_ZONE, (zone.domain, 'NATIVE'))
+                    zone.id = cursor.lastrowid
+
+                self._insert_soa_record(cursor, zone, zone.soa_record)
+                self._insert_records(cursor, zone.id, zone.records)
+        except self.integrity_errors:
+            raise dns.DuplicateZoneError()
+
+        return zone.id
+
+    def rm_zone(self, zone):
+        """
+        See the documentation for AuthorititativeServerBase.rm_zone() for
+        details.
+        """
+
+        if isinstance(zone, str):
+            zone = dns.Zone(zone)
+
+        with self._transaction() as cursor:
+            zone_id = self._zone_id(cursor, zone)
+            cursor.execute(self.DELETE_RECORDS_ASSOCIATED_WITH_DOMAIN,
+                           (zone_id,))
+            cursor.execute(self.DELETE_ZONE, (zone_id,))
+
+    def rm_records(self, zone, filters):
+        """
+        See the documentation for AuthoritativeServerBase.rm_records() for
+        details.
+
+        The matching rows are locked and read, then deleted with a single
+        statement, within one transaction.
+        """
+
+        if isinstance(zone, str):
+            zone = dns.Zone(zone)
+
+        with self._transaction() as cursor:
+            return self._delete_records(cursor, self._zone_id(cursor, zone),
+                                        filters)
+
+    def commit_changes(self, changes):
+        """
+        See the documentation for AuthoritativeServerBase.commit_changes() for
+        details.
+
+        The changes and the new SOA serial are written in a single transaction.
+        The SOA record is locked for its duration, so concurrent change sets to
+        the same zone are serialised, and records to sync are compared with
+        the zone's records as they stand within it.
+        """
+
+        zone = dns.Zone(changes.domain)
+
+        with self._transaction() as cursor:
+            zone_id = self._zone_id(cursor, zone)
+
+            cursor.execute(self.SELECT_SOA_RECORD_FOR_UPDATE, (zone_id,))
+            row = cursor.fetchone()
+            if not row:
+                raise dns.InvalidZoneError('no SOA record')
+            (soa_id, soa_content) = row
+            soa_record = dns.SoaRecord(*soa_content.split())
+
+            changes.removed = []
+            for filters in changes.removals:
+                changes.removed.extend(self._delete_records(cursor, zone_id,
+                                                            filters))
+            self._insert_records(cursor, zone_id, changes.additions)
+
+            if changes.desired is not None:
+                cursor.execute(self.SELECT_ZONE_RECORDS + self.FILTER_NOT_SOA
+                               + self.FOR_UPDATE, (zone_id,))
+                current = [self._build_record(r) for r in cursor]
+
+                (removals, additions) = changes.diff(current)
+                for r in removals:
+                    self._delete_records(cursor, zone_id, {'id': r.id})
+                self._insert_records(cursor, zone_id, additions)
+
+            if changes.removed or changes.additions:
+                soa_record.serial = dns.next_serial(soa_record.serial)
+                cursor.execute(self.UPDATE_RECORD_CONTENT,
+                               (self._soa_content(soa_record), soa_id))
+
+        changes.serial = int(soa_record.serial)
+        return changes.serial
+
+    def _delete_records(self, cursor, zone_id, filters):
+        """
+        Delete the records matching filters within an existing transaction,
+        returning them.
+        """
+
+        (conditions, params) = self._filter_records(filters)
+        params.insert(0, zone_id)
+
+        cursor.execute(self.SELECT_ZONE_RECORDS + conditions + self.FOR_UPDATE,
+                       params)
+        records = [self._build_record(r) for r in cursor]
+
+        if records:
+            cursor.execute(self.DELETE_RECORDS_ASSOCIATED_WITH_DOMAIN
+                           + conditions, params)
+
+        return records
+
+    def _insert_records(self, cursor, zone_id, records):
+        """
+        Insert records within an existing transaction, several hundred rows
+        per statement.
+        """
+
+        for i in range(0, len(records), self.INSERT_RECORDS_CHUNK):
+            chunk = records[i:i + self.INSERT_RECORDS_CHUNK]
+
+            params = []
+            for r in chunk:
+                params.extend((zone_id, r.name, self._rtype_name(r.rtype),
+                               r.content, r.ttl, r.priority))
+
+            cursor.execute(self.INSERT_RECORD
+                           + self.INSERT_RECORDS_VALUES * (len(chunk) - 1),
+                           params)
+
+    def get_zone(self, main_domain):
+        """
+        See the documentation for ServerBase.get_zone() for details.
+
+        Known quirks:
+
+          * PowerDNS doesn't support directives, as implemented by BIND. As a
+            result, the ttl and origin fields of each zone are always set to
+            None.
+          * The comment field PowerDNS adds to records is _not_ supported by
+            this libary. Inserted rows won't contain this field, and there's a
+            chance that modifications will alter it.
+        """
+
+        with self._transaction(True) as cursor:
+            cursor.execute(self.SELECT_ZONE, (main_domain,))
+            zone_meta = cursor.fetchone()
+            if not zone_meta:
+                raise dns.NonexistentZoneError()
+
+            cursor.execute(self.SELECT_ZONE_RECORDS, (zone_meta[0],))
+
+            soa_record = None
+            records    = []
+            for r in cursor:
+                if r[2].upper() == 'SOA':
+                    soa_record = dns.SoaRecord(*r[3].split())
+                else:
+                    records.append(self._build_record(r))
+
+        zone = dns.Zone(zone_meta[1],
+                        new_soa_record=soa_record, new_records=records)
+        zone.id = zone_meta[0]
+
+        return zone
+
+    def get_zone_page(self, main_domain, filters=None, after=None, limit=None):
+        """
+        See the documentation for ServerBase.get_zone_page() for details.
+
+        The filtering and pagination are performed by the database. The same
+        quirks as get_zone() apply.
+        """
+
+        (conditions, params) = self._filter_records(filters, True)
+        query = self.SELECT_ZONE_RECORDS + conditions
+
+        if after is not None:
+            query += self.FILTER_AFTER
+            params.append(after)
+
+        query += self.ORDER_BY_ID
+        if limit is not None:
+            # Fetch one more row than we need, to find out whether or not
+            # there's another page
+            query += self.LIMIT
+            params.append(limit + 1)
+
+        with self._transaction(True) as cursor:
+            cursor.execute(self.SELECT_ZONE, (main_domain,))
+            zone_meta = cursor.fetchone()
+            if not zone_meta:
+                raise dns.NonexistentZoneError()
+
+            soa_record = None
+            cursor.execute(self.SELECT_SOA_RECORD, (zone_meta[0],))
+            row = cursor.fetchone()
+            if row:
+                soa_record = dns.SoaRecord(*row[0].split())
+
+            cursor.execute(query, [zone_meta[0]] + params)
+            records = [self._build_record(r) for r in cursor]
+
+        next_cursor = None
+        if limit is not None and len(records) > limit:
+            records = records[:limit]
+            next_cursor = records[-1].id
+
+        zone = dns.Zone(zone_meta[1],
+                        new_soa_record=soa_record, new_records=records)
+        zone.id = zone_meta[0]
+
+        return (zone, next_cursor)
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3.2
+
+#
+# HyperNova server management framework
+#
+# SQLite adapter for DNS management
+#
+# Copyright (c) 2012 TDM Ltd
+#                    Luke Carrier <luke.carrier@tdm.info>
+#
+
+"""
+Zones stored in an SQLite database using the PowerDNS schema, as served by
+PowerDNS's gsqlite3 backend. Handy for single-node installations, and for
+testing and benchmarking the dns module without a MySQL server.
+
+A few things:
+
+  * The schema is created when the database is first opened, if it doesn't
+    already exist.
+  * SQLite has no row locks. Transactions which write take the database's
+    write lock up front (BEGIN IMMEDIATE), which serialises them; readers are
+    never blocked, as the database is put in WAL mode.
+  * An in-memory database (":memory:") is private to a single connection, so
+    the pool is limited to one connection when using one.
+"""
+
+from contextlib import contextmanager
+from hypernova.libraries.appconfig.dnsserver import sql
+from hypernova.libraries.connectionpool import ConnectionPool
+import sqlite3
+
+class AuthoritativeServer(sql.SqlAuthoritativeServerBase):
+
+    integrity_errors = (sqlite3.IntegrityError,)
+
+    # The PowerDNS gsqlite3 schema, plus an index for the lookups this adapter
+    # performs within a zone
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS `domains` (
+            `id`              INTEGER PRIMARY KEY AUTOINCREMENT,
+            `name`            VARCHAR(255) NOT NULL COLLATE NOCASE,
+            `master`          VARCHAR(128) DEFAULT NULL,
+            `last_check`      INTEGER DEFAULT NULL,
+            `type`            VARCHAR(6) NOT NULL,
+            `notified_serial` INTEGER DEFAULT NULL,
+            `account`         VARCHAR(40) DEFAULT NULL
+        );
+        CREATE UNIQUE INDEX IF NOT EXISTS `name_index` ON `domains` (`name`);
+
+        CREATE TABLE IF NOT EXISTS `records` (
+            `id`          INTEGER PRIMARY KEY AUTOINCREMENT,
+            `domain_id`   INTEGER DEFAULT NULL,
+            `name`        VARCHAR(255) DEFAULT NULL,
+            `type`        VARCHAR(10) DEFAULT NULL,
+            `content`     VARCHAR(65535) DEFAULT NULL,
+            `ttl`         INTEGER DEFAULT NULL,
+            `prio`        INTEGER DEFAULT NULL,
+            `change_date` INTEGER DEFAULT NULL
+        );
+        CREATE INDEX IF NOT EXISTS `rec_name_index` ON `records` (`name`);
+        CREATE INDEX IF NOT EXISTS `nametype_index` ON `records` (`name`, `type`);
+        CREATE INDEX IF NOT EXISTS `domain_id_name_type_index`
+            ON `records` (`domain_id`, `name`, `type`);
+    """
+
+    # Locking is taken care of by BEGIN IMMEDIATE
+    SELECT_SOA_RECORD_FOR_UPDATE = "SELECT `id`, `content` " \
+                                   "FROM `records` " \
+                                   "WHERE `domain_id` = ? " \
+                                   "AND `type` = 'SOA' " \
+                                   "LIMIT 1"
+
+    FOR_UPDATE = ""
+
+    # Unlike MySQL, SQLite has no default LIKE escape character
+    FILTER_CONTENT_PREFIX = " AND `content` LIKE ? ESCAPE '\\'"
+
+    # Older SQLite builds allow at most 999 parameters per statement
+    INSERT_RECORDS_CHUNK = 150
+
+    def __init__(self, path, pool_size=4, pool_idle_time=300, timeout=30):
+        """
+        Initialise the connection pool.
+
+        Connections are shared by all instances using the same database. At
+        most pool_size are opened, and those idle for more than pool_idle_time
+        seconds are closed. Writers wait up to timeout seconds for another
+        transaction to release the database.
+        """
+
+        self.path    = path
+        self.timeout = float(timeout)
+
+        if path == ':memory:':
+            pool_size = 1
+
+        self.pool = ConnectionPool.get_pool(
+                ('sqlite', path), self._connect, max_size=int(pool_size),
+                max_idle_time=int(pool_idle_time))
+
+    def _connect(self):
+        """
+        Open a new connection, creating the schema if necessary.
+
+        Connections are handed between threads by the pool, but are only ever
+        used by one at a time.
+        """
+
+        db = sqlite3.connect(self.path, timeout=self.timeout,
+                             isolation_level=None, check_same_thread=False)
+        db.execute('PRAGMA journal_mode = WAL')
+        db.execute('PRAGMA synchronous = NORMAL')
+        db.executescript(self.SCHEMA)
+
+        return db
+
+    @contextmanager
+    def _transaction(self, read_only=False):
+        """
+        Get a cursor on a pooled connection, within a transaction.
+
+        The transaction is committed when the with block completes, or rolled
+        back if it raises. Unless read_only is set, the database's write lock
+        is taken immediately.
+        """
+
+        with self.pool.connection() as db:
+            cursor = db.cursor()
+            cursor.execute('BEGIN' if read_only else 'BEGIN IMMEDIATE')
+
+            # The transaction was begun by hand rather than by the sqlite3
+            # module, so it has to be ended by hand too
+            try:
+                yield cursor
+            except:
+                cursor.execute('ROLLBACK')
+                raise
+            else:
+                cursor.execute('COMMIT')
+            finally:
+                cursor.close()
@@ -0,0 +1,272 @@
+#!/usr/bin/env python3.2
+
+#
+# HyperNova server management framework
+#
+# DNS master file parser and renderer
+#
+# Copyright (c) 2012 TDM Ltd
+#                    Luke Carrier <luke.carrier@tdm.info>
+#
+
+"""
+Read and write zones in the RFC 1035 master file format, as used by BIND.
+
+Names within parsed zones are fully qualified and have no trailing full stop,
+matching the way the PowerDNS adapter stores them. As in PowerDNS, the
+priority of MX and SRV records is held separately from their content:
+
+    example.org.  3600  IN  SRV  10 5 5060 sip.example.org.
+
+becomes a record with priority 10 and content "5 5060 sip.example.org".
+
+Only the IN class and the record types in Record.RECORD_TYPES are supported.
+The $INCLUDE directive is not.
+"""
+
+from hypernova.libraries.appconfig import dnsserver as dns
+
+# Multipliers for TTL units (e.g. 1h30m)
+TTL_UNITS = {
+    's': 1,
+    'm': 60,
+    'h': 3600,
+    'd': 86400,
+    'w': 604800,
+}
+
+# Record types whose content is a domain name
+NAME_TYPES = ['cname', 'ns', 'ptr']
+
+def parse(text, origin=None):
+    """
+    Parse a zone from the contents of a master file.
+
+    origin is the initial value of $ORIGIN, and is overridden by any $ORIGIN
+    directive in the file. The zone's domain is the origin in effect at its SOA
+    record. Raises InvalidZoneError, with the offending line number, if the file
+    can't be parsed.
+    """
+
+    zone = dns.Zone()
+    if origin:
+        origin = origin.rstrip('.')
+
+    owner = None
+    for (line_no, indented, tokens) in _tokenise(text):
+        try:
+            if tokens[0].upper() == '$ORIGIN':
+                origin = tokens[1].rstrip('.')
+                zone.origin = origin
+                continue
+            elif tokens[0].upper() == '$TTL':
+                zone.ttl = parse_ttl(tokens[1])
+                continue
+            elif tokens[0].startswith('$'):
+                raise ValueError('unsupported directive %s' %(tokens[0]))
+
+            if not indented:
+                owner = _absolute(tokens.pop(0), origin)
+            elif owner is None:
+                raise ValueError('no owner name')
+
+            ttl = None
+            while tokens[0].upper() in ('IN', 'CH', 'HS') \
+                    or tokens[0][0].isdigit():
+                token = tokens.pop(0)
+                if token[0].isdigit():
+                    ttl = parse_ttl(token)
+                elif token.upper() != 'IN':
+                    raise ValueError('unsupported class %s' %(token))
+
+            rtype = tokens.pop(0).lower()
+            if rtype == 'soa':
+                if zone.soa_record:
+                    raise ValueError('duplicate SOA record')
+
+                zone.domain = owner
+                zone.soa_record = dns.SoaRecord(
+                        _absolute(tokens[0], origin),
+                        _absolute(tokens[1], origin),
+                        *[parse_ttl(t) for t in tokens[2:7]])
+                continue
+
+            zone.add_record(_parse_record(owner, ttl, rtype, tokens, origin))
+        except (IndexError, ValueError) as e:
+            raise dns.InvalidZoneError('line %d: %s' %(line_no, e))
+
+    if not zone.soa_record:
+        raise dns.InvalidZoneError('no SOA record')
+
+    # Records with no explicit TTL take the $TTL value, or failing that the
+    # SOA's minimum TTL
+    default_ttl = zone.ttl if zone.ttl is not None else zone.soa_record.min_ttl
+    for r in zone.records:
+        if r.ttl is None:
+            r.ttl = default_ttl
+
+    return zone
+
+def render(zone):
+    """
+    Render a zone as a master file.
+
+    The file is generated a line at a time, so that large zones can be written
+    out without being held in memory as a single string. Raises an
+    InvalidZoneError if the zone has no SOA record. Records without a TTL are
+    written without one, and so take the zone's default when read back.
+    """
+
+    soa = zone.soa_record
+    if not soa:
+        raise dns.InvalidZoneError('no SOA record')
+
+    yield '$ORIGIN %s.' %(zone.domain)
+    if zone.ttl is not None:
+        yield '$TTL %d' %(int(zone.ttl))
+
+    yield '%s. IN SOA %s. %s. ( %s %s %s %s %s )' \
+          %(zone.domain, soa.primary_ns, soa.responsible_person, soa.serial,
+            soa.refresh, soa.retry, soa.expire, soa.min_ttl)
+
+    for r in zone.records:
+        rtype   = dns.Record.RECORD_TYPES[r.rtype]
+        content = r.content
+        if rtype in NAME_TYPES or rtype in ('mx', 'srv'):
+            content = '%s.' %(content)
+
+        if r.priority is not None and rtype in ('mx', 'srv'):
+            content = '%d %s' %(int(r.priority), content)
+
+        if r.ttl is None:
+            yield '%s. IN %s %s' %(r.name, rtype.upper(), content)
+        else:
+            yield '%s. %d IN %s %s' %(r.name, int(r.ttl), rtype.upper(),
+                                      content)
+
+def parse_ttl(value):
+    """
+    Parse a TTL, which may be expressed in units (e.g. 1h30m).
+    """
+
+    if value.isdigit():
+        return int(value)
+
+    total = 0
+    number = ''
+    for char in value.lower():
+        if char.isdigit():
+            number += char
+        elif char in TTL_UNITS and number:
+            total += int(number) * TTL_UNITS[char]
+            number = ''
+        else:
+            raise ValueError('invalid TTL %s' %(value))
+
+    if number:
+        raise ValueError('invalid TTL %s' %(value))
+
+    return total
+
+def _absolute(name, origin):
+    """
+    Qualify a name relative to the origin, stripping the trailing full stop.
+    """
+
+    if name == '@':
+        if not origin:
+            raise ValueError('@ used without an origin')
+        return origin
+    elif name.endswith('.'):
+        return name[:-1]
+    elif not origin:
+        raise ValueError('relative name %s used without an origin' %(name))
+
+    return '%s.%s' %(name, origin)
+
+def _parse_record(name, ttl, rtype, rdata, origin):
+    """
+    Build a Record from the type and data fields of a line.
+    """
+
+    try:
+        rtype_index = dns.Record.RECORD_TYPES.index(rtype)
+    except ValueError:
+        raise ValueError('unsupported record type %s' %(rtype.upper()))
+
+    priority = None
+    if rtype in NAME_TYPES:
+        content = _absolute(rdata[0], origin)
+    elif rtype == 'mx':
+        priority = int(rdata[0])
+        content  = _absolute(rdata[1], origin)
+    elif rtype == 'srv':
+        priority = int(rdata[0])
+        content  = ' '.join(rdata[1:3] + [_absolute(rdata[3], origin)])
+    elif rdata:
+        content = ' '.join(rdata)
+    else:
+        raise ValueError('no record data')
+
+    return dns.Record(name, rtype_index, content, ttl, priority)
+
+def _tokenise(text):
+    """
+    Split a master file into entries.
+
+    Yields a tuple of the line number an entry starts on, whether or not it's
+    indented (in which case the owner is that of the previous entry) and its
+    tokens. Comments are discarded, parenthesised entries spanning several
+    lines are joined and quoted strings are kept (quotes and all) as a single
+    token.
+    """
+
+    tokens   = []
+    depth    = 0
+    start    = None
+    indented = False
+
+    for (line_no, line) in enumerate(text.splitlines(), 1):
+        if not depth:
+            start    = line_no
+            indented = line[:1].isspace()
+
+        token  = ''
+        quoted = False
+        for char in line:
+            if quoted:
+                token += char
+                if char == '"':
+                    quoted = False
+            elif char == '"':
+                token += char
+                quoted = True
+            elif char == ';':
+                break
+            elif char in '()' or char.isspace():
+                if token:
+                    tokens.append(token)
+                    token = ''
+
+                if char == '(':
+                    depth += 1
+                elif char == ')':
+                    depth -= 1
+            else:
+                token += char
+
+        if quoted:
+            raise dns.InvalidZoneError('line %d: unterminated string'
+                                       %(line_no))
+        if token:
+            tokens.append(token)
+
+        if depth < 0:
+            raise dns.InvalidZoneError('line %d: unbalanced parentheses'
+                                       %(line_no))
+        if not depth and tokens:
+            yield (start, indented, tokens)
+            tokens = []
+
+    if depth:
+        raise dns.InvalidZoneError('line %d: unbalanced parentheses' %(start))
@@ -9,10 +9,90 @@
 #                    Luke Carrier <luke.carrier@tdm.info>
 #
 
-from http.client import HTTPConnection
+import errno
+from http.client import BadStatusLine, HTTPConnection, HTTPException
 from hypernova.libraries.gnupg import GPG
+from hypernova.libraries.securityfilters import RESET_HEADER, \
+                                                SIGNED_HEADER, \
+                                                AuthenticationError, \
+                                                get_security_filter
 import json
 import os
+import socket
+import threading
+
+# Errors raised by writing to, or reading from, connections the agent has
+# closed; a reused connection failing with one of these before any of the
+# response has arrived was closed whilst idle
+STALE_ERRNOS = (errno.ECONNABORTED, errno.ECONNRESET, errno.EPIPE)
+
+class ConnectionPool:
+    """
+    Pool of persistent HTTP connections, keyed by address.
+
+    Connections are handed out to one query at a time and returned once the
+    response has been read, so a burst of requests to the same node can reuse
+    a single TCP connection instead of paying for a new handshake each time.
+    """
+
+    def __init__(self, max_idle=4):
+        """
+        Initialise the pool.
+
+        max_idle is the maximum number of idle connections retained per node;
+        any extra connections are closed when they're released.
+        """
+
+        self.max_idle = max_idle
+
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, host, port, timeout=None):
+        """
+        Get a connection, whose socket operations time out after timeout
+        seconds (None to wait indefinitely).
+
+        Returns a tuple containing the connection and a boolean indicating
+        whether or not it has been used before.
+        """
+
+        with self._lock:
+            idle = self._idle.get((host, port))
+            if idle:
+                connection = idle.pop()
+                connection.timeout = timeout
+                if connection.sock:
+                    connection.sock.settimeout(timeout)
+                return (connection, True)
+
+        return (HTTPConnection(host, port, timeout=timeout), False)
+
+    def release(self, host, port, connection):
+        """
+        Return a connection to the pool for reuse.
+        """
+
+        with self._lock:
+            idle = self._idle.setdefault((host, port), [])
+            if len(idle) < self.max_idle:
+                idle.append(connection)
+                return
+
+        connection.close()
+
+    def clear(self):
+        """
+        Close all idle connections.
+        """
+
+        with self._lock:
+            (idle, self._idle) = (self._idle, {})
+
+        for connections in idle.values():
+            for connection in connections:
+                connection.close()
+
 
 class Client:
 
@@ -24,49 +104,148 @@ class Client:
     M_GET  = 'GET'
     M_POST = 'POST'
 
-    def __init__(self, host='127.0.0.1', port=8080, gpg_dir=None):
+    # Connections, shared between all clients in the process
+    connection_pool = ConnectionPool()
+
+    # Security filters, shared between all clients in the process
+    #
+    # Keyed by filter name, GPG directory and options, so that stateful filters
+    # (such as the session filter) can reuse their state across Client objects
+    # configured alike.
+    security_filters = {}
+
+    def __init__(self, host='127.0.0.1', port=8080, gpg_dir=None,
+                 security_filter='gnupg', security_options={},
+                 keep_alive=True, timeout=None):
 
         self.host = host
         self.port = port
         self.gpg_dir = gpg_dir
+        self.keep_alive = keep_alive
+        self.timeout = timeout
 
         if not self.gpg_dir:
             self.gpg_dir = os.path.join(os.getenv('HOME'), '.hypernova', 'gpg')
 
         self._init_connection()
-        self._init_gpg()
+        self._init_security_filter(security_filter, security_options)
 
     def _init_connection(self):
 
-        self._connection = HTTPConnection(self.host, self.port)
+        self._pool = Client.connection_pool
+
+    def _init_security_filter(self, name, options):
 
-    def _init_gpg(self):
+        key = (name, self.gpg_dir, tuple(sorted(dict(options).items())))
 
-        self._gpg = GPG.get_gpg(gnupghome=self.gpg_dir)
+        if key not in Client.security_filters:
+            gpg = GPG.get_gpg(gnupghome=self.gpg_dir)
+            Client.security_filters[key] = get_security_filter(name, gpg,
+                                                               options)
+
+        self._filter = Client.security_filters[key]
 
     def query(self, params, client_fp, server_fp):
 
         if not isinstance(params, str):
             params = json.dumps(params)
 
-        params = self._gpg.encrypt(params, server_fp, sign=client_fp)
-        encrypted_params = str(params)
-
-        if not params:
-            raise ValueError('Invalid passphrase, or the server\'s key has ' \
-                             'not been signed')
-
-        http_headers = {'Content-Length': len(encrypted_params)}
-        self._connection.request(self.M_GET, '/', body=encrypted_params,
-                                 headers=http_headers)
-
-        response = self._connection.getresponse()
-        response_data = str(response.read(), 'UTF-8')
-
-        response_data = self._gpg.decrypt(response_data)
-        if response_data.fingerprint != server_fp:
-            raise ValueError('Response was not signed')
-
-        self._connection.close()
-
-        return json.loads(str(response_data))
+        # If the agent has forgotten our session (e.g. it was restarted), it'll
+        # refuse our request unread and say so; discard the session and retry
+        # once. Other refusals (e.g. of replays) are never retried, since the
+        # request may already have been carried out.
+        for attempt in range(2):
+            try:
+                encrypted_params = self._filter.encrypt(params, client_fp,
+                                                        server_fp)
+            except AuthenticationError:
+                raise ValueError('Invalid passphrase, or the server\'s key ' \
+                                 'has not been signed')
+
+            (status, headers, response_data) = \
+                    self._request(encrypted_params)
+
+            # Agents without the capacity to serve a request turn it away
+            # unread, with a signed (rather than encrypted) response. Any
+            # session handshake the request carried was lost with it.
+            if status == 503 and headers.get(SIGNED_HEADER.lower()):
+                self._filter.reset(server_fp)
+                try:
+                    (response_data, sender) = self._filter.verify(
+                            response_data, server_fp, client_fp)
+                    break
+                except AuthenticationError:
+                    raise ValueError('Response was not signed')
+
+            try:
+                (response_data, sender) = self._filter.decrypt(response_data,
+                                                               server_fp,
+                                                               client_fp)
+                break
+            except AuthenticationError:
+                if attempt or status != 403 \
+                        or not headers.get(RESET_HEADER.lower()) \
+                        or not self._filter.reset(server_fp):
+                    raise ValueError('Response was not signed')
+
+        return json.loads(response_data)
+
+    def _request(self, body):
+        """
+        Send a request body to the agent and read the response.
+
+        Returns a tuple containing the HTTP status, the response headers (with
+        lowercase names) and the response body. Idle connections may have been
+        closed by the agent since we last used them, so a reused connection
+        which proves to be closed (see _is_stale()) is replaced with a new one
+        and the request sent again, once. Nothing else is retried: the agent
+        may have carried out the request.
+        """
+
+        body = bytes(body, 'UTF-8')
+        http_headers = {'Content-Length': len(body)}
+
+        for attempt in range(2):
+            (connection, reused) = self._pool.acquire(self.host, self.port,
+                                                      self.timeout)
+
+            try:
+                connection.request(self.M_GET, '/', body=body,
+                                   headers=http_headers)
+                response = connection.getresponse()
+            except (BadStatusLine, socket.error) as e:
+                connection.close()
+                if reused and not attempt and self._is_stale(e):
+                    continue
+                raise
+
+            try:
+                response_data = response.read()
+            except (HTTPException, socket.error):
+                connection.close()
+                raise
+
+            if self.keep_alive and not response.will_close:
+                self._pool.release(self.host, self.port, connection)
+            else:
+                connection.close()
+
+            headers = dict((name.lower(), value)
+                           for (name, value) in response.getheaders())
+            return (response.status, headers, str(response_data, 'UTF-8'))
+
+    def _is_stale(self, e):
+        """
+        Was a request refused because the agent had closed the connection?
+
+        The agent closes idle connections without reading what's already been
+        sent on them, so either the request couldn't be written at all, or the
+        connection was closed without a byte of response. Timeouts don't
+        qualify: the agent may still be carrying out the request.
+        """
+
+        # BadStatusLine records an empty status line as its repr()
+        if isinstance(e, BadStatusLine):
+            return e.line in ('', repr(''))
+
+        return not isinstance(e, socket.timeout) and e.errno in STALE_ERRNOS
@@ -9,60 +9,447 @@
 #                    Luke Carrier <luke.carrier@tdm.info>
 #
 
+from collections import namedtuple, OrderedDict
 from configparser import SafeConfigParser
+import configparser
+import marshal
 import os
+import tempfile
+
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+
+# Default for options which must be set, in a ConfigurationSchema
+REQUIRED = object()
 
 class ConfigurationFactory():
     """
     Initialise a SafeConfigParser object from files in a specified directory.
+
+    Parsing the files is skipped where possible. Once parsed, the configuration
+    is saved to a compiled cache (a hidden file in the directory, or alongside
+    the file if root_dir is one), which is used instead for as long as the
+    names, modification times and sizes of the files are unchanged. This
+    spares the provisioner processes spawned by the agent, amongst others,
+    from parsing the same files again.
     """
 
-    configs = {}
+    # Name of the compiled cache, within the configuration directory
+    CACHE_FILE = '.compiled'
 
-    def get(name, root_dir=None, log=None):
+    # Version of the compiled cache's format; bump on incompatible changes
+    CACHE_VERSION = 1
 
-        if name not in ConfigurationFactory.configs:
-            config = SafeConfigParser()
+    # The current configurations, as tuples containing the parser and the
+    # snapshot (None if the configuration has no schema), and the directories
+    # they were loaded from
+    published = {}
+    root_dirs = {}
+
+    # Schemas of the configurations which have them
+    schemas = {}
+
+    def get(name, root_dir=None, log=None, schema=None):
+        """
+        Get a configuration, loading it if it hasn't been already.
+
+        If a schema is given, a snapshot of the configuration is made
+        available through get_snapshot(), and a ValidationError is raised if
+        the configuration doesn't conform to it.
+        """
+
+        if name not in ConfigurationFactory.published:
+            ConfigurationFactory.publish(
+                    name, ConfigurationFactory.load(root_dir, log), schema)
+            ConfigurationFactory.root_dirs[name] = root_dir
+
+        return ConfigurationFactory.published[name][0]
+
+    def get_snapshot(name):
+        """
+        Get the current snapshot of a configuration with a schema.
+
+        The snapshot is immutable, so it may be shared between threads, and
+        kept for as long as is convenient (e.g. for the duration of a request)
+        without ever seeing a half-reloaded configuration. Raises KeyError if
+        the configuration has no schema.
+        """
+
+        snapshot = ConfigurationFactory.published[name][1]
+        if snapshot is None:
+            raise KeyError(name)
+
+        return snapshot
+
+    def publish(name, config, schema=None):
+        """
+        Make a configuration, and its snapshot if it has a schema, current.
+
+        The snapshot is built (and the configuration validated) before
+        anything is published, and the two are then published together in a
+        single step, so that no thread sees the new configuration with the old
+        snapshot (or vice versa).
+        """
+
+        if not schema:
+            schema = ConfigurationFactory.schemas.get(name)
+
+        snapshot = None
+        if schema:
+            snapshot = schema.snapshot(config)
+            ConfigurationFactory.schemas[name] = schema
+
+        ConfigurationFactory.published[name] = (config, snapshot)
+
+    def reload(name, log=None):
+        """
+        Reload a configuration from the directory it was loaded from.
+
+        The new configuration replaces the old in a single step, so objects
+        which call get() (or get_snapshot()) whenever they need it see either
+        one or the other. If it can't be loaded, or doesn't conform to its
+        schema, the old configuration is left in place.
+        """
+
+        config = ConfigurationFactory.load(
+                ConfigurationFactory.root_dirs[name], log)
+        ConfigurationFactory.publish(name, config)
+
+        return config
+
+    def load(root_dir, log=None):
+        """
+        Load a configuration, from the compiled cache if it's current.
+        """
+
+        (config_files, cache_file) = \
+                ConfigurationFactory._get_files(root_dir, log)
+        signature = ConfigurationFactory._get_signature(config_files)
+
+        config = ConfigurationFactory._load_compiled(cache_file, signature,
+                                                     log)
+        if config is None:
+            config = ConfigurationFactory._parse(config_files, log)
+            ConfigurationFactory._save_compiled(cache_file, signature, config,
+                                                log)
+
+        return config
+
+    def _get_files(root_dir, log=None):
+        """
+        Get the paths to the files in a configuration directory, in the order
+        they're loaded, and to its compiled cache.
+        """
+
+        try:
+            config_files = os.listdir(root_dir)
+        except OSError:
+            if not os.path.isfile(root_dir):
+                if log:
+                    log.error('directory does not exist')
 
+                raise LoadError
+
+            (head, tail) = os.path.split(root_dir)
+            return ([root_dir], os.path.join(
+                    head, '.%s%s' %(tail, ConfigurationFactory.CACHE_FILE)))
+
+        config_files.sort()
+
+        paths = []
+        for config_file in config_files:
+
+            # Skip dotfiles (including our own cache) and directories
+            if config_file.startswith('.'):
+                if log and not config_file.startswith(
+                        ConfigurationFactory.CACHE_FILE):
+                    log.warn('skipping hidden item %s' %(config_file))
+
+                continue
+
+            paths.append(os.path.join(root_dir, config_file))
+
+        return (paths, os.path.join(root_dir, ConfigurationFactory.CACHE_FILE))
+
+    def _get_signature(config_files):
+        """
+        Get the names, modification times and sizes of the configuration
+        files, which must match those in the compiled cache for it to be used.
+        """
+
+        signature = []
+        for config_file in config_files:
             try:
-                config_files = os.listdir(root_dir)
-                config_files.sort()
+                stat = os.stat(config_file)
+                signature.append((config_file, stat.st_mtime, stat.st_size))
+            except OSError:
+                signature.append((config_file, None, None))
+
+        return signature
 
-                for config_file in config_files:
+    def _parse(config_files, log=None):
+        """
+        Parse the configuration files.
+        """
 
-                    # Skip dotfiles and directories
-                    if config_file.startswith('.'):
-                        if log:
-                            log.warn('skipping hidden item %s' %(config_file))
+        config = SafeConfigParser()
 
-                        continue
+        for config_file in config_files:
+            if log:
+                log.info('loading configuration file %s'
+                         %(os.path.basename(config_file)))
+
+            try:
+                with open(config_file, 'r') as f:
+                    config.read_file(f)
+            except IOError:
+                if log:
+                    log.warn('failed to load file %s; is it a directory?'
+                             %(config_file))
 
+        return config
+
+    def _load_compiled(cache_file, signature, log=None):
+        """
+        Load the configuration from the compiled cache.
+
+        Returns None if the cache is missing, stale or can't be trusted.
+        """
+
+        try:
+            with open(cache_file, 'rb') as f:
+
+                # Whoever can write to the cache can alter the configuration
+                stat = os.fstat(f.fileno())
+                if stat.st_uid not in (0, os.getuid()) \
+                        or stat.st_mode & 0o022:
                     if log:
-                        log.info('loading configuration file %s' %(config_file))
+                        log.warn('ignoring compiled configuration %s; it may '
+                                 'be modified by other users' %(cache_file))
+
+                    return None
+
+                compiled = marshal.load(f)
+        except (IOError, OSError, EOFError, ValueError, TypeError):
+            return None
+
+        try:
+            if compiled['version'] != ConfigurationFactory.CACHE_VERSION \
+                    or compiled['signature'] != signature:
+                return None
+
+            config = SafeConfigParser()
+            config.read_dict(OrderedDict(
+                    (section, OrderedDict(options))
+                    for (section, options) in compiled['sections']))
+        except (KeyError, TypeError, ValueError, configparser.Error):
+            return None
+
+        if log:
+            log.info('loaded compiled configuration %s' %(cache_file))
+
+        return config
+
+    def _save_compiled(cache_file, signature, config, log=None):
+        """
+        Save the configuration to the compiled cache.
+
+        The cache is replaced atomically, and is readable only by its owner.
+        Failing to save it (e.g. because the directory is read-only) only
+        means the files are parsed again next time.
+        """
 
-                    config_file = os.path.join(root_dir, config_file)
-                    try:
-                        with open(config_file, 'r') as f:
-                            config.read_file(f)
-                    except IOError:
-                        if log:
-                            log.warn('failed to load file %s; is it a directory?'
-                                     %(config_file))
+        # SafeConfigParser offers no public means of getting a section's own
+        # options, without the defaults
+        sections = [(config.default_section, list(config.defaults().items()))]
+        for section in config.sections():
+            sections.append((section, list(config._sections[section].items())))
 
+        compiled = {
+            'version':   ConfigurationFactory.CACHE_VERSION,
+            'signature': signature,
+            'sections':  sections,
+        }
+
+        try:
+            (fd, temp_path) = tempfile.mkstemp(
+                    prefix=os.path.basename(cache_file) + '.',
+                    dir=os.path.dirname(cache_file))
+        except (IOError, OSError) as e:
+            if log:
+                log.debug('not saving compiled configuration: %s' %(e))
+
+            return
+
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                marshal.dump(compiled, f)
+            ConfigurationFactory._set_permissions(temp_path, signature)
+            os.rename(temp_path, cache_file)
+        except (IOError, OSError, ValueError) as e:
+            os.unlink(temp_path)
+            if log:
+                log.debug('not saving compiled configuration: %s' %(e))
+
+    def _set_permissions(cache_file, signature):
+        """
+        Make the compiled cache no more accessible than the files it was
+        compiled from, but as accessible as all of them (e.g. to the agent, if
+        the cache was written by a provisioner running as root).
+
+        The cache is never writable by anybody but its owner.
+        """
+
+        (mode, gids) = (0o644, set())
+        for (config_file, mtime, size) in signature:
+            try:
+                stat = os.stat(config_file)
             except OSError:
-                if not os.path.isfile(root_dir):
-                    if log:
-                        log.error('directory does not exist')
+                continue
 
-                    raise LoadError
+            mode &= stat.st_mode
+            gids.add(stat.st_gid)
 
-                with open(root_dir, 'r') as f:
-                    config.read_file(f)
+        if len(gids) == 1:
+            try:
+                os.chown(cache_file, -1, gids.pop())
+            except OSError:
+                pass
+
+        os.chmod(cache_file, (mode & 0o644) | 0o600)
+
+
+class ConfigurationSchema:
+    """
+    Describes the sections of a configuration, for building snapshots.
+
+    sections maps the name of each section either to a list of (option, type,
+    default) tuples, or to a single type for sections whose options can't be
+    known in advance (e.g. those passed on to DNS adapters). Types are str,
+    int, float and bool; defaults may be REQUIRED.
+    """
+
+    def __init__(self, sections):
+        """
+        Initialise values.
+        """
+
+        self.sections = sections
+
+        self._section_types = {}
+        for (name, options) in sections.items():
+            if isinstance(options, list):
+                self._section_types[name] = namedtuple(
+                        '%sSection' %(name.capitalize()),
+                        [option for (option, kind, default) in options])
+
+    def snapshot(self, config):
+        """
+        Build a snapshot of a configuration.
+
+        Raises a ValidationError if a value can't be converted to its type, or
+        a required option (or the section containing it) is missing.
+        """
+
+        sections = {}
+
+        for (name, options) in self.sections.items():
+            if not config.has_section(name):
+                if isinstance(options, list) \
+                        and any(default is REQUIRED
+                                for (option, kind, default) in options):
+                    raise ValidationError('the %s section is required'
+                                          %(name))
+
+                continue
+
+            if not isinstance(options, list):
+                sections[name] = FrozenMapping(
+                        (option, self._convert(config, name, option, options))
+                        for option in config.options(name))
+                continue
+
+            values = []
+            for (option, kind, default) in options:
+                if config.has_option(name, option):
+                    values.append(self._convert(config, name, option, kind))
+                elif default is REQUIRED:
+                    raise ValidationError('%s.%s is required' %(name, option))
+                else:
+                    values.append(default)
 
-            ConfigurationFactory.configs[name] = config
+            sections[name] = self._section_types[name](*values)
 
-        return ConfigurationFactory.configs[name]
+        return ConfigurationSnapshot(sections)
+
+    def _convert(self, config, section, option, kind):
+        """
+        Get an option's value, converted to its type.
+        """
+
+        try:
+            if kind is bool:
+                return config.getboolean(section, option)
+
+            return kind(config.get(section, option))
+        except (ValueError, configparser.Error) as e:
+            raise ValidationError('%s.%s is invalid: %s' %(section, option, e))
+
+
+class ConfigurationSnapshot:
+    """
+    Immutable, typed copy of a configuration.
+
+    Each section described by the schema is an attribute: a named tuple of
+    its options, converted to their types with defaults filled in, or a
+    FrozenMapping for sections whose options aren't known in advance. Optional
+    sections missing from the configuration are missing from the snapshot.
+    """
+
+    def __init__(self, sections):
+        for (name, section) in sections.items():
+            object.__setattr__(self, name, section)
+
+    def __contains__(self, name):
+        return name in self.__dict__
+
+    def __setattr__(self, name, value):
+        raise AttributeError('configuration snapshots are immutable')
+
+    def __delattr__(self, name):
+        raise AttributeError('configuration snapshots are immutable')
+
+
+class FrozenMapping(Mapping):
+    """
+    Read-only dictionary.
+    """
+
+    def __init__(self, items):
+        self._items = dict(items)
+
+    def __getitem__(self, key):
+        return self._items[key]
+
+    def __iter__(self):
+        return iter(self._items)
+
+    def __len__(self):
+        return len(self._items)
+
+    def __repr__(self):
+        return 'FrozenMapping(%r)' %(self._items)
 
 
 class LoadError(Exception):
     pass
+
+
+class ValidationError(LoadError):
+    """
+    A configuration doesn't conform to its schema.
+    """
+
+    pass
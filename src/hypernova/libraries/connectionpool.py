@@ -0,0 +1,254 @@
+#!/usr/bin/env python3.2
+
+#
+# HyperNova server management framework
+#
+# Generic connection pool
+#
+# Copyright (c) 2012 TDM Ltd
+#                    Luke Carrier <luke.carrier@tdm.info>
+#
+
+"""
+Thread-safe pooling for connections to external services (e.g. databases).
+
+Pools are shared by the whole process and keyed by the credentials used to
+create their connections, so that every adapter instance talking to the same
+server reuses the same connections:
+
+    pool = ConnectionPool.get_pool(('mysql', host, user, db), connect)
+    with pool.connection() as db:
+        ...
+"""
+
+from contextlib import contextmanager
+import threading
+import time
+
+class ConnectionPool:
+    """
+    Connection pool.
+
+    Up to max_size connections are created on demand with connect() and reused
+    thereafter. Connections idle for longer than max_idle_time seconds are
+    closed; those idle for longer than check_interval seconds are passed to
+    check() before they're handed out, and replaced if they fail it.
+    """
+
+    # Pools, keyed by credentials
+    pools = {}
+
+    _pools_lock = threading.Lock()
+
+    def get_pool(key, connect, **options):
+        """
+        Get the (shared) pool for the specified key, creating it if necessary.
+
+        options are passed to the ConnectionPool constructor when the pool is
+        created, and ignored thereafter.
+        """
+
+        with ConnectionPool._pools_lock:
+            if key not in ConnectionPool.pools:
+                ConnectionPool.pools[key] = ConnectionPool(connect, **options)
+
+            return ConnectionPool.pools[key]
+
+    def __init__(self, connect, max_size=8, max_idle_time=300, check=None,
+                 check_interval=30, broken=(), wait_timeout=None):
+        """
+        Initialise the pool.
+
+        connect is called with no arguments to create a connection, and check
+        with a connection to ensure it's still usable (it should return False
+        or raise if not). Exceptions in broken raised while a connection is in
+        use indicate that it's no longer usable, and cause it to be discarded
+        rather than returned to the pool. wait_timeout is the number of seconds
+        to wait for a connection when the pool is exhausted (None waits
+        forever).
+        """
+
+        self.connect        = connect
+        self.max_size       = max_size
+        self.max_idle_time  = max_idle_time
+        self.check          = check
+        self.check_interval = check_interval
+        self.broken         = broken
+        self.wait_timeout   = wait_timeout
+
+        # Idle connections as (connection, time released) tuples, the most
+        # recently used last, and the number of connections in existence
+        self._idle = []
+        self._size = 0
+
+        self._available = threading.Condition(threading.Lock())
+
+    def acquire(self):
+        """
+        Get a connection, waiting for one to be released if the pool is full.
+
+        Raises PoolExhaustedError if none became available within the wait
+        timeout.
+        """
+
+        deadline = None
+        if self.wait_timeout is not None:
+            deadline = time.time() + self.wait_timeout
+
+        with self._available:
+            while True:
+                self._evict()
+
+                if self._idle:
+                    (connection, released) = self._idle.pop()
+                    break
+
+                if self._size < self.max_size:
+                    self._size += 1
+                    connection = None
+                    break
+
+                timeout = None
+                if deadline:
+                    timeout = deadline - time.time()
+                    if timeout <= 0:
+                        raise PoolExhaustedError()
+
+                self._available.wait(timeout)
+
+        # Connecting and checking may block, so we do both without the lock
+        if connection and time.time() - released >= self.check_interval \
+                and not self._check(connection):
+            self._discard(connection)
+            return self.acquire()
+
+        if not connection:
+            try:
+                connection = self.connect()
+            except:
+                with self._available:
+                    self._size -= 1
+                    self._available.notify()
+                raise
+
+        return connection
+
+    def release(self, connection, discard=False):
+        """
+        Return a connection to the pool, or discard it if it's no longer
+        usable.
+        """
+
+        if discard:
+            self._discard(connection)
+            return
+
+        with self._available:
+            self._idle.append((connection, time.time()))
+            self._available.notify()
+
+    @contextmanager
+    def connection(self):
+        """
+        Borrow a connection for the duration of a with block.
+        """
+
+        connection = self.acquire()
+
+        try:
+            yield connection
+        except self.broken:
+            self.release(connection, True)
+            raise
+        except:
+            self.release(connection)
+            raise
+
+        self.release(connection)
+
+    def clear(self):
+        """
+        Close all idle connections.
+        """
+
+        with self._available:
+            (idle, self._idle) = (self._idle, [])
+            self._size -= len(idle)
+            self._available.notify_all()
+
+        for (connection, released) in idle:
+            self._close(connection)
+
+    def size(self):
+        """
+        Get the number of connections in existence, both idle and in use.
+        """
+
+        return self._size
+
+    def _check(self, connection):
+        """
+        Ensure a connection is still usable.
+        """
+
+        if not self.check:
+            return True
+
+        try:
+            return self.check(connection) is not False
+        except Exception:
+            return False
+
+    def _close(self, connection):
+        """
+        Close a connection, ignoring failures; it's being thrown away anyway.
+        """
+
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def _discard(self, connection):
+        """
+        Close a connection and free its slot.
+        """
+
+        self._close(connection)
+
+        with self._available:
+            self._size -= 1
+            self._available.notify()
+
+    def _evict(self):
+        """
+        Close connections which have been idle for too long.
+
+        Must be called with the lock held. The oldest connections are at the
+        front of the list.
+        """
+
+        if not self.max_idle_time:
+            return
+
+        cutoff = time.time() - self.max_idle_time
+        expired = 0
+        while expired < len(self._idle) and self._idle[expired][1] < cutoff:
+            expired += 1
+
+        if expired:
+            for (connection, released) in self._idle[:expired]:
+                self._close(connection)
+
+            del self._idle[:expired]
+            self._size -= expired
+
+
+class PoolExhaustedError(Exception):
+    """
+    Pool exhausted error.
+
+    Thrown when no connection became available within the pool's wait timeout.
+    """
+
+    pass
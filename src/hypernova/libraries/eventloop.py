@@ -0,0 +1,574 @@
+#!/usr/bin/env python3.2
+
+#
+# HyperNova server management framework
+#
+# Event loop HTTP server
+#
+# Copyright (c) 2012 TDM Ltd
+#                    Luke Carrier <luke.carrier@tdm.info>
+#
+
+"""
+An alternative to socketserver's ThreadingMixIn for HTTP servers.
+
+Rather than dedicating a thread to every connection, a single thread multiplexes
+all of the connections with poll(), buffering requests until they've been read
+in their entirety. Complete requests are then handed to a bounded pool of
+worker threads, which run the (blocking) request handler against the buffered
+request and return the buffered response to the loop for writing.
+
+This keeps the number of threads constant under load, whilst the limits below
+apply backpressure: connections beyond max_connections are left in the listen
+backlog, and once workers + max_queued requests are in flight we stop
+dispatching (and eventually reading) until the workers catch up.
+"""
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import errno
+from io import BytesIO
+import queue
+import re
+import select
+import socket
+import socketserver
+import threading
+import time
+
+# Framing
+#
+# We only need to know where each request ends, so we read no further into the
+# headers than the Content-Length.
+HEADER_END     = re.compile(b'\r?\n\r?\n')
+CONTENT_LENGTH = re.compile(b'^content-length:[ \t]*([0-9]+)[ \t]*\r?$',
+                            re.IGNORECASE | re.MULTILINE)
+
+# Errors which mean "try again later" on a non-blocking socket
+RETRY_ERRNOS = (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR)
+
+class EventLoopHTTPServer(socketserver.TCPServer):
+    """
+    Event loop HTTP server.
+
+    Request handler classes must be compatible with BufferedRequestHandlerMixIn.
+    """
+
+    allow_reuse_address = True
+
+    # Limits
+    #
+    # max_connections caps the number of open connections, workers the number
+    # of requests handled concurrently and max_queued the number of complete
+    # requests which may wait for a worker.
+    max_connections = 1024
+    workers         = 16
+    max_queued      = 64
+
+    # Maximum number of complete requests buffered per connection before we
+    # stop reading from it
+    max_pipelined = 16
+
+    # Seconds a connection may sit idle, or take to send a request in its
+    # entirety (however steadily it trickles in), before we close it
+    request_timeout = None
+
+    max_header_size  = 65536
+    max_request_size = 16 * 1024 * 1024
+
+    def __init__(self, server_address, RequestHandlerClass,
+                 bind_and_activate=True):
+        """
+        Initialise the server.
+        """
+
+        super().__init__(server_address, RequestHandlerClass, bind_and_activate)
+
+        self.connections = {}
+
+        self._ready     = deque()
+        self._completed = queue.Queue()
+        self._in_flight = 0
+
+        (self._wake_r, self._wake_w) = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._wake_w.setblocking(False)
+
+        self._running = False
+        self._stopped = threading.Event()
+        self._stopped.set()
+
+    def serve_forever(self, poll_interval=0.5):
+        """
+        Run the event loop until shutdown() is called.
+        """
+
+        # Overridden from BaseServer
+        #
+        # We run our own loop in place of the stock accept-and-handle loop.
+
+        self.socket.setblocking(False)
+
+        self._executor  = ThreadPoolExecutor(self.workers)
+        self._poller    = select.poll()
+        self._accepting = False
+        self._next_expiry = 0
+
+        self._poller.register(self._wake_r, select.POLLIN)
+
+        self._running = True
+        self._stopped.clear()
+
+        try:
+            while self._running:
+                self._update_accepting()
+
+                for (fd, events) in self._poll(poll_interval):
+                    if fd == self._wake_r.fileno():
+                        self._drain_wake()
+                    elif fd == self.socket.fileno():
+                        self._accept()
+                    elif fd in self.connections:
+                        self._service(self.connections[fd], events)
+
+                self._collect()
+                self._dispatch()
+                self._expire()
+        finally:
+            for connection in list(self.connections.values()):
+                self._close(connection)
+
+            self._executor.shutdown(wait=False)
+            self._stopped.set()
+
+    def shutdown(self):
+        """
+        Stop the event loop and wait for it to exit.
+        """
+
+        # Overridden from BaseServer
+
+        self._running = False
+        self._wake()
+        self._stopped.wait()
+
+    def server_close(self):
+        """
+        Clean up the server.
+        """
+
+        super().server_close()
+
+        self._wake_r.close()
+        self._wake_w.close()
+
+    def error_response(self, code, message):
+        """
+        Assemble a response for errors raised before a request reaches its
+        handler (e.g. oversized requests).
+        """
+
+        body = bytes(message, 'UTF-8')
+        head = 'HTTP/1.1 %d %s\r\nConnection: close\r\n' \
+               'Content-Length: %d\r\n\r\n' %(code, message, len(body))
+
+        return bytes(head, 'ASCII') + body
+
+    def handle_buffered(self, request, client_address):
+        """
+        Run the request handler against a buffered request.
+
+        Called on a worker thread. Returns a tuple containing the buffered
+        response and whether or not the connection should be closed.
+        """
+
+        handler = self.RequestHandlerClass(request, client_address, self)
+        return (handler.wfile.getvalue(), handler.close_connection)
+
+    def _poll(self, poll_interval):
+        """
+        Wait for events.
+        """
+
+        try:
+            return self._poller.poll(poll_interval * 1000)
+        except (OSError, select.error) as e:
+            if e.args[0] == errno.EINTR:
+                return []
+            raise
+
+    def _wake(self):
+        """
+        Interrupt the loop's poll().
+        """
+
+        try:
+            self._wake_w.send(b'\0')
+        except socket.error:
+            pass
+
+    def _drain_wake(self):
+        """
+        Discard wakeup bytes.
+        """
+
+        try:
+            while self._wake_r.recv(4096):
+                pass
+        except socket.error:
+            pass
+
+    def _update_accepting(self):
+        """
+        Stop accepting connections when we're full, and resume when we aren't.
+        """
+
+        accepting = len(self.connections) < self.max_connections
+        if accepting == self._accepting:
+            return
+
+        if accepting:
+            self._poller.register(self.socket, select.POLLIN)
+        else:
+            self._poller.unregister(self.socket)
+
+        self._accepting = accepting
+
+    def _accept(self):
+        """
+        Accept as many pending connections as we have room for.
+        """
+
+        while len(self.connections) < self.max_connections:
+            try:
+                (sock, address) = self.socket.accept()
+            except socket.error as e:
+                if e.args[0] in RETRY_ERRNOS:
+                    return
+                raise
+
+            if not self.verify_request(sock, address):
+                self.shutdown_request(sock)
+                continue
+
+            sock.setblocking(False)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+            connection = EventLoopConnection(sock, address)
+            self.connections[sock.fileno()] = connection
+            self._poller.register(sock, select.POLLIN)
+            connection.events = select.POLLIN
+
+    def _service(self, connection, events):
+        """
+        Handle poll() events on a connection.
+        """
+
+        if events & (select.POLLERR | select.POLLNVAL):
+            self._close(connection)
+            return
+
+        if events & (select.POLLIN | select.POLLHUP):
+            self._read(connection)
+
+        if connection.socket and events & select.POLLOUT:
+            self._write(connection)
+
+        if connection.socket:
+            self._update(connection)
+
+    def _read(self, connection):
+        """
+        Read and frame data from a connection.
+        """
+
+        try:
+            data = connection.socket.recv(65536)
+        except socket.error as e:
+            if e.args[0] in RETRY_ERRNOS:
+                return
+            self._close(connection)
+            return
+
+        if not data:
+            connection.eof = True
+            self._finish(connection)
+            return
+
+        now = time.time()
+        connection.inbuf += data
+        connection.last_active = now
+
+        if not connection.frame(self.max_header_size, self.max_request_size):
+            connection.broken = (413, 'Request entity too large')
+
+        # Time partial requests from their first byte, rather than their
+        # latest, so that they can't be kept alive a byte at a time
+        if not connection.inbuf:
+            connection.request_started = None
+        elif connection.request_started is None:
+            connection.request_started = now
+
+        if connection.requests and not connection.busy \
+                and connection not in self._ready:
+            self._ready.append(connection)
+
+        self._finish(connection)
+
+    def _write(self, connection):
+        """
+        Write as much buffered output to a connection as it'll take.
+        """
+
+        try:
+            sent = connection.socket.send(connection.outbuf)
+        except socket.error as e:
+            if e.args[0] in RETRY_ERRNOS:
+                return
+            self._close(connection)
+            return
+
+        del connection.outbuf[:sent]
+        connection.last_active = time.time()
+        self._finish(connection)
+
+    def _finish(self, connection):
+        """
+        Close a connection once it has nothing left to do.
+        """
+
+        if not connection.socket or connection.busy or connection.requests:
+            return
+
+        if connection.broken:
+            connection.outbuf += self.error_response(*connection.broken)
+            connection.broken = None
+            connection.closing = True
+
+        if connection.outbuf:
+            return
+
+        if connection.closing or connection.eof:
+            self._close(connection)
+
+    def _update(self, connection):
+        """
+        Subscribe to the events we're interested in on a connection.
+        """
+
+        events = 0
+        if not (connection.eof or connection.closing or connection.broken) \
+                and len(connection.requests) < self.max_pipelined:
+            events |= select.POLLIN
+        if connection.outbuf:
+            events |= select.POLLOUT
+
+        if events != connection.events:
+            self._poller.modify(connection.socket, events)
+            connection.events = events
+
+    def _dispatch(self):
+        """
+        Hand complete requests to the workers, whilst there's room.
+        """
+
+        while self._ready \
+                and self._in_flight < self.workers + self.max_queued:
+            connection = self._ready.popleft()
+            if not connection.socket or connection.busy \
+                    or not connection.requests:
+                continue
+
+            request = connection.requests.popleft()
+            connection.busy = True
+            self._in_flight += 1
+            self._executor.submit(self._handle, connection, request)
+
+    def _handle(self, connection, request):
+        """
+        Handle a request on a worker thread, passing the result to the loop.
+        """
+
+        try:
+            result = self.handle_buffered(request, connection.address)
+        except Exception:
+            self.handle_error(request, connection.address)
+            result = (b'', True)
+
+        self._completed.put((connection, result))
+        self._wake()
+
+    def _collect(self):
+        """
+        Queue responses from the workers for writing.
+        """
+
+        while True:
+            try:
+                (connection, (output, close)) = self._completed.get_nowait()
+            except queue.Empty:
+                return
+
+            self._in_flight -= 1
+            connection.busy = False
+
+            if not connection.socket:
+                continue
+
+            connection.outbuf += output
+            connection.last_active = time.time()
+
+            if close:
+                connection.closing = True
+                connection.requests.clear()
+            elif connection.requests:
+                self._ready.append(connection)
+
+            # Write optimistically; most responses fit in the socket buffer,
+            # saving us a trip around the loop
+            self._write(connection)
+            if connection.socket:
+                self._update(connection)
+
+    def _expire(self):
+        """
+        Close connections which have been idle for longer than the timeout, or
+        which have taken longer than it to send their current request.
+
+        Connections with requests in flight are exempt, since the delay is
+        ours. We check at most once a second.
+        """
+
+        now = time.time()
+        if not self.request_timeout or now < self._next_expiry:
+            return
+
+        self._next_expiry = now + min(1, self.request_timeout)
+        deadline = now - self.request_timeout
+
+        for connection in list(self.connections.values()):
+            if connection.busy or connection.requests:
+                continue
+
+            if connection.request_started is not None:
+                if connection.request_started < deadline:
+                    self._close(connection)
+            elif connection.last_active < deadline:
+                self._close(connection)
+
+    def _close(self, connection):
+        """
+        Close a connection and forget about it.
+        """
+
+        if not connection.socket:
+            return
+
+        del self.connections[connection.socket.fileno()]
+        self._poller.unregister(connection.socket)
+        self.shutdown_request(connection.socket)
+
+        connection.socket = None
+        connection.requests.clear()
+
+
+class EventLoopConnection:
+    """
+    State for a single connection.
+    """
+
+    def __init__(self, sock, address):
+        """
+        Initialise values.
+        """
+
+        self.socket  = sock
+        self.address = address
+
+        self.inbuf    = bytearray()
+        self.outbuf   = bytearray()
+        self.requests = deque()
+
+        # Is a worker serving one of our requests?
+        self.busy = False
+
+        # Have we been asked to close (closing), has the peer stopped sending
+        # (eof) or has the request stream become unreadable (broken; the
+        # status code and message to respond with)?
+        self.closing = False
+        self.eof     = False
+        self.broken  = None
+
+        # When we last read from or wrote to the connection, and when the
+        # first byte of the partial request in inbuf (if any) arrived
+        self.events          = 0
+        self.last_active     = time.time()
+        self.request_started = None
+
+    def frame(self, max_header_size, max_request_size):
+        """
+        Split complete requests from the input buffer.
+
+        Returns False if the request stream can't be read any further.
+        """
+
+        while True:
+            match = HEADER_END.search(self.inbuf)
+            if not match:
+                return len(self.inbuf) <= max_header_size
+
+            header_end = match.end()
+            if header_end > max_header_size:
+                return False
+
+            length = CONTENT_LENGTH.search(self.inbuf, 0, header_end)
+            length = int(length.group(1)) if length else 0
+            if length > max_request_size:
+                return False
+
+            if len(self.inbuf) < header_end + length:
+                return True
+
+            self.requests.append(bytes(self.inbuf[:header_end + length]))
+            del self.inbuf[:header_end + length]
+
+
+class BufferedRequestHandlerMixIn:
+    """
+    Adapts a StreamRequestHandler to serve a single buffered request.
+
+    The request is read from memory and the response written to memory, for the
+    server to deliver.
+    """
+
+    def setup(self):
+        """
+        Prepare the buffers.
+        """
+
+        # Overridden from StreamRequestHandler
+
+        self.rfile = BytesIO(self.request)
+        self.wfile = BytesIO()
+
+    def handle(self):
+        """
+        Handle the request.
+        """
+
+        # Overridden from BaseHTTPRequestHandler
+        #
+        # There's only ever one request in the buffer. Whether the connection
+        # should be closed afterwards is left in close_connection.
+
+        self.close_connection = True
+        self.handle_one_request()
+
+    def finish(self):
+        """
+        Leave the buffers intact for the server to collect.
+        """
+
+        # Overridden from StreamRequestHandler
+
+        pass
@@ -10,6 +10,8 @@
 #
 
 import gnupg
+import queue
+import threading
 
 class GPG(gnupg.GPG):
     """
@@ -19,14 +21,149 @@ class GPG(gnupg.GPG):
     instances = {}
 
     def get_gpg(gpgbinary='gpg', gnupghome=None, verbose=False,
-                use_agent=False, keyring=None, instancename=None):
+                use_agent=False, keyring=None, instancename=None, pool_size=0,
+                queue_depth=0):
+        """
+        Get a (possibly shared) GPG instance.
+
+        When pool_size is non-zero, a GPGPool fronting that many workers is
+        returned in place of a single instance. Callers needn't care about the
+        difference, since the pool exposes the same methods.
+        """
 
         if not instancename:
             instancename = str(locals())
 
         if instancename not in GPG.instances:
-            GPG.instances[instancename] = GPG(gpgbinary, gnupghome, verbose,
-                                              use_agent, keyring)
+            if pool_size:
+                GPG.instances[instancename] = GPGPool(pool_size, queue_depth,
+                                                      gpgbinary, gnupghome,
+                                                      verbose, use_agent,
+                                                      keyring)
+            else:
+                GPG.instances[instancename] = GPG(gpgbinary, gnupghome,
+                                                  verbose, use_agent, keyring)
 
         return GPG.instances[instancename]
 
+
+class GPGPool:
+    """
+    Bounded pool of GPG worker threads.
+
+    Each worker thread owns its own GPG instance (and therefore its own view of
+    the keyring), consuming operations from a shared queue. This bounds the
+    number of gpg processes running at any one time, regardless of how many
+    server threads are submitting work, and allows us to keep a warm gpg-agent
+    behind the workers when use_agent is set.
+
+    The pool doesn't make any one operation cheaper: python_gnupg still spawns
+    a gpg process for each, since gpg can't be kept resident to serve them.
+    What it saves is the contention between gpg processes when many requests
+    arrive at once (see benchmarks.gpgpool).
+
+    The queue depth provides backpressure: once it's full, submitters block
+    until a worker frees up a slot. A depth of 0 means unbounded.
+    """
+
+    def __init__(self, size, queue_depth, *gpg_args):
+        """
+        Spawn the workers.
+        """
+
+        self.size       = size
+        self._queue     = queue.Queue(queue_depth)
+        self._instances = []
+        self._workers   = []
+
+        for i in range(size):
+            gpg = self._get_instance(*gpg_args)
+            worker = threading.Thread(target=self._work, args=(gpg,),
+                                      name='hn-gpg-%d' %(i))
+            worker.daemon = True
+            worker.start()
+            self._instances.append(gpg)
+            self._workers.append(worker)
+
+    def __getattr__(self, name):
+        """
+        Proxy GPG method calls through to a worker, and GPG attributes (such as
+        gnupghome) through to a worker's instance.
+
+        Private attributes are never proxied; this allows callers to attach
+        metadata (like the agent's _secret_key) to the pool itself.
+        """
+
+        if name.startswith('_') or not self._instances:
+            raise AttributeError(name)
+
+        if not callable(getattr(GPG, name, None)):
+            return getattr(self._instances[0], name)
+
+        def submit(*args, **kwargs):
+            return self.submit(name, *args, **kwargs)
+
+        return submit
+
+    def _get_instance(self, *gpg_args):
+        """
+        Get the GPG instance for a new worker.
+        """
+
+        return GPG(*gpg_args)
+
+    def _work(self, gpg):
+        """
+        Worker main loop.
+        """
+
+        while True:
+            job = self._queue.get()
+
+            try:
+                job.result = getattr(gpg, job.method)(*job.args, **job.kwargs)
+            except Exception as e:
+                job.exception = e
+            finally:
+                job.done.set()
+                self._queue.task_done()
+
+    def queue_depth(self):
+        """
+        Get the number of operations waiting for a worker.
+        """
+
+        return self._queue.qsize()
+
+    def submit(self, method, *args, **kwargs):
+        """
+        Queue an operation and wait for its result.
+        """
+
+        job = GPGPoolJob(method, args, kwargs)
+        self._queue.put(job)
+        job.done.wait()
+
+        if job.exception:
+            raise job.exception
+
+        return job.result
+
+
+class GPGPoolJob:
+    """
+    A single operation queued for a GPGPool worker.
+    """
+
+    def __init__(self, method, args, kwargs):
+        """
+        Initialise values.
+        """
+
+        self.method = method
+        self.args   = args
+        self.kwargs = kwargs
+
+        self.done      = threading.Event()
+        self.result    = None
+        self.exception = None
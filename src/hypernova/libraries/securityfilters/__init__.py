@@ -9,6 +9,14 @@
 #                    Luke Carrier <luke.carrier@tdm.info>
 #
 
+# HTTP header marking responses which are signed, rather than encrypted (e.g.
+# those sent before a request could be decrypted)
+SIGNED_HEADER = 'X-HyperNova-Signed'
+
+# HTTP header marking requests refused because they referred to state (e.g. a
+# session) which the agent doesn't hold; the client may reset() and try again
+RESET_HEADER = 'X-HyperNova-Reset'
+
 class BaseSecurityFilter:
 	"""
 	Base security filter.
@@ -16,38 +24,102 @@ class BaseSecurityFilter:
 	This class should be used as a base for all security filter implementations.
 	It outlines the function prototypes used for encrypting and signing requests
 	and responses.
+
+	Senders and recipients are opaque to the agent and client: they're whatever
+	identifies a peer to the filter (a key fingerprint for the GPG filters). The
+	decrypt() and verify() methods return the identity of the peer that
+	produced the data alongside the data itself, so that a response can be
+	addressed to them.
 	"""
 
-	def encrypt(data, sender, recipient):
+	def __init__(self, gpg=None, options={}):
+		"""
+		Initialise the filter.
+
+		gpg should be a GPG (or GPGPool) instance for those filters which rely
+		on public key cryptography; options is a mapping of configuration values
+		(usually the security section of the configuration).
+		"""
+
+		self.gpg     = gpg
+		self.options = options
+
+	def encrypt(self, data, sender, recipient):
 		"""
 		Encrypt the supplied data such that it may only be decrypted by the
 		desired recipient.
 		"""
 
-		pass
+		raise NotImplementedError
 
-	def decrypt(data, sender, recipient):
+	def decrypt(self, data, sender, recipient):
 		"""
 		Decrypt the data supplied by the given sender.
+
+		Returns a tuple containing the decrypted data and the identity of its
+		sender. If sender is None, data from any trusted peer is accepted.
 		"""
 
-		pass
+		raise NotImplementedError
 
-	def sign(data, sender, recipient):
+	def sign(self, data, sender, recipient):
 		"""
 		Sign the supplied data to allow the recipient to identify it as
 		originating from the sender.
 		"""
 
-		pass
+		raise NotImplementedError
 
-	def verify(data, sender, recipient):
+	def verify(self, data, sender, recipient):
 		"""
 		Verify that the supplied data originated from the sender.
+
+		Returns a tuple containing the signed data and the identity of its
+		signer.
 		"""
 
-		pass
+		raise NotImplementedError
 
+	def reset(self, recipient):
+		"""
+		Discard any state held for communication with the recipient.
+
+		Returns True if there was any state to discard.
+		"""
+
+		return False
+
+
+class AuthenticationError(Exception):
+	"""
+	Authentication error.
+
+	Thrown whenever data cannot be encrypted or decrypted, or its origin cannot
+	be verified.
+	"""
+
+	pass
+
+
+class ResetRequiredError(AuthenticationError):
+	"""
+	Data referred to state which isn't held by its recipient.
+
+	Thrown where the sender can recover by discarding its own state with
+	reset() and trying again (e.g. after the recipient forgot a session).
+	Nothing else may be retried, lest a request be carried out twice.
+	"""
 
-def get_security_filter(filter, *args, **kwargs):
 	pass
+
+
+def get_security_filter(filter, *args, **kwargs):
+	"""
+	Get a security filter by its name, and initialise it with the arguments in
+	args.
+	"""
+
+	module_name = "hypernova.libraries.securityfilters.%s" %(filter)
+	module = __import__(module_name, fromlist=['SecurityFilter'])
+	Klass = getattr(module, 'SecurityFilter')
+	return Klass(*args, **kwargs)
@@ -9,3 +9,76 @@
 #                    Luke Carrier <luke.carrier@tdm.info>
 #
 
+from hypernova.libraries.securityfilters import AuthenticationError, \
+                                                BaseSecurityFilter
+
+class SecurityFilter(BaseSecurityFilter):
+	"""
+	GPG security filter.
+
+	Every message is encrypted to the recipient's public key and signed with
+	the sender's private key. Peers are identified by their key fingerprints,
+	and only data signed by a key present (and trusted) in the local keyring is
+	accepted.
+	"""
+
+	def encrypt(self, data, sender, recipient):
+		"""
+		See the documentation for BaseSecurityFilter.encrypt() for details.
+		"""
+
+		result = self.gpg.encrypt(data, recipient, sign=sender)
+		if not result:
+			raise AuthenticationError('invalid passphrase, or the recipient\'s '
+			                          'key has not been signed')
+
+		return str(result)
+
+	def decrypt(self, data, sender, recipient):
+		"""
+		See the documentation for BaseSecurityFilter.decrypt() for details.
+
+		Decryption and signature verification take place in a single pass.
+		"""
+
+		return self._check(self.gpg.decrypt(data), sender)
+
+	def sign(self, data, sender, recipient):
+		"""
+		See the documentation for BaseSecurityFilter.sign() for details.
+		"""
+
+		result = self.gpg.sign(data, keyid=sender)
+		if not result:
+			raise AuthenticationError('unable to sign data; check the key')
+
+		return str(result)
+
+	def verify(self, data, sender, recipient):
+		"""
+		See the documentation for BaseSecurityFilter.verify() for details.
+		"""
+
+		# Passing clearsigned data through decrypt() yields both the signed
+		# content and the signature's details, which verify() doesn't.
+		return self._check(self.gpg.decrypt(data), sender)
+
+	def _check(self, result, sender):
+		"""
+		Ensure the result of a decryption was trustworthy.
+		"""
+
+		if str(result) == '':
+			raise AuthenticationError('decrypted data empty; potential '
+			                          'authentication failure')
+
+		fingerprint = getattr(result, 'fingerprint', None)
+		if not fingerprint:
+			raise AuthenticationError('data unsigned or signing key not in '
+			                          'local key store')
+
+		if sender and fingerprint != sender:
+			raise AuthenticationError('data signed by unexpected key %s'
+			                          %(fingerprint))
+
+		return (str(result), fingerprint)
@@ -21,14 +21,14 @@ class SecurityFilter(BaseSecurityFilter):
 	and debugging purposes, though.
 	"""
 
-	def encrypt(data, sender, recipient):
+	def encrypt(self, data, sender, recipient):
 		return data
 
-	def decrypt(data, sender, recipient):
-		return data
+	def decrypt(self, data, sender, recipient):
+		return (data, sender)
 
-	def sign(data, sender, recipient):
+	def sign(self, data, sender, recipient):
 		return data
 
-	def verify(data, sender, recipient):
-		return data
+	def verify(self, data, sender, recipient):
+		return (data, sender)
@@ -0,0 +1,502 @@
+#!/usr/bin/env python3.2
+
+#
+# HyperNova server management framework
+#
+# Hybrid (GPG handshake, symmetric session) security filter
+#
+# Copyright (c) 2012 TDM Ltd
+#                    Luke Carrier <luke.carrier@tdm.info>
+#
+
+"""
+The session filter trades public key operations on every message for a single
+GPG-authenticated handshake per session:
+
+  * The first message a client sends to a recipient is an ordinary GPG message
+    (encrypted to the recipient, signed by the sender) whose plaintext is
+    prefixed with a handshake line carrying a random session identifier and
+    key, and the time it was issued.
+  * The recipient verifies the signature as usual and remembers the key. Only
+    the holder of the recipient's private key can learn it, so its use from
+    then on authenticates both parties. Each session identifier is accepted
+    once, and handshakes older than the session lifetime are refused, so a
+    captured handshake can't be replayed.
+  * All subsequent messages in either direction are encrypted and
+    authenticated with keys derived from the session key.
+
+Messages are encrypted with HMAC-SHA512 in counter mode and authenticated with
+HMAC-SHA256 (encrypt-then-MAC), using only the standard library. Each message
+carries a sequence number which is covered by the MAC; recipients track them to
+reject replays.
+
+Agents which don't understand sessions respond to handshakes with plain GPG
+messages; the filter notices and falls back to the GPG filter's behaviour for
+that peer.
+"""
+
+import base64
+import hashlib
+import hmac
+from hypernova.libraries.securityfilters import AuthenticationError, \
+                                                ResetRequiredError
+from hypernova.libraries.securityfilters.gnupg import SecurityFilter \
+                                                      as GPGSecurityFilter
+import os
+import threading
+import time
+
+# Wire markers
+#
+# Session messages are entirely ASCII, and begin with SESSION_MARKER. Handshakes
+# are ordinary GPG messages whose plaintext begins with HANDSHAKE_MARKER.
+SESSION_MARKER   = 'HNS1'
+HANDSHAKE_MARKER = 'HNSK1'
+
+# Message directions
+#
+# Mixed into the keystream and MAC so that a request can never be reflected
+# back at its sender as a response.
+DIRECTION_REQUEST  = b'q'
+DIRECTION_RESPONSE = b'r'
+
+MAC_LENGTH = 32
+SEQ_LENGTH = 8
+
+class SecurityFilter(GPGSecurityFilter):
+	"""
+	Hybrid session security filter.
+
+	A single filter instance plays either role: encrypting to a fingerprint
+	establishes (or reuses) a session with that recipient, whilst decrypting a
+	handshake registers a session for the sender.
+	"""
+
+	def __init__(self, gpg=None, options={}):
+		"""
+		Initialise the filter.
+		"""
+
+		super().__init__(gpg, options)
+
+		self.lifetime     = int(options.get('session_lifetime', 3600))
+		self.max_sessions = int(options.get('max_sessions', 1024))
+
+		self._lock = threading.Lock()
+
+		# Sessions we've established with recipients, keyed by fingerprint
+		self._outbound = {}
+
+		# Sessions peers have established with us, keyed by session ID
+		self._inbound = {}
+
+		# Times until which the IDs of sessions we've accepted (whether still
+		# in _inbound or not) must be refused, keyed by session ID
+		self._accepted = {}
+
+		# Recipients which have shown they don't support sessions
+		self._unsupported = set()
+
+		# Sessions whose handshakes each thread is awaiting the responses to
+		self._local = threading.local()
+
+	def encrypt(self, data, sender, recipient):
+		"""
+		See the documentation for BaseSecurityFilter.encrypt() for details.
+		"""
+
+		# Responding to a peer, either within a session or not
+		if isinstance(recipient, Peer):
+			if not recipient.session:
+				return super().encrypt(data, sender, recipient.fingerprint)
+
+			return recipient.session.seal(DIRECTION_RESPONSE, recipient.seq,
+										  data)
+
+		if recipient in self._unsupported:
+			return super().encrypt(data, sender, recipient)
+
+		# Nothing this thread sent the recipient before is still awaited
+		handshakes = self._get_handshakes()
+		handshakes.pop(recipient, None)
+
+		with self._lock:
+			session = self._outbound.get(recipient)
+			if session and not session.expired() and session.established:
+				seq = session.next_seq()
+				handshake = False
+			elif session and not session.expired():
+				# Handshake in flight; don't race it with a second one
+				session = None
+				handshake = False
+			else:
+				session = Session(os.urandom(16), os.urandom(32), recipient,
+								  self.lifetime)
+				self._outbound[recipient] = session
+				seq = 0
+				handshake = True
+
+		if not session:
+			return super().encrypt(data, sender, recipient)
+
+		if not handshake:
+			return session.seal(DIRECTION_REQUEST, seq, data)
+
+		session.expect(0)
+		handshakes[recipient] = session
+		header = '%s %s %s %d %d\n' %(HANDSHAKE_MARKER, session.hex_id,
+									  str(base64.b64encode(session.key),
+										  'ASCII'),
+									  self.lifetime, time.time())
+		return super().encrypt(header + data, sender, recipient)
+
+	def decrypt(self, data, sender, recipient):
+		"""
+		See the documentation for BaseSecurityFilter.decrypt() for details.
+
+		The returned sender is a Peer object, which must be passed back to
+		encrypt() as the recipient of any response.
+		"""
+
+		if data.startswith(SESSION_MARKER + ' '):
+			return self._decrypt_session(data, sender)
+
+		(clear, fingerprint) = super().decrypt(data, sender, recipient)
+
+		if clear.startswith(HANDSHAKE_MARKER + ' '):
+			return self._accept_handshake(clear, fingerprint)
+
+		# A plain GPG response to our handshake means the peer doesn't do
+		# sessions; stop trying. Requests sent (by other threads) whilst the
+		# handshake was in flight were plain GPG messages, and responses to
+		# them say nothing either way.
+		session = self._get_handshakes().pop(fingerprint, None)
+		if session:
+			with self._lock:
+				if self._outbound.get(fingerprint) is session \
+						and not session.established:
+					del self._outbound[fingerprint]
+					self._unsupported.add(fingerprint)
+
+		return (clear, Peer(fingerprint, None, None))
+
+	def reset(self, recipient):
+		"""
+		See the documentation for BaseSecurityFilter.reset() for details.
+		"""
+
+		self._get_handshakes().pop(recipient, None)
+
+		with self._lock:
+			return self._outbound.pop(recipient, None) is not None
+
+	def _get_handshakes(self):
+		"""
+		Get the sessions whose handshakes this thread is awaiting responses to,
+		keyed by fingerprint.
+
+		Clients send a request and read its response on the same thread, so
+		this identifies the response to a handshake, whatever other requests
+		are in flight.
+		"""
+
+		try:
+			return self._local.handshakes
+		except AttributeError:
+			self._local.handshakes = {}
+			return self._local.handshakes
+
+	def _accept_handshake(self, clear, fingerprint):
+		"""
+		Register a session proposed by a peer.
+
+		Each handshake is only accepted once, and only within the session's
+		lifetime of being issued.
+		"""
+
+		(header, sep, clear) = clear.partition('\n')
+
+		try:
+			(marker, hex_id, key, lifetime, issued) = header.split(' ')
+			session_id = base64.b16decode(hex_id.upper())
+			key = base64.b64decode(bytes(key, 'ASCII'))
+			lifetime = min(int(lifetime), self.lifetime)
+			issued = int(issued)
+		except (TypeError, ValueError):
+			raise AuthenticationError('malformed session handshake')
+
+		if len(key) != 32:
+			raise AuthenticationError('malformed session handshake')
+
+		now = time.time()
+		expires = issued + lifetime
+		if expires <= now or issued > now + self.lifetime:
+			raise AuthenticationError('stale session handshake')
+
+		session = Session(session_id, key, fingerprint, expires - now)
+		session.accept(0)
+
+		with self._lock:
+			self._prune()
+			if session_id in self._accepted:
+				raise AuthenticationError('replayed session handshake')
+
+			self._accepted[session_id] = expires
+			self._inbound[session_id] = session
+
+		return (clear, Peer(fingerprint, session, 0))
+
+	def _decrypt_session(self, data, sender):
+		"""
+		Decrypt a message sent within a session.
+		"""
+
+		try:
+			(marker, hex_id, blob) = data.split(' ', 2)
+			session_id = base64.b16decode(hex_id.upper())
+		except (TypeError, ValueError):
+			raise AuthenticationError('malformed session message')
+
+		with self._lock:
+			session = self._inbound.get(session_id)
+			inbound = session is not None
+			if not session:
+				for s in self._outbound.values():
+					if s.id == session_id:
+						session = s
+						break
+
+		if not session or session.expired():
+			raise ResetRequiredError('unknown or expired session')
+
+		if sender and session.fingerprint != sender:
+			raise AuthenticationError('session belongs to unexpected key %s'
+									  %(session.fingerprint))
+
+		if inbound:
+			(seq, clear) = session.open(DIRECTION_REQUEST, blob)
+			session.accept(seq)
+			return (clear, Peer(session.fingerprint, session, seq))
+
+		(seq, clear) = session.open(DIRECTION_RESPONSE, blob)
+		session.fulfil(seq)
+		return (clear, Peer(session.fingerprint, session, seq))
+
+	def _prune(self):
+		"""
+		Drop expired sessions, and the oldest if we're still over capacity.
+
+		The IDs of sessions are remembered until their handshakes would be
+		refused as stale anyway, even once the sessions have been dropped.
+
+		Must be called with the lock held.
+		"""
+
+		now = time.time()
+		for (session_id, expires) in list(self._accepted.items()):
+			if expires <= now:
+				del self._accepted[session_id]
+
+		for (session_id, session) in list(self._inbound.items()):
+			if session.expired():
+				del self._inbound[session_id]
+
+		while len(self._inbound) >= self.max_sessions:
+			oldest = min(self._inbound.values(), key=lambda s: s.expires)
+			del self._inbound[oldest.id]
+
+
+class Peer:
+	"""
+	A peer communicating with us.
+
+	Where the peer is using a session, carries the session and the sequence
+	number of the request being answered, so that the response can be sealed
+	to match.
+	"""
+
+	def __init__(self, fingerprint, session, seq):
+		"""
+		Initialise values.
+		"""
+
+		self.fingerprint = fingerprint
+		self.session     = session
+		self.seq         = seq
+
+	def __str__(self):
+		return self.fingerprint
+
+
+class Session:
+	"""
+	Symmetric session state.
+	"""
+
+	# Number of sequence numbers behind the highest seen which may still be
+	# accepted; allows for requests arriving out of order on separate
+	# connections.
+	REPLAY_WINDOW = 64
+
+	def __init__(self, session_id, key, fingerprint, lifetime):
+		"""
+		Initialise values and derive keys.
+		"""
+
+		self.id          = session_id
+		self.hex_id      = str(base64.b16encode(session_id), 'ASCII').lower()
+		self.key         = key
+		self.fingerprint = fingerprint
+		self.expires     = time.time() + lifetime
+		self.established = False
+
+		self._enc_key = hmac.new(key, b'hn-enc', hashlib.sha256).digest()
+		self._mac_key = hmac.new(key, b'hn-mac', hashlib.sha256).digest()
+
+		self._lock    = threading.Lock()
+		self._seq     = 0
+		self._pending = set()
+		self._highest = -1
+		self._seen    = 0
+
+	def expired(self):
+		"""
+		Has the session outlived its welcome?
+		"""
+
+		return time.time() >= self.expires
+
+	def next_seq(self):
+		"""
+		Allocate a sequence number for an outgoing request.
+		"""
+
+		with self._lock:
+			self._seq += 1
+			self._pending.add(self._seq)
+			return self._seq
+
+	def expect(self, seq):
+		"""
+		Note that we're expecting a response bearing seq.
+		"""
+
+		with self._lock:
+			self._pending.add(seq)
+
+	def fulfil(self, seq):
+		"""
+		Accept a response, ensuring it answers an outstanding request.
+		"""
+
+		with self._lock:
+			if seq not in self._pending:
+				raise AuthenticationError('unexpected or replayed response')
+
+			self._pending.remove(seq)
+			self.established = True
+
+	def accept(self, seq):
+		"""
+		Accept a request, rejecting replays.
+
+		Sequence numbers are tracked with a sliding bitmap, as with IPsec.
+		"""
+
+		with self._lock:
+			if seq > self._highest:
+				self._seen = (self._seen << (seq - self._highest)) | 1
+				self._seen &= (1 << self.REPLAY_WINDOW) - 1
+				self._highest = seq
+				return
+
+			offset = self._highest - seq
+			if offset >= self.REPLAY_WINDOW or self._seen & (1 << offset):
+				raise AuthenticationError('replayed or stale request')
+
+			self._seen |= 1 << offset
+
+	def seal(self, direction, seq, data):
+		"""
+		Encrypt and authenticate data.
+		"""
+
+		seq = seq.to_bytes(SEQ_LENGTH, 'big')
+		ciphertext = self._xor(direction, seq, bytes(data, 'UTF-8'))
+		mac = self._mac(direction, seq, ciphertext)
+
+		blob = str(base64.b64encode(seq + ciphertext + mac), 'ASCII')
+		return ' '.join((SESSION_MARKER, self.hex_id, blob))
+
+	def open(self, direction, blob):
+		"""
+		Authenticate and decrypt data, returning its sequence number.
+		"""
+
+		try:
+			blob = base64.b64decode(bytes(blob, 'ASCII'))
+		except (TypeError, ValueError):
+			raise AuthenticationError('malformed session message')
+
+		if len(blob) < SEQ_LENGTH + MAC_LENGTH:
+			raise AuthenticationError('malformed session message')
+
+		seq        = blob[:SEQ_LENGTH]
+		ciphertext = blob[SEQ_LENGTH:-MAC_LENGTH]
+		mac        = blob[-MAC_LENGTH:]
+
+		if not _compare_digest(mac, self._mac(direction, seq, ciphertext)):
+			raise AuthenticationError('session message failed authentication')
+
+		clear = self._xor(direction, seq, ciphertext)
+		return (int.from_bytes(seq, 'big'), str(clear, 'UTF-8'))
+
+	def _mac(self, direction, seq, ciphertext):
+		"""
+		Compute the MAC over a message's header and ciphertext.
+		"""
+
+		mac = hmac.new(self._mac_key, self.id, hashlib.sha256)
+		mac.update(direction)
+		mac.update(seq)
+		mac.update(ciphertext)
+		return mac.digest()
+
+	def _xor(self, direction, seq, data):
+		"""
+		Apply the keystream for a message to data.
+		"""
+
+		if not data:
+			return data
+
+		prf = hmac.new(self._enc_key, direction + seq, hashlib.sha512)
+		blocks = []
+		for counter in range((len(data) + 63) // 64):
+			block = prf.copy()
+			block.update(counter.to_bytes(8, 'big'))
+			blocks.append(block.digest())
+		keystream = b''.join(blocks)[:len(data)]
+
+		result = int.from_bytes(data, 'big') ^ int.from_bytes(keystream, 'big')
+		return result.to_bytes(len(data), 'big')
+
+
+def _compare_digest(a, b):
+	"""
+	Compare two digests in constant time.
+
+	Prefers the standard library's implementation where one is available.
+	"""
+
+	if hasattr(hmac, 'compare_digest'):
+		return hmac.compare_digest(a, b)
+
+	if len(a) != len(b):
+		return False
+
+	result = 0
+	for (x, y) in zip(a, b):
+		result |= x ^ y
+
+	return result == 0
@@ -10,7 +10,6 @@
 #
 
 from copy import deepcopy
-import gzip
 from hypernova.libraries.appconfig import dbserver, httpserver
 from hypernova.libraries.appconfig.authserver import (get_auth_server,
                                                       Group  as AuthGroup,
@@ -18,17 +17,15 @@ from hypernova.libraries.appconfig.authserver import (get_auth_server,
 from hypernova.libraries.appconfig.dbserver import (Database,
                                                     User as DBUser)
 from hypernova.libraries.configuration import ConfigurationFactory
-from hypernova.libraries.downloader import download
 from hypernova.libraries.permissionelevation import elevate_cmd
+import importlib
 from os import chown, environ, unlink, walk
 from os.path import dirname, isdir, join, realpath
-import pkgutil
 from random import choice
 from shutil import move, rmtree
 import string
 import subprocess
 import sys
-import tarfile
 import tempfile
 from time import time
 
@@ -283,6 +280,9 @@ class SiteProvisionerBase:
         Download a URL to a local temporary file and return the file's path.
         """
 
+        # urllib is expensive to import, and only needed here
+        from hypernova.libraries.downloader import download
+
         file = tempfile.mkstemp(suffix=options['suffix'])[1]
         self.temporary_files.append(file)
         download(url, file, **options)
@@ -293,6 +293,8 @@ class SiteProvisionerBase:
         Unpack the specified archive to the specified target.
         """
 
+        import tarfile
+
         target = tempfile.mkdtemp()
         self.temporary_files.append(target)
 
@@ -379,17 +381,24 @@ class SiteProvisionerBase:
 def get_provisioner(profile_name):
     """
     Attempt to get a site profile.
+
+    Profiles are imported on demand. Raises KeyError if there's no such
+    profile; errors raised by a profile which fails to import (including
+    ImportErrors for its own dependencies) are left to propagate.
     """
 
-    return getattr(globals()[profile_name], 'SiteProvisioner')
+    if not profile_name.isidentifier():
+        raise KeyError(profile_name)
 
-# Import submodules
-#
-# Since __all__ only contains imported submodules, we need to walk through the
-# packages under this namespace and import them here in order to work with them
-# later. This isn't pretty, but it works.
-__all__ = []
-for (loader, module_name, is_package) in pkgutil.walk_packages(__path__):
-    __all__.append(module_name)
-    module = loader.find_module(module_name).load_module(module_name)
-    exec("%s = module" %(module_name))
+    module_name = '%s.%s' %(__name__, profile_name)
+    try:
+        module = importlib.import_module(module_name)
+    except ImportError as e:
+        # Only the profile's own absence means there's no such profile;
+        # interpreters which don't record the missing module's name can't tell
+        if getattr(e, 'name', module_name) != module_name:
+            raise
+
+        raise KeyError(profile_name)
+
+    return getattr(module, 'SiteProvisioner')
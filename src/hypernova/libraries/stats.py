@@ -0,0 +1,252 @@
+#!/usr/bin/env python3.2
+
+#
+# HyperNova server management framework
+#
+# Request timing statistics
+#
+# Copyright (c) 2012 TDM Ltd
+#                    Luke Carrier <luke.carrier@tdm.info>
+#
+
+"""
+In-process latency statistics.
+
+The agent times each stage of every request it serves with a StageTimer, and
+records the results in histograms kept per module and action by Stats. The
+histograms are exposed to clients through the stats module.
+"""
+
+import math
+import threading
+import time
+
+# High resolution clock
+#
+# Python 3.3 introduced perf_counter(); fall back to the wall clock on earlier
+# releases.
+clock = getattr(time, 'perf_counter', time.time)
+
+# Request pipeline stages, in order
+#
+# Security filters decrypt requests and verify their signatures in a single
+# pass, so the decrypt stage covers both.
+STAGES = ('read', 'decrypt', 'decode', 'dispatch', 'module', 'encode',
+          'encrypt', 'write')
+
+class Histogram:
+    """
+    Thread-safe latency histogram.
+
+    Samples are counted in logarithmic buckets: bucket n holds samples of at
+    most 2^n microseconds. Percentiles are therefore approximate (reported as
+    the upper bound of the bucket they fall within), but recording is cheap
+    and memory use is constant.
+    """
+
+    BUCKETS = 32
+
+    def __init__(self):
+        """
+        Initialise values.
+        """
+
+        self._lock = threading.Lock()
+        self.reset()
+
+    def record(self, seconds):
+        """
+        Record a sample.
+        """
+
+        micros = math.ceil(seconds * 1000000)
+        bucket = min(max(micros - 1, 0).bit_length(), self.BUCKETS - 1)
+
+        with self._lock:
+            self.counts[bucket] += 1
+            self.count += 1
+            self.total += seconds
+            self.min = seconds if self.min is None else min(self.min, seconds)
+            self.max = max(self.max, seconds)
+
+    def reset(self):
+        """
+        Discard all samples.
+        """
+
+        with self._lock:
+            self.counts = [0] * self.BUCKETS
+            self.count  = 0
+            self.total  = 0.0
+            self.min    = None
+            self.max    = 0.0
+
+    def percentile(self, percentile):
+        """
+        Get the approximate sample at the specified percentile, in seconds.
+        """
+
+        with self._lock:
+            return self._percentile(percentile)
+
+    def summary(self):
+        """
+        Summarise the samples as a dictionary, suitable for serialisation.
+
+        All times are in seconds.
+        """
+
+        with self._lock:
+            return {
+                'count': self.count,
+                'total': self.total,
+                'mean':  self.total / self.count if self.count else 0.0,
+                'min':   self.min or 0.0,
+                'max':   self.max,
+                'p50':   self._percentile(50),
+                'p90':   self._percentile(90),
+                'p99':   self._percentile(99),
+            }
+
+    def _percentile(self, percentile):
+        """
+        See percentile(); must be called with the lock held.
+        """
+
+        if not self.count:
+            return 0.0
+
+        rank = self.count * percentile / 100
+        seen = 0
+        for (bucket, count) in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                # Never report more than the slowest sample we've seen
+                return min((1 << bucket) / 1000000, self.max)
+
+        return self.max
+
+
+class StageTimer:
+    """
+    Times the stages of a single request.
+
+    Time accrues to the current stage until the next one begins, so a request
+    which fails part way through attributes the time spent to the stage it
+    failed in.
+    """
+
+    def __init__(self, stage=None):
+        """
+        Start timing, optionally beginning with the named stage.
+        """
+
+        self.timings = {}
+        self.current = stage
+
+        self._started = self._last = clock()
+
+    def stage(self, name):
+        """
+        Begin a stage, ending the current one.
+
+        A name of None stops the timer.
+        """
+
+        now = clock()
+        if self.current:
+            self.timings[self.current] = self.timings.get(self.current, 0.0) \
+                                         + now - self._last
+
+        self.current = name
+        self._last   = now
+
+    def stop(self):
+        """
+        Stop timing, returning the total elapsed time.
+        """
+
+        self.stage(None)
+        return self.total()
+
+    def total(self):
+        """
+        Get the time elapsed between starting and stopping the timer.
+        """
+
+        return self._last - self._started
+
+    def format(self):
+        """
+        Format the timings as log fields (stage=milliseconds).
+        """
+
+        fields = ['%s=%.3f' %(stage, self.timings[stage] * 1000)
+                  for stage in STAGES if stage in self.timings]
+        fields.append('total=%.3f' %(self.total() * 1000))
+
+        return ' '.join(fields)
+
+
+class Stats:
+    """
+    Per-action latency statistics.
+
+    Histograms are kept for each stage of each action (keyed module.action),
+    alongside one for the total time taken.
+    """
+
+    histograms = {}
+
+    _lock = threading.Lock()
+
+    def record(name, timer, total=True):
+        """
+        Record the timings of a request for the named action.
+
+        Where the timer covers only part of a request (e.g. a request within a
+        batch), total should be False to leave the total time alone.
+        """
+
+        histograms = Stats.histograms.get(name)
+        if not histograms:
+            with Stats._lock:
+                histograms = Stats.histograms.setdefault(name, {})
+
+        timings = list(timer.timings.items())
+        if total:
+            timings.append(('total', timer.total()))
+
+        for (stage, seconds) in timings:
+            histogram = histograms.get(stage)
+            if not histogram:
+                with Stats._lock:
+                    histogram = histograms.setdefault(stage, Histogram())
+
+            histogram.record(seconds)
+
+    def get(prefix=''):
+        """
+        Summarise the statistics for all actions whose names begin with prefix.
+
+        Returns a dictionary of summaries (see Histogram.summary()), keyed by
+        action name and then stage.
+        """
+
+        with Stats._lock:
+            names = [n for n in Stats.histograms if n.startswith(prefix)]
+            histograms = dict((n, dict(Stats.histograms[n])) for n in names)
+
+        return dict((name, dict((stage, h.summary())
+                                for (stage, h) in stages.items()))
+                    for (name, stages) in histograms.items())
+
+    def reset(prefix=''):
+        """
+        Discard the statistics for all actions whose names begin with prefix.
+        """
+
+        with Stats._lock:
+            for name in list(Stats.histograms):
+                if name.startswith(prefix):
+                    del Stats.histograms[name]
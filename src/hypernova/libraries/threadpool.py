@@ -0,0 +1,135 @@
+#!/usr/bin/env python3.2
+
+#
+# HyperNova server management framework
+#
+# Bounded thread pool server mix-in
+#
+# Copyright (c) 2012 TDM Ltd
+#                    Luke Carrier <luke.carrier@tdm.info>
+#
+
+"""
+A drop-in replacement for socketserver's ThreadingMixIn.
+
+Rather than spawning a thread for every connection, connections are queued for
+a fixed number of worker threads. When the queue is full, new connections are
+turned away immediately (see reject_request()) rather than accepted and left to
+wait for a worker which may never come.
+
+Rejections are handled by a thread of their own, which responds and then reads
+(and discards) the request until the client hangs up. Closing the socket with
+the request still arriving would reset the connection, and the client may never
+see the response.
+"""
+
+import queue
+import socket
+import threading
+
+class BoundedThreadPoolMixIn:
+    """
+    Mix-in class to handle each connection on a fixed pool of threads.
+    """
+
+    # Number of worker threads, and the number of accepted connections which
+    # may wait for one (0 means unbounded)
+    workers    = 16
+    max_queued = 64
+
+    # Number of rejected connections which may wait to be turned away, beyond
+    # which they're closed without a response, and the number of seconds
+    # we'll wait on a rejected client
+    max_rejected   = 64
+    reject_timeout = 1
+
+    _queue   = None
+    _rejects = None
+
+    def process_request(self, request, client_address):
+        """
+        Queue a connection for a worker, or reject it if the queue's full.
+        """
+
+        # Overridden from BaseServer
+
+        if not self._queue:
+            self._start_workers()
+
+        try:
+            self._queue.put_nowait((request, client_address))
+        except queue.Full:
+            try:
+                self._rejects.put_nowait((request, client_address))
+            except queue.Full:
+                self.shutdown_request(request)
+
+    def connections_waiting(self):
+        """
+        Find out whether any accepted connections are waiting for a worker.
+        """
+
+        return self._queue is not None and not self._queue.empty()
+
+    def reject_request(self, request, client_address):
+        """
+        Respond to a connection we don't have capacity to serve.
+
+        Called on the rejection thread, before the request is read; by default
+        the connection is simply closed.
+        """
+
+        pass
+
+    def _start_workers(self):
+        """
+        Spawn the workers.
+        """
+
+        self._queue   = queue.Queue(self.max_queued)
+        self._rejects = queue.Queue(self.max_rejected)
+
+        threads = [threading.Thread(target=self._work, name='hn-worker-%d' %(i))
+                   for i in range(self.workers)]
+        threads.append(threading.Thread(target=self._reject, name='hn-reject'))
+
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+    def _work(self):
+        """
+        Worker main loop.
+        """
+
+        while True:
+            (request, client_address) = self._queue.get()
+
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    def _reject(self):
+        """
+        Rejection main loop.
+        """
+
+        while True:
+            (request, client_address) = self._rejects.get()
+
+            try:
+                request.settimeout(self.reject_timeout)
+                self.reject_request(request, client_address)
+
+                request.shutdown(socket.SHUT_WR)
+                while request.recv(65536):
+                    pass
+            except socket.error:
+                pass
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                request.close()
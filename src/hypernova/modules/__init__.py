@@ -9,8 +9,10 @@
 #                    Luke Carrier <luke.carrier@tdm.info>
 #
 
-import pkgutil
+import importlib
 import json
+import threading
+import time
 
 class AgentRequestHandlerBase:
     """
@@ -21,6 +23,12 @@ class AgentRequestHandlerBase:
     the name of the module and the function that was called.
     """
 
+    # Actions which may be sent as part of a batch
+    #
+    # Modules must opt in to batching on a per-action basis, since not all
+    # actions are suitable for it (e.g. long-running ones).
+    batch_actions = []
+
     def _format_response(response={}, successful=True, error_code=0,
                          message='', explanation=''):
 
@@ -53,6 +61,21 @@ class ClientRequestBuilderBase:
             'parameters': parameters,
         }
 
+    def _format_batch_request(requests, parallel=False):
+        """
+        Combine several requests (as returned by _format_request()) into a
+        batch, to be sent to the agent in a single round-trip.
+
+        The agent responds with the result of each request, in order, under
+        the results key. If parallel is set, the agent may dispatch the
+        requests concurrently.
+        """
+
+        return {
+            'batch':    list(requests),
+            'parallel': parallel,
+        }
+
     def init_subparser(subparser, subparser_factory):
         """
         Initialise a subparser
@@ -84,13 +107,90 @@ def unserialise(serialised):
 
     return json.loads(serialised)
 
-# Import submodules
+# Modules, keyed by name
 #
-# Since __all__ only contains imported submodules, we need to walk through the
-# packages under this namespace and import them here in order to work with them
-# later. This isn't pretty, but it works.
-__all__ = []
-for (loader, module_name, is_package) in pkgutil.walk_packages(__path__):
-    __all__.append(module_name)
-    module = loader.find_module(module_name).load_module(module_name)
-    exec("%s = module" %(module_name))
+# Modules are imported when they're first used (see get_module()), rather than
+# when this package is, so that callers only pay for the modules they need.
+# New modules must be added here.
+MODULES = {
+    'db':                'hypernova.modules.db',
+    'dns':               'hypernova.modules.dns',
+    'health':            'hypernova.modules.health',
+    'packagemanagement': 'hypernova.modules.packagemanagement',
+    'site':              'hypernova.modules.site',
+    'snmpd':             'hypernova.modules.snmpd',
+    'stats':             'hypernova.modules.stats',
+}
+
+# Imported modules and the time taken to import each, keyed by name
+_loaded     = {}
+load_times  = {}
+_load_lock  = threading.RLock()
+
+# Errors raised by modules which failed to load, keyed by name; see
+# clear_failures()
+_failed = {}
+
+# Callables called with the name of each module and the module itself when
+# it's first imported
+load_hooks = []
+
+def get_module(name):
+    """
+    Get a module by its name, importing it if necessary.
+
+    Raises KeyError if there's no such module, or a ModuleLoadError if it (or
+    one of the load hooks) fails. Failures are remembered: the module isn't
+    imported again until clear_failures() is called.
+    """
+
+    with _load_lock:
+        if name in _failed:
+            raise ModuleLoadError(name, _failed[name])
+
+        if name not in _loaded:
+            path = MODULES[name]
+
+            try:
+                started = time.time()
+                module  = importlib.import_module(path)
+                load_times[name] = time.time() - started
+
+                for hook in load_hooks:
+                    hook(name, module)
+            except Exception as e:
+                _failed[name] = e
+                raise ModuleLoadError(name, e) from e
+
+            _loaded[name] = module
+
+        return _loaded[name]
+
+def clear_failures():
+    """
+    Forget the modules which failed to load, so that they're tried again.
+    """
+
+    with _load_lock:
+        _failed.clear()
+
+
+class ModuleLoadError(Exception):
+    """
+    Module load error.
+
+    Thrown when a module fails to import, or to initialise.
+    """
+
+    def __init__(self, name, error):
+        """
+        Initialise values.
+        """
+
+        super().__init__(name, error)
+
+        self.name  = name
+        self.error = error
+
+    def __str__(self):
+        return 'module %s failed to load: %s' %(self.name, self.error)
@@ -9,48 +9,88 @@
 #                    Luke Carrier <luke.carrier@tdm.info>
 #
 
-from hypernova.libraries.appconfig.dnsserver import DuplicateZoneError, \
+from hypernova.libraries.appconfig.dnsserver import ChangeSet, \
+                                                    DuplicateZoneError, \
+                                                    InvalidZoneError, \
                                                     NonexistentZoneError, \
                                                     ServerCommunicationError, \
                                                     Record, \
                                                     SoaRecord, \
                                                     Zone, \
-                                                    get_authoritative_server
+                                                    diff_records, \
+                                                    get_authoritative_server, \
+                                                    zonefile
 from hypernova.libraries.configuration import ConfigurationFactory
 from hypernova.libraries.packagemanagement import get_package_db, \
                                                   get_package_manager
 from hypernova.modules import AgentRequestHandlerBase, \
                               ClientRequestBuilderBase, \
                               ClientResponseFormatterBase
+import csv
+import itertools
+import json
+import sys
 
 class AgentRequestHandler(AgentRequestHandlerBase):
     """
     DNS management component for the agent.
     """
 
+    batch_actions = ['add_record', 'rm_record', 'add_zone', 'rm_zone',
+                     'get_zone', 'export_zone', 'cache_stats']
+
+    def _get_server():
+        """
+        Get the configured authoritative DNS server.
+
+        All values in the dns configuration section bar the adapter name are
+        passed to the adapter as keyword arguments.
+        """
+
+        options = dict(ConfigurationFactory.get_snapshot('hypernova').dns)
+        adapter = options.pop('adapter')
+
+        return get_authoritative_server(adapter, **options)
+
+    def _build_record(record):
+        """
+        Build a Record from its parameters.
+        """
+
+        return Record(record['name'], record['type'], record['content'],
+                      record['ttl'], record.get('priority'))
+
+    def _build_filters(record):
+        """
+        Build rm_records() filters from a record's parameters.
+        """
+
+        filters = dict(record)
+        filters['rtype'] = filters.pop('type')
+
+        return filters
+
     def do_add_record(params):
         """
-        Add a record to an existing zone.
+        Add a record to an existing zone, bumping its serial.
         """
 
-        config = ConfigurationFactory.get('hypernova')
-        server = get_authoritative_server(config['dns']['adapter'],
-                                          config['dns'])
+        server = AgentRequestHandler._get_server()
 
         try:
-            zone = server.get_zone(params['zone'])
-            record = Record(params['record']['name'],
-                            params['record']['type'],
-                            params['record']['content'],
-                            params['record']['ttl'],
-                            params['record']['priority'])
-            server.add_record(zone, record)
+            record = AgentRequestHandler._build_record(params['record'])
+
+            changes = server.begin_changes(params['zone'])
+            changes.add_record(record)
+            changes.commit()
 
             successful = True
-            result = {'record': record.to_encodable()}
+            result = {'record': record.to_encodable(), 'serial': changes.serial}
         except NonexistentZoneError:
             successful = False
             result = {'error': 'NonexistentZone'}
+        except InvalidZoneError as e:
+            return AgentRequestHandler._format_invalid_zone(e)
 
         return AgentRequestHandler._format_response(
             result,
@@ -59,23 +99,21 @@ class AgentRequestHandler(AgentRequestHandlerBase):
 
     def do_rm_record(params):
         """
-        Remove a record.
+        Remove a record, bumping the zone's serial.
         """
 
-        config = ConfigurationFactory.get('hypernova')
-        server = get_authoritative_server(config['dns']['adapter'],
-                                          config['dns'])
-
-        result = {'records': []}
+        server = AgentRequestHandler._get_server()
 
         try:
-            zone = server.get_zone(params['zone'])
-            params['rtype'] = params['record'].pop('type')
-
-            records = zone.filter_records_for(params['record'])
-            for r in records:
-                result['records'].append(r.to_encodable())
-                server.rm_record(zone, r)
+            changes = server.begin_changes(params['zone'])
+            changes.rm_records(
+                    AgentRequestHandler._build_filters(params['record']))
+            changes.commit()
+
+            result = {
+                'records': [r.to_encodable() for r in changes.removed],
+                'serial':  changes.serial,
+            }
 
             successful = True
 
@@ -86,24 +124,233 @@ class AgentRequestHandler(AgentRequestHandlerBase):
         except NonexistentZoneError:
             successful = False
             result = {'error': 'NonexistentZoneError'}
+        except InvalidZoneError as e:
+            return AgentRequestHandler._format_invalid_zone(e)
+
+        return AgentRequestHandler._format_response(
+            result,
+            successful=successful
+        )
+
+    def do_apply_changes(params):
+        """
+        Add and remove many records in a zone at once.
+
+        The records to add and remove are applied together, and the zone's
+        serial bumped just once.
+        """
+
+        server = AgentRequestHandler._get_server()
+
+        try:
+            changes = server.begin_changes(params['zone'])
+            for record in params.get('remove', []):
+                changes.rm_records(AgentRequestHandler._build_filters(record))
+            for record in params.get('add', []):
+                changes.add_record(AgentRequestHandler._build_record(record))
+        except (KeyError, ValueError):
+            return AgentRequestHandler._format_response(
+                {'error': 'ValidationError'},
+                successful=False
+            )
+
+        try:
+            changes.commit()
+
+            successful = True
+            result     = {
+                'added':   len(changes.additions),
+                'removed': [r.to_encodable() for r in changes.removed],
+                'serial':  changes.serial,
+            }
+        except NonexistentZoneError:
+            successful = False
+            result     = {'error': 'NonexistentZone'}
+        except InvalidZoneError as e:
+            return AgentRequestHandler._format_invalid_zone(e)
+        except ServerCommunicationError:
+            successful = False
+            result     = {'error': 'ServerCommunication'}
+
+        return AgentRequestHandler._format_response(
+            result,
+            successful=successful
+        )
+
+    def _build_bulk_record(record):
+        """
+        Build a Record from its parameters, as given to add_records.
+
+        Records may have come from a CSV file, so the TTL and priority are
+        converted to ints. Raises an exception if the record is invalid.
+        """
+
+        priority = record.get('priority')
+        if priority in ('', None) or int(priority) == -1:
+            priority = None
+        else:
+            priority = int(priority)
+
+        built = Record(record['name'], record['type'], record['content'],
+                       int(record['ttl']), priority)
+
+        if not built.name or built.rtype == Record.RECORD_TYPES.index('soa'):
+            raise ValueError('invalid name or type')
+
+        return built
+
+    def _build_bulk_filters(record):
+        """
+        Build rm_records() filters from a record's parameters, as given to
+        rm_records.
+
+        Empty values are ignored, but at least one of the name, type and
+        content must be given. Raises an exception if the record is invalid.
+        """
+
+        filters = {}
+        for (key, attr) in (('name', 'name'), ('type', 'rtype'),
+                            ('content', 'content')):
+            if record.get(key) not in (None, ''):
+                filters[attr] = record[key]
+
+        if not filters:
+            raise ValueError('no name, type or content')
+        if 'rtype' in filters:
+            Record.get_type_index(filters['rtype'])
+
+        return filters
+
+    def _validate_bulk(params, build, apply):
+        """
+        Build each record given to add_records or rm_records, adding the valid
+        ones to a change set.
+
+        Returns the change set and a result for each record, in order; those
+        for invalid records are marked unsuccessful.
+        """
+
+        server  = AgentRequestHandler._get_server()
+        changes = server.begin_changes(params['zone'])
+        results = []
+
+        for record in params['records']:
+            try:
+                apply(changes, build(record))
+                results.append({'record': record, 'successful': True})
+            except (AttributeError, KeyError, TypeError, ValueError) as e:
+                explanation = str(e)
+                if isinstance(e, KeyError):
+                    explanation = 'missing %s' %(e.args[0])
+
+                results.append({
+                    'record':      record,
+                    'successful':  False,
+                    'error':       'ValidationError',
+                    'explanation': explanation,
+                })
+
+        return (changes, results)
+
+    def _commit_bulk(changes, results):
+        """
+        Commit the change set built by _validate_bulk(), if it's not empty.
+        """
+
+        try:
+            if changes.additions or changes.removals:
+                changes.commit()
+
+            successful = True
+            result     = {
+                'results': results,
+                'serial':  changes.serial,
+            }
+        except NonexistentZoneError:
+            successful = False
+            result     = {'error': 'NonexistentZone'}
+        except InvalidZoneError as e:
+            return AgentRequestHandler._format_invalid_zone(e)
+        except ServerCommunicationError:
+            successful = False
+            result     = {'error': 'ServerCommunication'}
 
         return AgentRequestHandler._format_response(
             result,
             successful=successful
         )
 
+    def do_add_records(params):
+        """
+        Add many records to a zone, reporting the outcome for each.
+
+        Unlike apply_changes, an invalid record doesn't cause the whole request
+        to be rejected. The valid records are added in a single change set,
+        bumping the zone's serial once.
+        """
+
+        try:
+            (changes, results) = AgentRequestHandler._validate_bulk(
+                    params, AgentRequestHandler._build_bulk_record,
+                    ChangeSet.add_record)
+        except (KeyError, TypeError):
+            return AgentRequestHandler._format_response(
+                {'error': 'ValidationError'},
+                successful=False
+            )
+
+        return AgentRequestHandler._commit_bulk(changes, results)
+
+    def do_rm_records(params):
+        """
+        Remove the records matching each of many sets of filters from a zone,
+        reporting the number removed by each.
+
+        As with add_records, the removals are made in a single change set. Sets
+        of filters which match no records are reported as unsuccessful.
+        """
+
+        try:
+            (changes, results) = AgentRequestHandler._validate_bulk(
+                    params, AgentRequestHandler._build_bulk_filters,
+                    ChangeSet.rm_records)
+        except (KeyError, TypeError):
+            return AgentRequestHandler._format_response(
+                {'error': 'ValidationError'},
+                successful=False
+            )
+
+        response = AgentRequestHandler._commit_bulk(changes, results)
+
+        # Attribute each removed record to the first set of filters matching
+        # it
+        removed = Zone(new_records=changes.removed)
+        claimed = set()
+        filters = iter(changes.removals)
+        for result in results:
+            if not result['successful']:
+                continue
+
+            matched = [r for r in removed.find(**next(filters))
+                       if id(r) not in claimed]
+            claimed.update(id(r) for r in matched)
+
+            result['removed'] = len(matched)
+            if not matched:
+                result['successful'] = False
+                result['error']      = 'NoMatchingRecords'
+
+        return response
+
     def do_add_zone(params):
         """
         Add a zone.
         """
 
-        config = ConfigurationFactory.get('hypernova')
-
         try:
             result = {'error': 'ValidationError'}
 
-            server = get_authoritative_server(config['dns']['adapter'],
-                                              config['dns'])
+            server = AgentRequestHandler._get_server()
             zone = Zone(new_domain=params['zone']['domain'],
                         new_origin=params['zone']['origin'],
                         new_ttl=params['zone']['ttl'])
@@ -138,11 +385,8 @@ class AgentRequestHandler(AgentRequestHandlerBase):
         Remove a zone.
         """
 
-        config = ConfigurationFactory.get('hypernova')
-
         try:
-            server = get_authoritative_server(config['dns']['adapter'],
-                                               config['dns'])
+            server = AgentRequestHandler._get_server()
             try:
                 server.rm_zone(params['domain'])
                 successful = True
@@ -162,18 +406,30 @@ class AgentRequestHandler(AgentRequestHandlerBase):
     def do_get_zone(params):
         """
         Get a zone.
+
+        If any of the filters (name, type and content prefix), limit or after
+        parameters are specified, only a page of matching records is returned,
+        along with the cursor to pass as after to get the next page.
         """
 
-        config = ConfigurationFactory.get('hypernova')
+        filters = dict((k, v) for (k, v) in params.get('filters', {}).items()
+                       if v is not None)
+        if 'type' in filters:
+            filters['rtype'] = filters.pop('type')
 
         try:
-            server = get_authoritative_server(config['dns']['adapter'],
-                                              config['dns'])
+            server = AgentRequestHandler._get_server()
 
             try:
+                (zone, cursor) = server.get_zone_page(params['domain'],
+                                                      filters,
+                                                      params.get('after'),
+                                                      params.get('limit'))
+
                 successful = True
                 result     = {
-                    'zone': server.get_zone(params['domain']).to_encodable(),
+                    'zone': zone.to_encodable(),
+                    'next': cursor,
                 }
             except NonexistentZoneError:
                 successful = False
@@ -188,6 +444,203 @@ class AgentRequestHandler(AgentRequestHandlerBase):
             error_code=0
         )
 
+    def _parse_zone(params, require_soa=True):
+        """
+        Parse a complete zone.
+
+        The zone is given either as the text of a master file (format "zone")
+        or as returned by Zone.to_encodable() (format "json"). Raises
+        InvalidZoneError if it can't be parsed.
+        """
+
+        try:
+            if params.get('format', 'zone') == 'json':
+                zone = Zone.from_encodable(params['zone'])
+            else:
+                zone = zonefile.parse(params['zone'], params.get('origin'))
+        except (KeyError, TypeError, ValueError) as e:
+            raise InvalidZoneError('malformed zone: %s' %(e))
+
+        if require_soa and not zone.soa_record:
+            raise InvalidZoneError('no SOA record')
+
+        return zone
+
+    def _format_invalid_zone(e):
+        """
+        Format the response to a zone which failed validation.
+        """
+
+        return AgentRequestHandler._format_response(
+            {'error': 'ValidationError'},
+            successful=False,
+            explanation=str(e)
+        )
+
+    def do_import_zone(params):
+        """
+        Import a complete zone.
+
+        See _parse_zone() for the formats accepted.
+        """
+
+        try:
+            zone = AgentRequestHandler._parse_zone(params)
+        except InvalidZoneError as e:
+            return AgentRequestHandler._format_invalid_zone(e)
+
+        try:
+            server = AgentRequestHandler._get_server()
+
+            try:
+                server.import_zone(zone, params.get('replace', False))
+                successful = True
+                result     = {
+                    'domain':  zone.domain,
+                    'records': len(zone),
+                }
+            except DuplicateZoneError:
+                successful = False
+                result     = {'error': 'DuplicateZone'}
+        except ServerCommunicationError:
+            successful = False
+            result     = {'error': 'ServerCommunication'}
+
+        return AgentRequestHandler._format_response(
+            result,
+            successful=successful
+        )
+
+    def do_sync_zone(params):
+        """
+        Bring a zone's records into line with the desired state.
+
+        Only the records which differ are removed and added, in a single change
+        set; the differences are found as it's committed (see
+        ChangeSet.sync_records()). The SOA record of the desired zone is
+        ignored; the serial of the stored zone is bumped if anything changed.
+        With dry_run set, the differences are reported but not applied.
+        """
+
+        try:
+            zone = AgentRequestHandler._parse_zone(params, False)
+        except InvalidZoneError as e:
+            return AgentRequestHandler._format_invalid_zone(e)
+
+        # The diff must be against the current state of the zone, not a cached
+        # copy which may be stale
+        cache = AgentRequestHandler._get_cache()
+        if cache:
+            cache.invalidate(zone.domain)
+
+        try:
+            server = AgentRequestHandler._get_server()
+
+            try:
+                if params.get('dry_run', False):
+                    current = server.get_zone(zone.domain)
+                    (removals, additions) = diff_records(current, zone)
+                    serial = current.soa_record.serial
+                else:
+                    changes = server.begin_changes(zone.domain)
+                    changes.sync_records(zone)
+                    serial = changes.commit()
+                    (removals, additions) = (changes.removed,
+                                             changes.additions)
+
+                successful = True
+                result     = {
+                    'removed':   [r.to_encodable() for r in removals],
+                    'added':     [r.to_encodable() for r in additions],
+                    'unchanged': len(zone) - len(additions),
+                    'serial':    int(serial),
+                }
+            except NonexistentZoneError:
+                successful = False
+                result     = {'error': 'NonexistentZone'}
+            except InvalidZoneError as e:
+                return AgentRequestHandler._format_invalid_zone(e)
+        except ServerCommunicationError:
+            successful = False
+            result     = {'error': 'ServerCommunication'}
+
+        return AgentRequestHandler._format_response(
+            result,
+            successful=successful
+        )
+
+    def do_export_zone(params):
+        """
+        Export a complete zone, as a master file (format "zone") or in the form
+        returned by get_zone (format "json").
+        """
+
+        try:
+            server = AgentRequestHandler._get_server()
+
+            try:
+                zone = server.get_zone(params['domain'])
+                if params.get('format', 'zone') == 'json':
+                    exported = zone.to_encodable()
+                else:
+                    exported = "\n".join(zonefile.render(zone)) + "\n"
+
+                successful = True
+                result     = {'zone': exported}
+            except NonexistentZoneError:
+                successful = False
+                result     = {'error': 'NonexistentZone'}
+            except InvalidZoneError as e:
+                return AgentRequestHandler._format_invalid_zone(e)
+        except ServerCommunicationError:
+            successful = False
+            result     = {'error': 'ServerCommunication'}
+
+        return AgentRequestHandler._format_response(
+            result,
+            successful=successful
+        )
+
+    def _get_cache():
+        """
+        Get the zone cache, or None if caching is disabled.
+        """
+
+        return getattr(AgentRequestHandler._get_server(), 'cache', None)
+
+    def do_flush_cache(params):
+        """
+        Discard a zone, or all zones, from the zone cache.
+        """
+
+        cache = AgentRequestHandler._get_cache()
+        if not cache:
+            return AgentRequestHandler._format_response(
+                {'error': 'CacheDisabled'},
+                successful=False
+            )
+
+        if params.get('domain'):
+            cache.invalidate(params['domain'])
+        else:
+            cache.clear()
+
+        return AgentRequestHandler._format_response({'stats': cache.stats()})
+
+    def do_cache_stats(params):
+        """
+        Get the zone cache's size and hit/miss counters.
+        """
+
+        cache = AgentRequestHandler._get_cache()
+        if not cache:
+            return AgentRequestHandler._format_response(
+                {'error': 'CacheDisabled'},
+                successful=False
+            )
+
+        return AgentRequestHandler._format_response({'stats': cache.stats()})
+
     def do_install(params):
         """
         Install a DNS server.
@@ -216,6 +669,16 @@ class ClientRequestBuilder(ClientRequestBuilderBase):
     SOA_ATTR_STR  = ['primary_ns', 'responsible_person']
     RECORD_ATTR   = ['zone', 'name', 'type', 'content', 'ttl', 'priority']
 
+    # Zone import/export formats
+    ZONE_FORMATS = ['json', 'zone']
+
+    # Bulk record input formats, and the CSV columns for each bulk action
+    RECORD_FORMATS = ['csv', 'jsonl']
+    BULK_COLUMNS   = {
+        'add_records': ['name', 'type', 'content', 'ttl', 'priority'],
+        'rm_records':  ['name', 'type', 'content'],
+    }
+
     def init_subparser(subparser, subparser_factory):
         sp = subparser_factory.add_parser('add_record')
         for a in ClientRequestBuilder.RECORD_ATTR:
@@ -225,6 +688,20 @@ class ClientRequestBuilder(ClientRequestBuilderBase):
         for a in ClientRequestBuilder.RECORD_ATTR[:-2]:
             sp.add_argument(a)
 
+        sp = subparser_factory.add_parser('apply_changes')
+        sp.add_argument('zone')
+        sp.add_argument('file', help='JSON document with add and remove lists')
+
+        for action in ('add_records', 'rm_records'):
+            sp = subparser_factory.add_parser(action)
+            sp.add_argument('zone')
+            sp.add_argument('file', help='CSV or JSON lines file of records, '
+                                         'or - for stdin')
+            sp.add_argument('--format', dest='record_format',
+                            choices=ClientRequestBuilder.RECORD_FORMATS)
+            sp.add_argument('--chunk-size', dest='chunk_size', type=int,
+                            default=500, help='records per request')
+
         sp = subparser_factory.add_parser('add_zone')
         for a in (ClientRequestBuilder.ZONE_ATTR_STR +
                   ClientRequestBuilder.ZONE_ATTR_INT):
@@ -238,6 +715,36 @@ class ClientRequestBuilder(ClientRequestBuilderBase):
 
         sp = subparser_factory.add_parser('get_zone')
         sp.add_argument('domain')
+        sp.add_argument('--name')
+        sp.add_argument('--type')
+        sp.add_argument('--content', help='content prefix')
+        sp.add_argument('--limit', type=int)
+        sp.add_argument('--after', type=int)
+
+        sp = subparser_factory.add_parser('import_zone')
+        sp.add_argument('file')
+        sp.add_argument('--format', dest='zone_format',
+                        choices=ClientRequestBuilder.ZONE_FORMATS)
+        sp.add_argument('--origin')
+        sp.add_argument('--replace', action='store_true')
+
+        sp = subparser_factory.add_parser('sync_zone')
+        sp.add_argument('file')
+        sp.add_argument('--format', dest='zone_format',
+                        choices=ClientRequestBuilder.ZONE_FORMATS)
+        sp.add_argument('--origin')
+        sp.add_argument('--dry-run', dest='dry_run', action='store_true')
+
+        sp = subparser_factory.add_parser('export_zone')
+        sp.add_argument('domain')
+        sp.add_argument('--format', dest='zone_format', default='zone',
+                        choices=ClientRequestBuilder.ZONE_FORMATS)
+        sp.add_argument('--output')
+
+        sp = subparser_factory.add_parser('flush_cache')
+        sp.add_argument('domain', nargs='?')
+
+        subparser_factory.add_parser('cache_stats')
 
         subparser_factory.add_parser('install')
 
@@ -284,6 +791,106 @@ class ClientRequestBuilder(ClientRequestBuilderBase):
             ['dns', 'rm_record'], args
         )
 
+    def do_apply_changes(cli_args, client):
+        """
+        Add and remove many records at once.
+
+        The file contains a JSON object whose add and remove keys contain lists
+        of records, in the same form as for add_record and rm_record.
+        """
+
+        with open(cli_args.file) as f:
+            changes = json.load(f)
+
+        return ClientRequestBuilderBase._format_request(
+            ['dns', 'apply_changes'], {
+                'zone':   cli_args.zone,
+                'add':    changes.get('add', []),
+                'remove': changes.get('remove', []),
+            }
+        )
+
+    def _read_records(cli_args, columns):
+        """
+        Read records from a CSV or JSON lines file, or stdin, one at a time.
+
+        Each line holds one record: either a JSON object with the same keys as
+        for add_record and rm_record, or comma-separated values in the order of
+        columns. Unless a format is specified, lines beginning with a { are
+        assumed to contain JSON. Blank lines and those beginning with # are
+        ignored. Lines which can't be parsed are passed on verbatim, for the
+        agent to report as invalid.
+        """
+
+        if cli_args.file == '-':
+            f = sys.stdin
+        else:
+            f = open(cli_args.file)
+
+        try:
+            record_format = cli_args.record_format
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+
+                if not record_format:
+                    record_format = 'jsonl' if line.startswith('{') else 'csv'
+
+                if record_format == 'jsonl':
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        yield line
+                else:
+                    yield dict(zip(columns, next(csv.reader([line]))))
+        finally:
+            if f is not sys.stdin:
+                f.close()
+
+    def _format_bulk_requests(cli_args, action):
+        """
+        Split the records read by _read_records() into requests of at most
+        chunk_size records, generating them as the input is read.
+        """
+
+        records = ClientRequestBuilder._read_records(
+                cli_args, ClientRequestBuilder.BULK_COLUMNS[action])
+        chunk_size = max(cli_args.chunk_size, 1)
+
+        chunk = list(itertools.islice(records, chunk_size))
+        while chunk:
+            yield ClientRequestBuilderBase._format_request(
+                ['dns', action], {
+                    'zone':    cli_args.zone,
+                    'records': chunk,
+                }
+            )
+
+            chunk = list(itertools.islice(records, chunk_size))
+
+    def do_add_records(cli_args, client):
+        """
+        Add many records, read from a file or stdin.
+
+        Records are sent in several requests if there are more than will fit in
+        one; see _read_records() for the formats accepted.
+        """
+
+        return ClientRequestBuilder._format_bulk_requests(cli_args,
+                                                          'add_records')
+
+    def do_rm_records(cli_args, client):
+        """
+        Remove the records matching many sets of filters, read from a file or
+        stdin.
+
+        As for add_records, except that empty values are ignored.
+        """
+
+        return ClientRequestBuilder._format_bulk_requests(cli_args,
+                                                          'rm_records')
+
     def do_add_zone(cli_args, client):
         """
         Add a zone.
@@ -322,15 +929,107 @@ class ClientRequestBuilder(ClientRequestBuilderBase):
 
     def do_get_zone(cli_args, client):
         """
-        Retrieve a zone.
+        Retrieve a zone, or a page of its records.
         """
 
         return ClientRequestBuilderBase._format_request(
             ['dns', 'get_zone'], {
-                'domain': cli_args.domain
+                'domain':  cli_args.domain,
+                'filters': {
+                    'name':    cli_args.name,
+                    'type':    cli_args.type,
+                    'content': cli_args.content,
+                },
+                'limit':   cli_args.limit,
+                'after':   cli_args.after,
+            }
+        )
+
+    def _read_zone(cli_args):
+        """
+        Read a zone from a master file or JSON document, returning its format
+        and contents.
+
+        Unless a format is specified, files beginning with a { are assumed to
+        contain JSON.
+        """
+
+        with open(cli_args.file) as f:
+            data = f.read()
+
+        zone_format = cli_args.zone_format
+        if not zone_format:
+            zone_format = 'json' if data.lstrip().startswith('{') else 'zone'
+
+        if zone_format == 'json':
+            data = json.loads(data)
+
+        return (zone_format, data)
+
+    def do_import_zone(cli_args, client):
+        """
+        Import a zone from a master file or JSON document.
+        """
+
+        (zone_format, data) = ClientRequestBuilder._read_zone(cli_args)
+
+        return ClientRequestBuilderBase._format_request(
+            ['dns', 'import_zone'], {
+                'format':  zone_format,
+                'zone':    data,
+                'origin':  cli_args.origin,
+                'replace': cli_args.replace,
+            }
+        )
+
+    def do_sync_zone(cli_args, client):
+        """
+        Synchronise a zone with a master file or JSON document.
+        """
+
+        (zone_format, data) = ClientRequestBuilder._read_zone(cli_args)
+
+        return ClientRequestBuilderBase._format_request(
+            ['dns', 'sync_zone'], {
+                'format':  zone_format,
+                'zone':    data,
+                'origin':  cli_args.origin,
+                'dry_run': cli_args.dry_run,
+            }
+        )
+
+    def do_export_zone(cli_args, client):
+        """
+        Export a zone.
+        """
+
+        return ClientRequestBuilderBase._format_request(
+            ['dns', 'export_zone'], {
+                'domain': cli_args.domain,
+                'format': cli_args.zone_format,
+            }
+        )
+
+    def do_flush_cache(cli_args, client):
+        """
+        Flush the zone cache.
+        """
+
+        return ClientRequestBuilderBase._format_request(
+            ['dns', 'flush_cache'], {
+                'domain': cli_args.domain,
             }
         )
 
+    def do_cache_stats(cli_args, client):
+        """
+        Retrieve zone cache statistics.
+        """
+
+        return ClientRequestBuilderBase._format_request(
+            ['dns', 'cache_stats']
+        )
+
     def do_install(cli_args, client):
         """
         Install a DNS server.
@@ -347,7 +1046,9 @@ class ClientResponseFormatter(ClientResponseFormatterBase):
     """
 
     errors = {
+        'CacheDisabled': 'zone caching is disabled on the agent',
         'DuplicateZone': 'a zone with the specified domain already exists',
+        'NoMatchingRecords': 'no records matched',
         'NonexistentZone': 'the specified zone does not exist',
         'ServerCommunication': 'could not communicate with the DNS server',
         'UnknownError': 'an unknown error occurred within the agent',
@@ -359,6 +1060,17 @@ class ClientResponseFormatter(ClientResponseFormatterBase):
                      "* Responsible person: %s\n* Serial: %s\n* Refresh: %s\n" \
                      "* Retry: %s\n* Expire: %s\n* Minimum TTL: %s"
     RECORD_FMT     = "%s IN %s %s (MX priority %s; TTL %s)"
+    CACHE_FMT      = "Zone cache:\n* Zones: %d\n* Records: %d\n* Hits: %d\n" \
+                     "* Misses: %d\n* Evictions: %d"
+
+    BULK_ADD_FMT    = "Added %d of %d records"
+    BULK_RM_FMT     = "Removed %d records matching %d of %d filters"
+    BULK_SERIAL_FMT = "; serial is now %d"
+
+    SYNC_FMT         = "Removed %d and added %d records (%d unchanged); " \
+                       "serial is now %d"
+    SYNC_DRY_RUN_FMT = "Would remove %d and add %d records (%d unchanged); " \
+                       "serial is %d"
 
     def _format_directives(domain, ttl, origin):
         """
@@ -399,11 +1111,11 @@ class ClientResponseFormatter(ClientResponseFormatterBase):
         Format a set of records.
         """
 
-        result = 'Records:'
-        for r in records:
-            result += "\n* %s" %(ClientResponseFormatter._format_record(r))
+        lines = ['Records:']
+        lines.extend("* %s" %(ClientResponseFormatter._format_record(r))
+                     for r in records)
 
-        return result
+        return "\n".join(lines)
 
     def _format_zone(zone):
         """
@@ -430,6 +1142,110 @@ class ClientResponseFormatter(ClientResponseFormatterBase):
 
         return result
 
+    def do_apply_changes(cli_args, response):
+        """
+        Add and remove many records at once.
+        """
+
+        if not response['status']['successful']:
+            seeking = response['response'].get('error', 'UnknownError')
+            return (69, "Failed: %s" %(ClientResponseFormatter.errors[seeking]))
+
+        return "Added %d and removed %d records; serial is now %d" \
+               %(response['response']['added'],
+                 len(response['response']['removed']),
+                 response['response']['serial'])
+
+    def _format_bulk_record(record):
+        """
+        Format a record as given to add_records or rm_records.
+        """
+
+        if not isinstance(record, dict):
+            return str(record)
+
+        return ' '.join(str(record[k])
+                        for k in ('name', 'type', 'content', 'ttl', 'priority')
+                        if record.get(k) not in (None, ''))
+
+    def _format_bulk_results(response, prefix):
+        """
+        Format the outcome of each record in a bulk request.
+
+        Returns the exit status (non-zero if any record failed) and the lines
+        of output.
+        """
+
+        status = 0
+        lines  = []
+
+        for result in response['response']['results']:
+            record = ClientResponseFormatter._format_bulk_record(
+                    result['record'])
+
+            if 'removed' in result:
+                record += " (%d removed)" %(result['removed'])
+
+            if result['successful']:
+                lines.append("%s %s" %(prefix, record))
+                continue
+
+            status = 69
+            error  = ClientResponseFormatter.errors[result['error']]
+            if result.get('explanation'):
+                error += " (%s)" %(result['explanation'])
+            lines.append("! %s: %s" %(record, error))
+
+        return (status, lines)
+
+    def _format_bulk_serial(response):
+        """
+        Format the zone's new serial, if a bulk request changed it.
+        """
+
+        serial = response['response']['serial']
+        if serial is None:
+            return ''
+
+        return ClientResponseFormatter.BULK_SERIAL_FMT %(serial)
+
+    def do_add_records(cli_args, response):
+        """
+        Add many records.
+        """
+
+        if not response['status']['successful']:
+            return ClientResponseFormatter._format_error(response)
+
+        results = response['response']['results']
+        (status, lines) = ClientResponseFormatter._format_bulk_results(
+                response, '+')
+        lines.append(ClientResponseFormatter.BULK_ADD_FMT
+                     %(len([r for r in results if r['successful']]),
+                       len(results))
+                     + ClientResponseFormatter._format_bulk_serial(response))
+
+        return (status, "\n".join(lines))
+
+    def do_rm_records(cli_args, response):
+        """
+        Remove the records matching many sets of filters.
+        """
+
+        if not response['status']['successful']:
+            return ClientResponseFormatter._format_error(response)
+
+        results = response['response']['results']
+        (status, lines) = ClientResponseFormatter._format_bulk_results(
+                response, '-')
+        lines.append(ClientResponseFormatter.BULK_RM_FMT
+                     %(sum(r.get('removed', 0) for r in results),
+                       len([r for r in results if r['successful']]),
+                       len(results))
+                     + ClientResponseFormatter._format_bulk_serial(response))
+
+        return (status, "\n".join(lines))
+
     def do_add_zone(cli_args, response):
         """
         Add a zone.
@@ -483,8 +1299,14 @@ class ClientResponseFormatter(ClientResponseFormatterBase):
         result = "Failed: %s"
 
         if response['status']['successful']:
-            zone = response['response']['zone']
-            return ClientResponseFormatter._format_zone(zone)
+            zone   = response['response']['zone']
+            result = ClientResponseFormatter._format_zone(zone)
+
+            if response['response'].get('next') is not None:
+                result += "\n\nMore records: use --after %d for the next page" \
+                          %(response['response']['next'])
+
+            return result
         else:
             try:
                 seeking = response['response']['error']
@@ -493,6 +1315,103 @@ class ClientResponseFormatter(ClientResponseFormatterBase):
 
             return (69, result %(ClientResponseFormatter.errors[seeking]))
 
+    def _format_error(response):
+        """
+        Format an unsuccessful response, including any explanation.
+        """
+
+        result = ClientResponseFormatter.errors[
+                response['response'].get('error', 'UnknownError')]
+        if response['status']['explanation']:
+            result += " (%s)" %(response['status']['explanation'])
+
+        return (69, "Failed: %s" %(result))
+
+    def do_import_zone(cli_args, response):
+        """
+        Import a zone.
+        """
+
+        if response['status']['successful']:
+            return "Imported %d records into %s" \
+                   %(response['response']['records'],
+                     response['response']['domain'])
+
+        return ClientResponseFormatter._format_error(response)
+
+    def do_sync_zone(cli_args, response):
+        """
+        Synchronise a zone.
+        """
+
+        if not response['status']['successful']:
+            return ClientResponseFormatter._format_error(response)
+
+        result = response['response']
+        summary = ClientResponseFormatter.SYNC_FMT
+        if cli_args.dry_run:
+            summary = ClientResponseFormatter.SYNC_DRY_RUN_FMT
+
+        lines = [summary %(len(result['removed']), len(result['added']),
+                           result['unchanged'], result['serial'])]
+
+        lines.extend("- %s" %(ClientResponseFormatter._format_record(r))
+                     for r in result['removed'])
+        lines.extend("+ %s" %(ClientResponseFormatter._format_record(r))
+                     for r in result['added'])
+
+        return "\n".join(lines)
+
+    def do_export_zone(cli_args, response):
+        """
+        Export a zone, writing it to the output file if one was specified.
+        """
+
+        if not response['status']['successful']:
+            seeking = response['response'].get('error', 'UnknownError')
+            return (69, "Failed: %s" %(ClientResponseFormatter.errors[seeking]))
+
+        result = response['response']['zone']
+        if cli_args.zone_format == 'json':
+            result = json.dumps(result, indent=4, sort_keys=True)
+
+        if cli_args.output:
+            with open(cli_args.output, 'w') as f:
+                f.write(result)
+            result = ''
+
+        return result.rstrip("\n")
+
+    def _format_cache_stats(response):
+        """
+        Format zone cache statistics, or the reason they're unavailable.
+        """
+
+        if not response['status']['successful']:
+            seeking = response['response'].get('error', 'UnknownError')
+            return (69, "Failed: %s" %(ClientResponseFormatter.errors[seeking]))
+
+        stats = response['response']['stats']
+        return ClientResponseFormatter.CACHE_FMT %(stats['zones'],
+                                                   stats['records'],
+                                                   stats['hits'],
+                                                   stats['misses'],
+                                                   stats['evictions'])
+
+    def do_flush_cache(cli_args, response):
+        """
+        Flush the zone cache.
+        """
+
+        return ClientResponseFormatter._format_cache_stats(response)
+
+    def do_cache_stats(cli_args, response):
+        """
+        Retrieve zone cache statistics.
+        """
+
+        return ClientResponseFormatter._format_cache_stats(response)
+
     def do_install(cli_args, response):
         """
         Install a DNS server (just PowerDNS...for now).
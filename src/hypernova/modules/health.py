@@ -16,6 +16,8 @@ import os
 
 class AgentRequestHandler(AgentRequestHandlerBase):
 
+    batch_actions = ['load_averages']
+
     def do_load_averages(params):
 
         try:
@@ -8,7 +8,6 @@
 # Copyright (c) 2012 TDM Ltd
 #                    Luke Carrier <luke.carrier@tdm.info>
 
-from hypernova.libraries.siteconfig import get_provisioner
 from hypernova.modules import AgentRequestHandlerBase, \
                               ClientRequestBuilderBase, \
                               ClientResponseFormatterBase
@@ -23,11 +22,17 @@ class AgentRequestHandler(AgentRequestHandlerBase):
         Deploy a site from a profile.
         """
 
+        # The site configuration library is expensive to import, so it's left
+        # until a site is actually deployed
+        from hypernova.libraries.siteconfig import get_provisioner
+
         try:
             Provisioner = get_provisioner(params['profile'])
         except KeyError:
-            result = {'error': 'NonexistentProfile'}
-            successful = False
+            return AgentRequestHandlerBase._format_response(
+                {'error': 'NonexistentProfile'},
+                successful=False
+            )
 
         site = Provisioner(params['domain'])
         site.provision()
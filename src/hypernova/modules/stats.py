@@ -0,0 +1,140 @@
+#!/usr/bin/env python3.2
+
+#
+# HyperNova server management framework
+#
+# Agent statistics module
+#
+# Copyright (c) 2012 TDM Ltd
+#                    Luke Carrier <luke.carrier@tdm.info>
+#
+
+from hypernova.libraries.stats import STAGES, Stats
+from hypernova.modules import AgentRequestHandlerBase, \
+                              ClientRequestBuilderBase, \
+                              ClientResponseFormatterBase
+
+class AgentRequestHandler(AgentRequestHandlerBase):
+    """
+    Statistics request handler.
+
+    Exposes the agent's per-action latency statistics, broken down by request
+    pipeline stage.
+    """
+
+    batch_actions = ['get']
+
+    def do_get(params):
+        """
+        Get statistics for all actions beginning with the prefix parameter.
+        """
+
+        prefix = params.get('prefix', '')
+
+        return AgentRequestHandler._format_response({
+            'stats': Stats.get(prefix),
+        })
+
+    def do_reset(params):
+        """
+        Discard statistics for all actions beginning with the prefix
+        parameter.
+        """
+
+        Stats.reset(params.get('prefix', ''))
+
+        return AgentRequestHandler._format_response()
+
+
+class ClientRequestBuilder(ClientRequestBuilderBase):
+    """
+    Statistics request builder.
+    """
+
+    def init_subparser(subparser, subparser_factory):
+        for action in ('get', 'reset'):
+            sp = subparser_factory.add_parser(action)
+            sp.add_argument('prefix', nargs='?', default='')
+
+        return subparser
+
+    def do_get(cli_args, client):
+        """
+        Get statistics.
+        """
+
+        return ClientRequestBuilderBase._format_request(
+            ['stats', 'get'], {
+                'prefix': cli_args.prefix
+            }
+        )
+
+    def do_reset(cli_args, client):
+        """
+        Reset statistics.
+        """
+
+        return ClientRequestBuilderBase._format_request(
+            ['stats', 'reset'], {
+                'prefix': cli_args.prefix
+            }
+        )
+
+
+class ClientResponseFormatter(ClientResponseFormatterBase):
+    """
+    Statistics response formatter.
+    """
+
+    HEADER_FMT = "%-10s %8s %9s %9s %9s %9s %9s"
+    STAGE_FMT  = "%-10s %8d %9.3f %9.3f %9.3f %9.3f %9.3f"
+
+    def _format_action(name, stages):
+        """
+        Format the statistics for a single action, in milliseconds.
+        """
+
+        lines = [name]
+        for stage in STAGES + ('total',):
+            if stage not in stages:
+                continue
+
+            s = stages[stage]
+            lines.append(ClientResponseFormatter.STAGE_FMT
+                         %(stage, s['count'], s['mean'] * 1000,
+                           s['p50'] * 1000, s['p90'] * 1000, s['p99'] * 1000,
+                           s['max'] * 1000))
+
+        return "\n".join(lines)
+
+    def do_get(cli_args, response):
+        """
+        Get statistics.
+        """
+
+        if not response['status']['successful']:
+            return (69, 'Failed: an error occurred processing the request')
+
+        stats = response['response']['stats']
+        if not stats:
+            return 'No requests recorded'
+
+        header = ClientResponseFormatter.HEADER_FMT %('Stage (ms)', 'Count',
+                                                      'Mean', 'p50', 'p90',
+                                                      'p99', 'Max')
+        actions = [ClientResponseFormatter._format_action(name, stats[name])
+                   for name in sorted(stats)]
+
+        return "\n\n".join([header] + actions)
+
+    def do_reset(cli_args, response):
+        """
+        Reset statistics.
+        """
+
+        result = 'Failed: an error occurred processing the request'
+
+        if response['status']['successful']:
+            result = ''
+
+        return result
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3.2
+
+#
+# HyperNova server management framework
+#
+# Thin client front end
+#
+# Copyright (c) 2012 TDM Ltd
+#                    Luke Carrier <luke.carrier@tdm.info>
+#
+
+"""
+Forwards the command line, working directory and environment to the client
+daemon (see hypernova.clientd) over its Unix socket, then relays the command's
+output and exit status.
+
+If no daemon is running, the command is run by the full client in this
+process instead. So are commands which read standard input (i.e. which are
+given - as a file name), since it isn't forwarded to the daemon.
+
+Only the standard library's lightest modules are imported here: starting the
+front end should cost little more than starting the interpreter.
+"""
+
+import json
+import os
+import socket
+import sys
+
+# Name of the daemon's socket, within the client's configuration directory
+SOCKET_FILE = 'clientd.sock'
+
+def get_config_dir():
+    """
+    Get the client's configuration directory.
+    """
+
+    config_dir = os.getenv('CONFDIR')
+    if config_dir:
+        return os.path.abspath(config_dir)
+
+    return os.path.join(os.getenv('HOME'), '.hypernova')
+
+def forward(argv, socket_path):
+    """
+    Run a command through the daemon.
+
+    Returns the command's exit status, or None if no daemon is listening.
+    """
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+    except socket.error:
+        sock.close()
+        return None
+
+    streams = {
+        'stdout': sys.stdout,
+        'stderr': sys.stderr,
+    }
+
+    with sock:
+        request = json.dumps({
+            'argv': argv,
+            'cwd':  os.getcwd(),
+            'env':  dict(os.environ),
+        })
+        sock.sendall(bytes(request + "\n", 'UTF-8'))
+
+        for line in sock.makefile('rb'):
+            frame = json.loads(str(line, 'UTF-8'))
+            if 'exit' in frame:
+                return frame['exit']
+
+            streams[frame['stream']].write(frame['data'])
+            streams[frame['stream']].flush()
+
+    print('Failed: the client daemon stopped responding', file=sys.stderr)
+    return 69
+
+def main(argv):
+    """
+    Run a command, through the daemon if possible.
+    """
+
+    if '-' not in argv:
+        socket_path = os.path.join(get_config_dir(), SOCKET_FILE)
+        status      = forward(argv, socket_path)
+        if status is not None:
+            sys.exit(status)
+
+    import runpy
+    runpy.run_module('hypernova.client', run_name='__main__', alter_sys=True)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
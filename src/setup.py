@@ -30,6 +30,7 @@ setup(
         'hypernova.libraries.appconfig.httpserver',
         'hypernova.libraries.siteconfig',
         'hypernova.libraries.packagemanagement',
+        'hypernova.libraries.securityfilters',
         'hypernova.modules',
     ],
     install_requires = ['python-gnupg'],
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3.2
+
+#
+# HyperNova server management framework
+#
+# Benchmark harness
+#
+# Copyright (c) 2012 TDM Ltd
+#                    Luke Carrier <luke.carrier@tdm.info>
+#
+
+import os
+import subprocess
+import time
+
+# High resolution clock
+#
+# Python 3.3 introduced perf_counter(); fall back to the wall clock on earlier
+# releases.
+clock = getattr(time, 'perf_counter', time.time)
+
+def rate(function, count):
+    """
+    Call function count times, passing it the iteration, and return the number
+    of calls per second.
+    """
+
+    start = time.time()
+    for i in range(count):
+        function(i)
+
+    return count / (time.time() - start)
+
+def percentile(samples, percentile):
+    """
+    Get the sample at the specified percentile of a sorted list of samples.
+    """
+
+    if not samples:
+        return 0.0
+
+    index = int(round((len(samples) - 1) * percentile / 100))
+    return samples[index]
+
+def summarise(latencies, elapsed, errors=0):
+    """
+    Summarise a run of requests.
+
+    latencies should contain the time taken to serve each request and elapsed
+    the time taken by the run as a whole, both in seconds. Latencies in the
+    summary are in milliseconds.
+    """
+
+    latencies = sorted(latencies)
+    count = len(latencies)
+
+    return {
+        'requests':   count,
+        'errors':     errors,
+        'throughput': count / elapsed if elapsed else 0.0,
+        'mean':       sum(latencies) / count * 1000 if count else 0.0,
+        'p50':        percentile(latencies, 50) * 1000,
+        'p99':        percentile(latencies, 99) * 1000,
+        'max':        latencies[-1] * 1000 if count else 0.0,
+    }
+
+def git_commit():
+    """
+    Get the commit the working tree is based on, if we're in a git repository.
+    """
+
+    try:
+        with open(os.devnull, 'w') as devnull:
+            commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                             stderr=devnull)
+        return str(commit, 'ASCII').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3.2
+
+#
+# HyperNova server management framework
+#
+# GPG worker pool benchmark
+#
+# Copyright (c) 2012 TDM Ltd
+#                    Luke Carrier <luke.carrier@tdm.info>
+#
+
+"""
+Measure what the GPG worker pool does, and doesn't, save.
+
+Every operation on a GPG instance spawns a gpg process, whether or not the
+instance belongs to a pool: the pool bounds the number running at once and
+queues the rest, but doesn't make any one of them cheaper. The benchmark times
+an encrypt-and-sign and decrypt round trip through a lone GPG instance and
+through a GPGPool, from a number of concurrent threads, alongside the time
+taken merely to spawn gpg:
+
+    python3.2 -m benchmarks.gpgpool [--pool-size 4] [--concurrency 1 8]
+                                    [--operations 200]
+"""
+
+from argparse import ArgumentParser
+from benchmarks import clock, summarise
+import gnupg
+from hypernova.libraries.gnupg import GPG, GPGPool
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+
+class GPGPoolBenchmark:
+    """
+    GPG worker pool benchmark.
+    """
+
+    key_params = {
+        'key_type':      'RSA',
+        'key_length':    2048,
+        'name_real':     'HyperNova benchmark',
+        'name_email':    'benchmark@hn.org',
+        'no_protection': True,
+    }
+
+    def __init__(self, pool_size=4, concurrency=[1, 8], operations=200):
+        """
+        Initialise values.
+        """
+
+        self.pool_size   = pool_size
+        self.concurrency = concurrency
+        self.operations  = operations
+
+    def setUp(self):
+        """
+        Generate a key, to which we encrypt and with which we sign.
+        """
+
+        self.gpg_dir = tempfile.mkdtemp(prefix='hn-bench-')
+
+        gpg = gnupg.GPG(gnupghome=self.gpg_dir)
+        self.fingerprint = gpg.gen_key(gpg.gen_key_input(
+                **self.key_params)).fingerprint
+        gpg.trust_keys(self.fingerprint, 'TRUST_ULTIMATE')
+
+    def tearDown(self):
+        """
+        Discard the key.
+        """
+
+        shutil.rmtree(self.gpg_dir, ignore_errors=True)
+
+    def run_spawn(self):
+        """
+        Time spawning gpg, without asking it to do anything of note.
+        """
+
+        latencies = []
+        start = clock()
+        with open(os.devnull, 'w') as devnull:
+            for i in range(self.operations):
+                started = clock()
+                subprocess.call(['gpg', '--version'], stdout=devnull)
+                latencies.append(clock() - started)
+
+        return summarise(latencies, clock() - start)
+
+    def run(self, gpg, concurrency):
+        """
+        Time round trips through gpg from concurrency threads at once.
+        """
+
+        latencies = []
+        errors    = []
+
+        def work(count):
+            for i in range(count):
+                started = clock()
+                encrypted = gpg.encrypt('data', self.fingerprint,
+                                        sign=self.fingerprint)
+                if str(gpg.decrypt(str(encrypted))) != 'data':
+                    errors.append(1)
+                latencies.append(clock() - started)
+
+        threads = [threading.Thread(target=work,
+                                    args=(self.operations // concurrency,))
+                   for i in range(concurrency)]
+
+        start = clock()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        return summarise(latencies, clock() - start, len(errors))
+
+    def execute(self):
+        """
+        Run each configuration and report.
+        """
+
+        self.setUp()
+
+        try:
+            results = [('spawn gpg', self.run_spawn())]
+
+            lone = GPG(gnupghome=self.gpg_dir)
+            pool = GPGPool(self.pool_size, 0, 'gpg', self.gpg_dir)
+            for concurrency in self.concurrency:
+                results.append(('lone, %d threads' %(concurrency),
+                                self.run(lone, concurrency)))
+                results.append(('pool of %d, %d threads' %(self.pool_size,
+                                                           concurrency),
+                                self.run(pool, concurrency)))
+        finally:
+            self.tearDown()
+
+        print('%-24s %10s %10s %10s %10s' %('Configuration', 'Ops/s',
+                                           'mean (ms)', 'p99 (ms)', 'Errors'))
+        for (name, result) in results:
+            print('%-24s %10.1f %10.2f %10.2f %10d'
+                  %(name, result['throughput'], result['mean'],
+                    result['p99'], result['errors']))
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='GPG worker pool benchmark')
+    parser.add_argument('--pool-size', dest='pool_size', type=int, default=4)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8])
+    parser.add_argument('--operations', type=int, default=200)
+    args = parser.parse_args()
+
+    GPGPoolBenchmark(args.pool_size, args.concurrency,
+                     args.operations).execute()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3.2
+
+#
+# HyperNova server management framework
+#
+# Persistent connection benchmark
+#
+# Copyright (c) 2012 TDM Ltd
+#                    Luke Carrier <luke.carrier@tdm.info>
+#
+
+"""
+Compare the rate at which a burst of dns.add_record requests can be served
+with a fresh connection per request against persistent connections.
+
+The benchmark talks to a running agent paired with the client configuration in
+the specified directory, exactly as hn-client would. Records are added to the
+specified zone (which must exist) and removed again afterwards:
+
+    python3.2 -m benchmarks.keepalive [--count N] node zone
+"""
+
+from argparse import ArgumentParser, Namespace
+from benchmarks import rate
+from hypernova.libraries.client import Client
+from hypernova.libraries.configuration import ConfigurationFactory
+from hypernova.modules import dns
+import os
+
+class KeepAliveBenchmark:
+    """
+    Persistent connection benchmark.
+    """
+
+    def __init__(self, config_dir, node, zone, count, security_filter=None):
+        """
+        Load the client configuration.
+        """
+
+        config = ConfigurationFactory.get('hypernova',
+                root_dir=os.path.join(config_dir, 'client.ini'))
+        servers = ConfigurationFactory.get('hypernova.servers',
+                root_dir=os.path.join(config_dir, 'servers.ini'))
+
+        if not security_filter:
+            security_filter = config.get('security', 'filter',
+                                         fallback='gnupg')
+
+        (self.host, sep, self.port) = servers[node]['addr'].partition(':')
+        self.keys     = (config['client']['privkey'], servers[node]['pubkey'])
+        self.gpg_dir  = os.path.join(config_dir, 'gpg')
+        self.security_filter = security_filter
+
+        self.zone  = zone
+        self.count = count
+
+    def get_client(self, keep_alive):
+        """
+        Get a client for the node.
+        """
+
+        return Client(self.host, self.port, self.gpg_dir, self.security_filter,
+                      keep_alive=keep_alive)
+
+    def get_record(self, burst, i):
+        """
+        Get the arguments for a record, as the CLI would supply them.
+        """
+
+        return Namespace(zone=self.zone,
+                         name='hn-bench-%s-%d.%s' %(burst, i, self.zone),
+                         type='a', content='192.0.2.%d' %(i % 254 + 1),
+                         ttl=300, priority=-1)
+
+    def burst(self, name, keep_alive):
+        """
+        Add count records, returning the number of requests served per second.
+        """
+
+        client = self.get_client(keep_alive)
+
+        def add_record(i):
+            request = dns.ClientRequestBuilder.do_add_record(
+                    self.get_record(name, i), client)
+            client.query(request, *self.keys)
+
+        return rate(add_record, self.count)
+
+    def clean_up(self, name):
+        """
+        Remove the records added by a burst.
+        """
+
+        client = self.get_client(True)
+
+        for i in range(self.count):
+            request = dns.ClientRequestBuilder.do_rm_record(
+                    self.get_record(name, i), client)
+            client.query(request, *self.keys)
+
+    def execute(self):
+        """
+        Run both bursts and report.
+        """
+
+        results = []
+        for (name, keep_alive) in (('fresh', False), ('keepalive', True)):
+            try:
+                results.append(self.burst(name, keep_alive))
+            finally:
+                self.clean_up(name)
+
+        print('fresh connections: %8.1f req/s' %(results[0]))
+        print('keep-alive:        %8.1f req/s (%.2fx)' %(results[1],
+                                                         results[1] / results[0]))
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='persistent connection benchmark')
+    parser.add_argument('--config-dir', dest='config_dir',
+                        default=os.path.join(os.getenv('HOME'), '.hypernova'))
+    parser.add_argument('--count', type=int, default=500)
+    parser.add_argument('--filter', dest='security_filter', default=None)
+    parser.add_argument('node')
+    parser.add_argument('zone')
+    args = parser.parse_args()
+
+    KeepAliveBenchmark(args.config_dir, args.node, args.zone, args.count,
+                       args.security_filter).execute()
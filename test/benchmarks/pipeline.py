@@ -0,0 +1,389 @@
+#!/usr/bin/env python3.2
+
+#
+# HyperNova server management framework
+#
+# Request pipeline benchmark
+#
+# Copyright (c) 2012 TDM Ltd
+#                    Luke Carrier <luke.carrier@tdm.info>
+#
+
+"""
+Measure the throughput and latency of the agent's request pipeline.
+
+The benchmark starts an agent server in-process, with a throwaway keyring (or
+the null security filter), and drives it from a number of concurrent clients.
+DNS requests are served from the in-memory DNS adapter (or from an SQLite
+database on the PowerDNS schema), so no database server is required. A crypto-only benchmark times the security filters alone, without
+the network or the modules.
+
+Results are printed and may be saved as JSON, alongside the commit they were
+taken from; passing a previous result file with --compare reports the change:
+
+    python3.2 -m benchmarks.pipeline [--filter session] [--mode threading]
+                                     [--dns-adapter memory]
+                                     [--concurrency 4] [--requests 1000]
+                                     [--output FILE] [--compare FILE]
+                                     [workload ...]
+"""
+
+from argparse import ArgumentParser
+from benchmarks import clock, git_commit, summarise
+import configparser
+import gnupg
+from hypernova import agent
+from hypernova.libraries.appconfig.dnsserver import NonexistentZoneError, \
+                                                    Record, SoaRecord, Zone, \
+                                                    get_authoritative_server
+from hypernova.libraries.client import Client, ConnectionPool
+from hypernova.libraries.configuration import ConfigurationFactory
+from hypernova.libraries.gnupg import GPG
+from hypernova.libraries.securityfilters import get_security_filter
+from hypernova.modules import AgentRequestHandlerBase
+import json
+import os
+import platform
+import shutil
+import tempfile
+import threading
+import time
+
+# Domain of the zone served by the dns.get_zone workload
+ZONE = 'bench.hypernova.org'
+
+class PipelineBenchmark:
+    """
+    Request pipeline benchmark.
+    """
+
+    # Requests, keyed by workload name
+    WORKLOADS = {
+        'health.load_averages': {
+            'action': 'health.load_averages',
+        },
+        'dns.get_zone': {
+            'action':     'dns.get_zone',
+            'parameters': {'domain': ZONE},
+        },
+    }
+
+    key_params = {
+        'key_type':      'RSA',
+        'key_length':    2048,
+        'name_real':     'HyperNova benchmark',
+        'name_email':    'benchmark@hn.org',
+        'no_protection': True,
+    }
+
+    def __init__(self, security_filter='session', mode='threading',
+                 concurrency=4, requests=1000, records=100,
+                 dns_adapter='memory'):
+        """
+        Initialise values.
+        """
+
+        self.security_filter = security_filter
+        self.mode            = mode
+        self.dns_adapter     = dns_adapter
+        self.concurrency     = concurrency
+        self.requests        = requests
+        self.records         = records
+
+        self.keys = (None, None)
+
+    def setUp(self):
+        """
+        Generate keys, populate the DNS server and start the agent.
+        """
+
+        self.tmp_dir = tempfile.mkdtemp(prefix='hn-bench-')
+        self.agent_gpg_dir  = os.path.join(self.tmp_dir, 'agent')
+        self.client_gpg_dir = os.path.join(self.tmp_dir, 'client')
+        for gpg_dir in (self.agent_gpg_dir, self.client_gpg_dir):
+            os.mkdir(gpg_dir, 0o700)
+
+        if self.security_filter != 'null':
+            self._generate_keys()
+
+        self.dns_options = {}
+        if self.dns_adapter == 'sqlite':
+            self.dns_options['path'] = os.path.join(self.tmp_dir, 'dns.db')
+
+        config = configparser.ConfigParser()
+        config.read_dict({
+            'dns': dict(self.dns_options, adapter=self.dns_adapter),
+            'logging': dict((log, os.devnull)
+                            for log in ('main_log', 'request_log',
+                                        'error_log')),
+            'security': {'filter': self.security_filter},
+            'server': {'address': '127.0.0.1', 'port': '0'},
+        })
+        ConfigurationFactory.publish('hypernova', config, agent.CONFIG_SCHEMA)
+        self._populate_zone()
+
+        agent_fp = self.keys[1]
+        self.agent_filter  = self._get_filter(self.agent_gpg_dir, 4)
+        self.client_filter = self._get_filter(self.client_gpg_dir, 0)
+
+        (server_class, handler_class) = agent.SERVER_MODES[self.mode]
+        self.server = server_class(('127.0.0.1', 0), handler_class,
+                                   self.agent_filter, agent_fp)
+        self.server.workers    = max(self.concurrency, 4)
+        self.server.max_queued = self.concurrency * 2
+        self.server.prepare_busy_response()
+
+        self.server_thread = threading.Thread(target=self.server.serve_forever)
+        self.server_thread.daemon = True
+        self.server_thread.start()
+
+        # Share the filter (and therefore any session) between clients, and
+        # don't let the pool close connections other clients could reuse
+        Client.security_filters[(self.security_filter, self.client_gpg_dir,
+                                 ())] = self.client_filter
+        Client.connection_pool = ConnectionPool(max_idle=self.concurrency)
+
+    def tearDown(self):
+        """
+        Stop the agent and discard the keys.
+        """
+
+        self.server.shutdown()
+        self.server.server_close()
+
+        Client.connection_pool.clear()
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def _generate_keys(self):
+        """
+        Generate a keypair each for the agent and client, and pair them.
+        """
+
+        keys = []
+        for gpg_dir in (self.agent_gpg_dir, self.client_gpg_dir):
+            gpg = gnupg.GPG(gnupghome=gpg_dir)
+            key = gpg.gen_key(gpg.gen_key_input(**self.key_params))
+            keys.append((gpg, key.fingerprint))
+
+        ((agent_gpg, agent_fp), (client_gpg, client_fp)) = keys
+        for (gpg, fingerprint, peer) in ((agent_gpg, agent_fp, client_gpg),
+                                         (client_gpg, client_fp, agent_gpg)):
+            peer.import_keys(gpg.export_keys(fingerprint))
+            peer.trust_keys(fingerprint, 'TRUST_ULTIMATE')
+
+        self.keys = (client_fp, agent_fp)
+
+    def _get_filter(self, gpg_dir, pool_size):
+        """
+        Get a security filter using the keyring in gpg_dir.
+        """
+
+        if self.security_filter == 'null':
+            return get_security_filter('null')
+
+        gpg = GPG.get_gpg(gnupghome=gpg_dir, pool_size=pool_size,
+                          instancename=gpg_dir)
+        return get_security_filter(self.security_filter, gpg, {})
+
+    def _populate_zone(self):
+        """
+        Create the zone served by the dns.get_zone workload.
+        """
+
+        server = get_authoritative_server(self.dns_adapter,
+                                          **self.dns_options)
+        soa = SoaRecord('ns1.%s' %(ZONE), 'hostmaster.%s' %(ZONE), 1, 10800,
+                        3600, 604800, 3600)
+        records = [Record('host%d.%s' %(i, ZONE), 'a',
+                          '192.0.2.%d' %(i % 254 + 1), 300)
+                   for i in range(self.records)]
+
+        try:
+            server.rm_zone(ZONE)
+        except NonexistentZoneError:
+            pass
+        server.add_zone(Zone(ZONE, None, None, soa, records))
+
+    def _get_client(self):
+        """
+        Get a client for the agent.
+        """
+
+        (host, port) = self.server.server_address
+        return Client(host, port, self.client_gpg_dir, self.security_filter)
+
+    def run_workload(self, request):
+        """
+        Send requests requests from concurrency clients, returning a summary.
+        """
+
+        # Any remainder is shared out among the first clients
+        (share, extra) = divmod(self.requests, self.concurrency)
+        latencies = []
+        errors    = []
+        lock      = threading.Lock()
+
+        # Handshakes and the like shouldn't count
+        self._get_client().query(request, *self.keys)
+
+        def work(count):
+            client = self._get_client()
+            mine = []
+            failed = 0
+
+            for i in range(count):
+                start = clock()
+                try:
+                    response = client.query(request, *self.keys)
+                    if not response['status']['successful']:
+                        failed += 1
+                except Exception:
+                    failed += 1
+                mine.append(clock() - start)
+
+            with lock:
+                latencies.extend(mine)
+                errors.append(failed)
+
+        threads = [threading.Thread(target=work,
+                                    args=(share + (1 if i < extra else 0), ))
+                   for i in range(self.concurrency)]
+
+        start = clock()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = clock() - start
+
+        return summarise(latencies, elapsed, sum(errors))
+
+    def run_crypto(self):
+        """
+        Time a request and response round trip through the security filters,
+        without the network or modules.
+        """
+
+        (client_fp, agent_fp) = self.keys
+        request = json.dumps(self.WORKLOADS['dns.get_zone'])
+        response = json.dumps(AgentRequestHandlerBase._format_response(
+                {'zone': {}}))
+
+        def round_trip():
+            data = self.client_filter.encrypt(request, client_fp, agent_fp)
+            (data, peer) = self.agent_filter.decrypt(data, None, agent_fp)
+            data = self.agent_filter.encrypt(response, agent_fp, peer)
+            self.client_filter.decrypt(data, agent_fp, client_fp)
+
+        round_trip()
+
+        latencies = []
+        start = clock()
+        for i in range(self.requests):
+            started = clock()
+            round_trip()
+            latencies.append(clock() - started)
+
+        return summarise(latencies, clock() - start)
+
+    def execute(self, workloads):
+        """
+        Run the workloads, returning the results.
+        """
+
+        self.setUp()
+
+        try:
+            results = {}
+            for name in workloads:
+                if name == 'crypto':
+                    results[name] = self.run_crypto()
+                else:
+                    results[name] = self.run_workload(self.WORKLOADS[name])
+        finally:
+            self.tearDown()
+
+        return {
+            'commit':  git_commit(),
+            'time':    int(time.time()),
+            'python':  platform.python_version(),
+            'options': {
+                'filter':      self.security_filter,
+                'mode':        self.mode,
+                'dns_adapter': self.dns_adapter,
+                'concurrency': self.concurrency,
+                'requests':    self.requests,
+                'records':     self.records,
+            },
+            'results': results,
+        }
+
+
+def format_results(results, baseline=None):
+    """
+    Format results for printing, comparing them with a baseline if supplied.
+    """
+
+    lines = ['%-22s %8s %10s %9s %9s %9s' %('Workload', 'Requests', 'Req/s',
+                                             'p50 (ms)', 'p99 (ms)', 'Errors')]
+
+    for (name, result) in sorted(results['results'].items()):
+        lines.append('%-22s %8d %10.1f %9.3f %9.3f %9d'
+                     %(name, result['requests'], result['throughput'],
+                       result['p50'], result['p99'], result['errors']))
+
+        if baseline and name in baseline['results']:
+            old = baseline['results'][name]
+            lines.append('%-22s %8s %+9.1f%% %+8.1f%% %+8.1f%%'
+                         %('  vs. %s' %((baseline['commit'] or '?')[:8]), '',
+                           change(old['throughput'], result['throughput']),
+                           change(old['p50'], result['p50']),
+                           change(old['p99'], result['p99'])))
+
+    return "\n".join(lines)
+
+def change(old, new):
+    """
+    Get the percentage change between two values.
+    """
+
+    return (new - old) / old * 100 if old else 0.0
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='request pipeline benchmark')
+    parser.add_argument('--filter', dest='security_filter', default='session',
+                        choices=['gnupg', 'null', 'session'])
+    parser.add_argument('--mode', default='threading',
+                        choices=sorted(agent.SERVER_MODES))
+    parser.add_argument('--dns-adapter', default='memory',
+                        choices=['memory', 'sqlite'])
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--records', type=int, default=100)
+    parser.add_argument('--output')
+    parser.add_argument('--compare')
+    parser.add_argument('workloads', nargs='*',
+                        default=sorted(PipelineBenchmark.WORKLOADS)
+                                + ['crypto'])
+    args = parser.parse_args()
+
+    for name in args.workloads:
+        if name != 'crypto' and name not in PipelineBenchmark.WORKLOADS:
+            parser.error('unknown workload %s' %(name))
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    benchmark = PipelineBenchmark(args.security_filter, args.mode,
+                                  args.concurrency, args.requests, args.records,
+                                  args.dns_adapter)
+    results = benchmark.execute(args.workloads)
+
+    print(format_results(results, baseline))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=4, sort_keys=True)
@@ -0,0 +1,238 @@
+#!/usr/bin/env python3.2
+
+#
+# HyperNova server management framework
+#
+# Agent request handling tests.
+#
+# Copyright (c) 2012 TDM Ltd
+#                    Luke Carrier <luke.carrier@tdm.info>
+#
+
+from unit import UnitTestCase
+
+from concurrent.futures import ThreadPoolExecutor
+from http.client import HTTPConnection
+from hypernova import modules
+from hypernova.agent import AgentRequestHandler, AgentServer, \
+                           PoolAgentServer
+from hypernova.libraries.securityfilters import SIGNED_HEADER, \
+                                                get_security_filter
+from hypernova.modules import health
+import json
+import socket
+import threading
+import time
+
+class TestAgent(UnitTestCase):
+    """
+    Test the agent's handling of requests, over HTTP and with the null
+    security filter.
+    """
+
+    server_class = AgentServer
+
+    def setUp(self):
+        self.server = self.server_class(('127.0.0.1', 0), AgentRequestHandler,
+                                        get_security_filter('null'), None)
+        self.server.batch_executor = ThreadPoolExecutor(2)
+
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.server.batch_executor.shutdown()
+
+    def query(self, params):
+        """
+        Send a request, returning the HTTP status and the decoded response.
+        """
+
+        body = bytes(json.dumps(params), 'UTF-8')
+
+        connection = HTTPConnection(*self.server.server_address)
+        try:
+            connection.request('GET', '/', body=body,
+                               headers={'Content-Length': len(body)})
+            response = connection.getresponse()
+            return (response.status, json.loads(str(response.read(), 'UTF-8')))
+        finally:
+            connection.close()
+
+    def test_module_load_failure(self):
+        modules.MODULES['broken'] = 'hypernova.modules.nonexistent'
+        try:
+            # Failures are remembered until they're cleared
+            for attempt in range(2):
+                (status, response) = self.query({'action': 'broken.get'})
+                self.assertEqual(status, 500)
+                self.assertIn('broken', modules._failed)
+
+            modules.clear_failures()
+            self.assertEqual(self.query({'action': 'broken.get'})[0], 500)
+
+            # Only the broken module's requests in a batch fail
+            (status, response) = self.query({'batch': [
+                {'action': 'broken.get'},
+                {'action': 'health.load_averages'},
+            ]})
+            self.assertEqual(status, 200)
+            self.assertEqual([r['status']['error_code']
+                              for r in response['response']['results']],
+                             [500, 0])
+        finally:
+            del modules.MODULES['broken']
+            modules.clear_failures()
+
+    def test_batch(self):
+        batch = [
+            {'action': 'health.load_averages'},
+            'health.load_averages',
+            {'action': 'dns.install'},
+            {'action': 'health.nonexistent'},
+            {'action': 'health.load_averages'},
+        ]
+
+        # Each request's result is returned in order, and those which fail
+        # don't take the others down with them
+        for parallel in (False, True):
+            (status, response) = self.query({'batch':    batch,
+                                             'parallel': parallel})
+            self.assertEqual(status, 200)
+            self.assertFalse(response['status']['successful'])
+
+            results = response['response']['results']
+            self.assertEqual([r['status']['error_code'] for r in results],
+                             [0, 400, 405, 405, 0])
+            self.assertIn('1m', results[0]['response'])
+
+        self.assertEqual(self.query({'batch': 'health.load_averages'})[0], 400)
+
+        self.server.max_batch = 2
+        self.assertEqual(self.query({'batch': batch})[0], 413)
+
+    def test_concurrency_limits(self):
+        def fail(params):
+            raise RuntimeError('failed')
+
+        self.server.set_concurrency_limits({'health': '1'})
+        load_averages = health.AgentRequestHandler.do_load_averages
+        health.AgentRequestHandler.do_load_averages = fail
+        try:
+            # A failing request must give up its slot, or the module would
+            # refuse every request after it
+            for attempt in range(2):
+                self.assertEqual(
+                        self.query({'action': 'health.load_averages'})[0],
+                        500)
+        finally:
+            health.AgentRequestHandler.do_load_averages = load_averages
+
+        self.assertEqual(self.query({'action': 'health.load_averages'})[0],
+                         200)
+
+        # Requests beyond the cap are turned away, whether or not batched
+        slots = self.server.admit('health', 'load_averages')
+        try:
+            self.assertEqual(self.query({'action': 'health.load_averages'})[0],
+                             503)
+
+            (status, response) = self.query({'batch': [
+                {'action': 'health.load_averages'},
+            ]})
+            self.assertEqual(response['response']['results'][0]['status']
+                                     ['error_code'], 503)
+        finally:
+            self.server.release(slots)
+
+
+class TestAgentPool(TestAgent):
+    """
+    Test the agent's handling of requests, on a bounded thread pool.
+    """
+
+    class server_class(PoolAgentServer):
+        workers    = 1
+        max_queued = 1
+
+    def setUp(self):
+        super().setUp()
+        self.server.prepare_busy_response()
+
+    def wait_for(self, condition):
+        """
+        Wait (briefly) for a condition to become true.
+        """
+
+        for i in range(200):
+            if condition():
+                return True
+            time.sleep(0.005)
+
+        return False
+
+    def test_busy(self):
+        address = self.server.server_address
+
+        # Occupy the only worker, then the only place in the queue
+        waiting = []
+        for expected in (0, 1):
+            waiting.append(socket.create_connection(address))
+            self.assertTrue(self.wait_for(
+                    lambda: self.server._queue is not None
+                            and self.server._queue.qsize() == expected))
+
+        try:
+            body = b'{"action": "health.load_averages"}'
+            connection = HTTPConnection(*address)
+            connection.request('GET', '/', body=body,
+                               headers={'Content-Length': len(body)})
+            response = connection.getresponse()
+
+            self.assertEqual(response.status, 503)
+            self.assertEqual(response.getheader(SIGNED_HEADER), '1')
+            self.assertEqual(json.loads(str(response.read(), 'UTF-8'))
+                                     ['status']['error_code'], 503)
+            connection.close()
+        finally:
+            for sock in waiting:
+                sock.close()
+
+        # Once there's capacity again, requests are served
+        self.assertTrue(self.wait_for(lambda: self.server._queue.empty()))
+        self.assertEqual(self.query({'action': 'health.load_averages'})[0],
+                         200)
+
+    def test_idle_keep_alive(self):
+        # Long enough that only giving way to waiting connections can free
+        # the worker in time
+        self.server.keep_alive_timeout = 60
+
+        address = self.server.server_address
+        body    = b'{"action": "health.load_averages"}'
+
+        # Each served connection idles, keeping its connection alive, until
+        # one more than there are workers and places in the queue has been
+        # served
+        idle = []
+        try:
+            for i in range(3):
+                connection = HTTPConnection(*address, timeout=5)
+                connection.request('GET', '/', body=body,
+                                   headers={'Content-Length': len(body)})
+                response = connection.getresponse()
+                self.assertEqual(response.status, 200)
+                response.read()
+                idle.append(connection)
+
+            self.assertEqual(self.query({'action': 'health.load_averages'})[0],
+                             200)
+
+            # The connections gave up their worker by closing
+            self.assertEqual(idle[0].sock.recv(1), b'')
+        finally:
+            for connection in idle:
+                connection.close()
@@ -0,0 +1,256 @@
+#!/usr/bin/env python3.2
+
+#
+# HyperNova server management framework
+#
+# Client application tests.
+#
+# Copyright (c) 2012 TDM Ltd
+#                    Luke Carrier <luke.carrier@tdm.info>
+#
+
+from unit import UnitTestCase
+
+import argparse
+import configparser
+from hypernova.client import ClientActionBase, ClientBatchAction, \
+                            ClientCompleteAction, ClientRequestAction, \
+                            SimpleClientInterface
+from hypernova.libraries.configuration import ConfigurationFactory
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+class Client:
+    """
+    Stand-in client, recording the requests it's sent and answering each with
+    the next of a series of responses.
+    """
+
+    def __init__(self, responses):
+        self.responses = responses
+        self.requests  = []
+
+    def query(self, params, client_fp, server_fp):
+        self.requests.append((params, client_fp, server_fp))
+        return self.responses.pop(0)
+
+
+class TestClient(UnitTestCase):
+    """
+    Test the client's actions, against stand-in nodes.
+    """
+
+    def setUp(self):
+        self.root_dir = tempfile.mkdtemp()
+
+        config = configparser.ConfigParser()
+        config.read_dict({'client': {'privkey': 'CLIENT'}})
+
+        servers = configparser.ConfigParser()
+        servers.read_dict({
+            'web1': {'addr': 'web1:3030', 'pubkey': 'WEB1',
+                     'groups': 'web, prod'},
+            'web2': {'addr': 'web2:3030', 'pubkey': 'WEB2', 'groups': 'web'},
+            'db1':  {'addr': 'db1:3030',  'pubkey': 'DB1',  'groups': 'prod'},
+        })
+
+        ConfigurationFactory.publish('hypernova',         config)
+        ConfigurationFactory.publish('hypernova.servers', servers)
+
+    def tearDown(self):
+        for name in ('hypernova', 'hypernova.servers'):
+            ConfigurationFactory.published.pop(name, None)
+
+        shutil.rmtree(self.root_dir)
+
+    def run_action(self, Action, client, **cli_args):
+        """
+        Run an action with a stand-in client, returning its exit status and
+        output.
+        """
+
+        class TestAction(Action):
+            def _get_client(self, node, gpg_dir, timeout=None):
+                return client
+
+        stdout = sys.stdout
+        sys.stdout = io.StringIO()
+        try:
+            TestAction(argparse.Namespace(gpg_dir='/nonexistent', **cli_args),
+                       self.root_dir)
+            self.fail('action didn\'t exit')
+        except SystemExit as e:
+            return (e.code, sys.stdout.getvalue())
+        finally:
+            sys.stdout = stdout
+
+    def complete(self, line):
+        """
+        Complete the last word of a command line, returning the candidates.
+        """
+
+        environ = dict(os.environ)
+        os.environ.update({'COMP_WORDS': line,
+                           'COMP_CWORD': str(len(line.split()) - 1)})
+
+        stdout = sys.stdout
+        sys.stdout = io.StringIO()
+        try:
+            ClientCompleteAction(None, self.root_dir)
+            return sys.stdout.getvalue().split()
+        finally:
+            sys.stdout = stdout
+            os.environ.clear()
+            os.environ.update(environ)
+
+    def get_node_names(self, spec):
+        action = ClientRequestAction.__new__(ClientRequestAction)
+        ClientActionBase.__init__(action, None, self.root_dir)
+
+        return action._get_node_names(spec)
+
+    def write_batch(self, lines):
+        path = os.path.join(self.root_dir, 'batch')
+        with open(path, 'w') as f:
+            f.write("\n".join(lines) + "\n")
+
+        return path
+
+    def test_batch(self):
+        path = self.write_batch([
+            '# Comments and blank lines are ignored',
+            '',
+            'health load_averages',
+            '{"action": "stats.get", "parameters": {"reset": true}}',
+        ])
+
+        client = Client([{'response': {'results': [
+            {'status': {'successful': True}, 'response': {'1m': 0.5}},
+            {'status': {'successful': False}, 'response': {}},
+        ]}}])
+        (status, output) = self.run_action(ClientBatchAction, client,
+                                           node='web1', file=path,
+                                           parallel=True)
+
+        # Every line is sent in a single batch, to the named node
+        self.assertEqual(len(client.requests), 1)
+        (request, client_fp, server_fp) = client.requests[0]
+        self.assertEqual((client_fp, server_fp), ('CLIENT', 'WEB1'))
+        self.assertTrue(request['parallel'])
+        self.assertEqual([r['action'] for r in request['batch']],
+                         ['health.load_averages', 'stats.get'])
+        self.assertEqual(request['batch'][1]['parameters'], {'reset': True})
+
+        # Each result is formatted by its module, or printed as JSON for
+        # verbatim requests, and failures are reflected in the exit status
+        lines = output.splitlines()
+        self.assertEqual(lines[:2], ['Load averages:', '* 1m: 0.5'])
+        self.assertEqual(json.loads(lines[2])['status'],
+                         {'successful': False})
+        self.assertEqual(status, 69)
+
+    def test_batch_rejected(self):
+        path = self.write_batch(['health load_averages'])
+
+        client = Client([{'status': {'successful': False, 'error_code': 413},
+                          'response': {}}])
+        stderr = sys.stderr
+        sys.stderr = io.StringIO()
+        try:
+            (status, output) = self.run_action(ClientBatchAction, client,
+                                               node='web1', file=path,
+                                               parallel=False)
+        finally:
+            sys.stderr = stderr
+
+        self.assertEqual(status, 69)
+        self.assertEqual(output, '')
+
+    def test_node_names(self):
+        self.assertEqual(self.get_node_names('db1'), ['db1'])
+        self.assertEqual(self.get_node_names('web*'), ['web1', 'web2'])
+        self.assertEqual(self.get_node_names('@prod'), ['web1', 'db1'])
+
+        # Nodes named more than once are only queried once, in the order they
+        # were first named
+        self.assertEqual(self.get_node_names('db1, @web,web1'),
+                         ['db1', 'web1', 'web2'])
+
+        stderr = sys.stderr
+        sys.stderr = io.StringIO()
+        try:
+            for spec in ('cache*', '@nonexistent', 'web1,@nonexistent'):
+                with self.assertRaises(SystemExit) as raised:
+                    self.get_node_names(spec)
+                self.assertEqual(raised.exception.code, 64)
+        finally:
+            sys.stderr = stderr
+
+    def test_jsonl(self):
+        response = {'status': {'successful': True}, 'response': {'1m': 0.5}}
+        client   = Client([response, response])
+
+        (status, output) = self.run_action(
+                ClientRequestAction, client, node='@web', parallel=2,
+                timeout=None, output_format='jsonl', request_module='health',
+                request_action='load_averages')
+
+        # Each node's result is a line of its own, in whichever order they
+        # responded
+        self.assertEqual(status, 0)
+        results = sorted((json.loads(line) for line in output.splitlines()),
+                         key=lambda result: result['node'])
+        self.assertEqual([r['node'] for r in results], ['web1', 'web2'])
+        for result in results:
+            self.assertEqual(result['status'], 0)
+            self.assertEqual(result['output'], "Load averages:\n* 1m: 0.5")
+            self.assertEqual(result['response'], response)
+
+        self.assertEqual(sorted(server_fp for (request, client_fp, server_fp)
+                                in client.requests),
+                         ['WEB1', 'WEB2'])
+
+    def test_completion_table(self):
+        path         = os.path.join(self.root_dir,
+                                    ClientCompleteAction.TABLE_FILE)
+        build_parser = SimpleClientInterface.build_parser
+        built        = []
+
+        def counting_build_parser():
+            built.append(1)
+            return build_parser()
+
+        SimpleClientInterface.build_parser = counting_build_parser
+        try:
+            # The table is built once, then read from the cache
+            self.assertEqual(self.complete('hn-client re'), ['request'])
+            self.assertEqual(self.complete('hn-client request @w'), ['@web'])
+            self.assertEqual(len(built), 1)
+            self.assertTrue(os.path.exists(path))
+
+            # Modifying the client or a module invalidates it, as does
+            # damaging it
+            with open(path, 'r') as f:
+                table = json.load(f)
+            table['mtimes'][sorted(table['mtimes'])[0]] -= 1
+            with open(path, 'w') as f:
+                json.dump(table, f)
+
+            self.assertEqual(self.complete('hn-client ba'), ['batch'])
+            self.assertEqual(len(built), 2)
+
+            with open(path, 'w') as f:
+                f.write('{')
+
+            self.assertEqual(self.complete('hn-client co'),
+                             ['complete', 'config'])
+            self.assertEqual(len(built), 3)
+            self.assertEqual(self.complete('hn-client co'),
+                             ['complete', 'config'])
+            self.assertEqual(len(built), 3)
+        finally:
+            SimpleClientInterface.build_parser = build_parser
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3.2
+
+#
+# HyperNova server management framework
+#
+# Client daemon tests.
+#
+# Copyright (c) 2012 TDM Ltd
+#                    Luke Carrier <luke.carrier@tdm.info>
+#
+
+from unit import UnitTestCase
+
+from hypernova.clientd import ClientDaemon, ClientDaemonRequestHandler
+from hypernova.libraries.configuration import ConfigurationFactory
+import json
+import os
+import shutil
+import socket
+import tempfile
+
+class TestClientd(UnitTestCase):
+    """
+    Test running commands forwarded to the client daemon.
+    """
+
+    def setUp(self):
+        self.cwd      = os.getcwd()
+        self.root_dir = tempfile.mkdtemp()
+
+        config_dir = os.path.join(self.root_dir, 'conf')
+        os.mkdir(config_dir)
+        os.mkdir(os.path.join(config_dir, 'gpg'))
+        for name in ('client.ini', 'servers.ini'):
+            with open(os.path.join(config_dir, name), 'w') as f:
+                f.write(' ')
+
+        self.server = ClientDaemon(config_dir)
+
+    def tearDown(self):
+        self.server.server_close()
+        for name in ClientDaemon.CONFIGS:
+            ConfigurationFactory.published.pop(name, None)
+
+        os.chdir(self.cwd)
+        shutil.rmtree(self.root_dir)
+
+    def run_command(self, argv, env):
+        (front_end, daemon) = socket.socketpair()
+
+        request = json.dumps({
+            'argv': argv,
+            'cwd':  self.root_dir,
+            'env':  env,
+        })
+        front_end.sendall(bytes(request + "\n", 'UTF-8'))
+        ClientDaemonRequestHandler(daemon, None, self.server)
+        daemon.close()
+
+        with front_end:
+            frames = [json.loads(str(line, 'UTF-8'))
+                      for line in front_end.makefile('rb')]
+
+        stdout = ''.join(frame['data'] for frame in frames[:-1]
+                         if frame['stream'] == 'stdout')
+        return (frames[-1]['exit'], stdout)
+
+    def test_environment(self):
+        self.assertNotIn('COMP_WORDS', os.environ)
+        env = {
+            'COMP_WORDS': 'hn-client re',
+            'COMP_CWORD': '1',
+            'HOME':       self.root_dir,
+        }
+
+        # Completion reads the command line from the front end's environment,
+        # which mustn't outlive the command
+        self.assertEqual(self.run_command(['complete'], env), (0, "request\n"))
+        self.assertNotIn('COMP_WORDS', os.environ)
+        self.assertEqual(os.getenv('HOME'), os.path.expanduser('~'))
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3.2
+
+#
+# HyperNova server management framework
+#
+# DNS zone model tests.
+#
+# Copyright (c) 2012 TDM Ltd
+#                    Luke Carrier <luke.carrier@tdm.info>
+#
+
+from unit import UnitTestCase
+
+from hypernova.libraries.appconfig.dnsserver import InvalidZoneError, Record, \
+                                                    SoaRecord, Zone, \
+                                                    diff_records, \
+                                                    get_authoritative_server, \
+                                                    next_serial
+import datetime
+
+class TestLibrariesAppconfigDnsserver(UnitTestCase):
+    """
+    Test the zone model and its record indexes.
+    """
+
+    def get_zone(self):
+        self.www  = Record('www.example.org', 'a', '192.0.2.1', 300)
+        self.www6 = Record('www.example.org', 'aaaa', '2001:db8::1', 300)
+        self.mail = Record('mail.example.org', 'a', '192.0.2.1', 300)
+
+        return Zone('example.org', new_records=[self.www, self.www6,
+                                                self.mail])
+
+    def test_record_type(self):
+        self.assertEqual(Record('www', 'AAAA').rtype,
+                         Record.RECORD_TYPES.index('aaaa'))
+        self.assertEqual(Record('www', 1).rtype, 1)
+        self.assertRaises(AttributeError, setattr, Record(), 'other', 1)
+
+    def test_find(self):
+        zone = self.get_zone()
+
+        self.assertEqual(zone.find(name='www.example.org'),
+                         [self.www, self.www6])
+        self.assertEqual(zone.find(name='www.example.org', rtype='a'),
+                         [self.www])
+        self.assertEqual(zone.find(content='192.0.2.1'), [self.www, self.mail])
+        self.assertEqual(zone.find(rtype='a', ttl=300), [self.www, self.mail])
+        self.assertEqual(zone.find(name='ftp.example.org'), [])
+        self.assertEqual(zone.filter_records_for({'rtype': 'aaaa'}),
+                         [self.www6])
+
+    def test_rm_record(self):
+        zone = self.get_zone()
+
+        zone.rm_record(self.www)
+        self.assertEqual(zone.records, [self.www6, self.mail])
+        self.assertEqual(zone.find(name='www.example.org', rtype='a'), [])
+        self.assertEqual(zone.find(content='192.0.2.1'), [self.mail])
+        self.assertRaises(KeyError, zone.rm_record, self.www)
+
+        self.assertEqual(len(zone.records), 2)
+        self.assertEqual(Zone().records, [])
+
+        # Zones can be counted and iterated over without copying their records
+        self.assertEqual(len(zone), 2)
+        self.assertEqual(list(zone), [self.www6, self.mail])
+        self.assertEqual(len(Zone()), 0)
+
+    def test_page(self):
+        zone = Zone('example.org', new_records=[
+            Record('host%d.example.org' %(i), 'a', '192.0.2.%d' %(i), 300,
+                   new_id=i)
+            for i in range(10, 0, -1)
+        ])
+
+        (page, cursor) = zone.page({'rtype': 'a'}, limit=4)
+        self.assertEqual([r.id for r in page.records], [1, 2, 3, 4])
+        self.assertEqual(cursor, 4)
+
+        (page, cursor) = zone.page({'content': '192.0.2.1'}, after=cursor)
+        self.assertEqual([r.id for r in page.records], [10])
+        self.assertIsNone(cursor)
+        self.assertEqual(len(zone.records), 10)
+
+    def test_page_unstored(self):
+        zone = Zone('example.org', new_records=[
+            Record('host%d.example.org' %(i), 'a', '192.0.2.%d' %(i), 300)
+            for i in range(10)
+        ])
+
+        # Without IDs, records are paged through by their position
+        (names, cursor, pages) = ([], None, 0)
+        while pages == 0 or cursor is not None:
+            (page, cursor) = zone.page({'rtype': 'a'}, cursor, 4)
+            names.extend(r.name for r in page.records)
+            pages += 1
+
+        self.assertEqual(pages, 3)
+        self.assertEqual(names, ['host%d.example.org' %(i) for i in range(10)])
+
+    def test_rm_records(self):
+        server = get_authoritative_server('memory')
+        zone = self.get_zone()
+        zone.domain = 'rm-records.example.org'
+        zone.soa_record = SoaRecord('ns1.example.org', 'hostmaster.example.org')
+        server.add_zone(zone)
+
+        removed = server.rm_records(zone.domain, {'content': '192.0.2.1'})
+        self.assertEqual(sorted(r.name for r in removed),
+                         ['mail.example.org', 'www.example.org'])
+        self.assertEqual([r.name for r in server.get_zone(zone.domain).records],
+                         ['www.example.org'])
+        self.assertEqual(server.rm_records(zone.domain, {'rtype': 'mx'}), [])
+
+        server.rm_zone(zone.domain)
+
+    def test_next_serial(self):
+        today = datetime.date(2012, 6, 1)
+
+        self.assertEqual(next_serial(1, today), 2012060100)
+        self.assertEqual(next_serial('2012060100', today), 2012060101)
+        self.assertEqual(next_serial(2012053199, today), 2012060100)
+        self.assertEqual(next_serial(2099010100, today), 2099010101)
+
+    def test_change_set(self):
+        server = get_authoritative_server('memory')
+        zone = self.get_zone()
+        zone.domain = 'change-set.example.org'
+        zone.soa_record = SoaRecord('ns1.example.org', 'hostmaster.example.org',
+                                    2012010100)
+        server.add_zone(zone)
+
+        changes = server.begin_changes(zone.domain)
+        changes.rm_records({'name': 'www.example.org'})
+        changes.add_record(Record('ftp.example.org', 'a', '192.0.2.2'))
+        changes.add_record(Record('irc.example.org', 'a', '192.0.2.3'))
+        serial = changes.commit()
+
+        self.assertEqual(serial, next_serial(2012010100))
+        self.assertEqual(len(changes.removed), 2)
+
+        stored = server.get_zone(zone.domain)
+        self.assertEqual(stored.soa_record.serial, serial)
+        self.assertEqual([r.name for r in stored.records],
+                         ['mail.example.org', 'ftp.example.org',
+                          'irc.example.org'])
+
+        # Empty change sets leave the serial alone
+        self.assertEqual(server.begin_changes(zone.domain).commit(), serial)
+
+        server.rm_zone(zone.domain)
+
+    def test_sync(self):
+        server = get_authoritative_server('memory')
+        zone = self.get_zone()
+        zone.domain = 'sync.example.org'
+        zone.soa_record = SoaRecord('ns1.example.org', 'hostmaster.example.org',
+                                    2012010100)
+        server.add_zone(zone)
+
+        ftp = Record('ftp.example.org', 'a', '192.0.2.2', 300)
+        changes = server.begin_changes(zone.domain)
+        changes.sync_records([self.www, self.mail, ftp])
+
+        # Records added by others in the meantime aren't added again
+        server.add_record(zone.domain, ftp)
+        serial = changes.commit()
+
+        self.assertEqual(serial, next_serial(2012010100))
+        self.assertEqual([r.name for r in changes.removed],
+                         ['www.example.org'])
+        self.assertEqual(changes.additions, [])
+        self.assertEqual(sorted(r.name for r in
+                                server.get_zone(zone.domain).records),
+                         ['ftp.example.org', 'mail.example.org',
+                          'www.example.org'])
+
+        server.rm_zone(zone.domain)
+
+    def test_change_set_without_soa(self):
+        server = get_authoritative_server('memory')
+        zone = self.get_zone()
+        zone.domain = 'no-soa.example.org'
+        server.add_zone(zone)
+
+        changes = server.begin_changes(zone.domain)
+        changes.rm_records({'name': 'www.example.org'})
+        self.assertRaises(InvalidZoneError, changes.commit)
+        self.assertEqual(len(server.get_zone(zone.domain).records), 3)
+
+        server.rm_zone(zone.domain)
+
+    def test_diff_records(self):
+        zone = self.get_zone()
+        duplicate = Record('mail.example.org', 'a', '192.0.2.1', 300)
+        ttl = Record('www.example.org', 'a', '192.0.2.1', 60)
+
+        (removals, additions) = diff_records(
+                zone.records + [duplicate],
+                [Record('www.example.org', 'aaaa', '2001:db8::1', 300),
+                 Record('mail.example.org', 'a', '192.0.2.1', 300), ttl])
+
+        self.assertEqual(removals, [self.www, duplicate])
+        self.assertEqual(additions, [ttl])
+        self.assertEqual(diff_records(zone.records, zone.records), ([], []))
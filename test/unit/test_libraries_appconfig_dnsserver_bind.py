@@ -0,0 +1,151 @@
+#!/usr/bin/env python3.2
+
+#
+# HyperNova server management framework
+#
+# BIND DNS adapter tests.
+#
+# Copyright (c) 2012 TDM Ltd
+#                    Luke Carrier <luke.carrier@tdm.info>
+#
+
+from unit import UnitTestCase
+
+from hypernova.libraries.appconfig.dnsserver import InvalidZoneError, \
+                                                    NonexistentZoneError, \
+                                                    Record, \
+                                                    ServerCommunicationError, \
+                                                    SoaRecord, Zone, zonefile
+from hypernova.libraries.appconfig.dnsserver.bind import AuthoritativeServer
+import os
+import shutil
+import tempfile
+import time
+
+class TestLibrariesAppconfigDnsserverBind(UnitTestCase):
+    """
+    Test the BIND master file adapter.
+    """
+
+    def setUp(self):
+        self.zone_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.zone_dir)
+
+    def _zone(self):
+        return Zone('example.org', 3600, None,
+                    SoaRecord('ns1.example.org', 'hostmaster.example.org',
+                              2012010101, 10800, 900, 604800, 300),
+                    [Record('www.example.org', 'a', '192.0.2.1', 60)])
+
+    def _read(self):
+        with open(os.path.join(self.zone_dir, 'example.org.zone')) as f:
+            return zonefile.parse(f.read())
+
+    def test_write(self):
+        server = AuthoritativeServer(self.zone_dir)
+        server.add_zone(self._zone())
+
+        changes = server.begin_changes('example.org')
+        changes.add_record(Record('mail.example.org', 'a', '192.0.2.2', 60))
+        changes.rm_records({'name': 'www.example.org'})
+        serial = changes.commit()
+
+        written = self._read()
+        self.assertEqual(written.soa_record.serial, serial)
+        self.assertEqual([r.name for r in written.records],
+                         ['mail.example.org'])
+        self.assertEqual(os.listdir(self.zone_dir), ['example.org.zone'])
+
+        self.assertRaises(NonexistentZoneError, server.get_zone, 'example.net')
+
+    def test_write_without_ttl(self):
+        server = AuthoritativeServer(self.zone_dir)
+        zone = self._zone()
+        zone.ttl = None
+        server.add_zone(zone)
+
+        changes = server.begin_changes('example.org')
+        changes.add_record(Record('mail.example.org', 'a', '192.0.2.2', None))
+        changes.commit()
+        server.add_record('example.org',
+                          Record('ftp.example.org', 'a', '192.0.2.3', None))
+
+        # Records without a TTL take the SOA's minimum, both in memory and as
+        # a fresh adapter (e.g. after a restart) reads them back
+        for adapter in (server, AuthoritativeServer(self.zone_dir)):
+            zone = adapter.get_zone('example.org')
+            self.assertEqual(sorted((r.name, r.ttl) for r in zone.records),
+                             [('ftp.example.org', 300),
+                              ('mail.example.org', 300),
+                              ('www.example.org', 60)])
+
+    def test_sync(self):
+        AuthoritativeServer(self.zone_dir).add_zone(self._zone())
+
+        # Record IDs are assigned afresh whenever the file is read, so the
+        # records to remove must be found as the changes are committed
+        desired = [Record('mail.example.org', 'a', '192.0.2.2', 60)]
+        changes = AuthoritativeServer(self.zone_dir).begin_changes(
+                'example.org')
+        changes.sync_records(desired)
+        changes.commit()
+
+        self.assertEqual([r.name for r in changes.removed], ['www.example.org'])
+        self.assertEqual([r.name for r in self._read().records],
+                         ['mail.example.org'])
+
+    def test_change_set_without_soa(self):
+        server = AuthoritativeServer(self.zone_dir)
+        server.add_zone(self._zone())
+
+        # A zone without an SOA record is never written, nor changed further
+        self.assertRaises(InvalidZoneError, server.add_soa_record,
+                          'example.org', None)
+        self.assertIsNotNone(self._read().soa_record)
+
+        changes = server.begin_changes('example.org')
+        changes.add_record(Record('mail.example.org', 'a', '192.0.2.2', 60))
+        self.assertRaises(InvalidZoneError, changes.commit)
+        self.assertEqual(len(server.get_zone('example.org').records), 1)
+
+    def test_external_change(self):
+        server = AuthoritativeServer(self.zone_dir)
+        server.add_zone(self._zone())
+        self.assertEqual(len(server.get_zone('example.org').records), 1)
+
+        zone = self._zone()
+        zone.add_record(Record('mail.example.org', 'a', '192.0.2.2', 60))
+        path = os.path.join(self.zone_dir, 'example.org.zone')
+        with open(path, 'w') as f:
+            f.write("\n".join(zonefile.render(zone)))
+        os.utime(path, (time.time() + 10, time.time() + 10))
+
+        self.assertEqual(len(server.get_zone('example.org').records), 2)
+
+        server.rm_zone('example.org')
+        self.assertFalse(os.path.exists(path))
+
+    def test_write_delay(self):
+        server = AuthoritativeServer(self.zone_dir, write_delay=60)
+        server.add_zone(self._zone())
+        server.add_record('example.org',
+                          Record('mail.example.org', 'a', '192.0.2.2', 60))
+
+        self.assertFalse(os.listdir(self.zone_dir))
+        self.assertEqual(len(server.get_zone('example.org').records), 2)
+
+        server.flush()
+        self.assertEqual(len(self._read().records), 2)
+
+    def test_reload_command(self):
+        server = AuthoritativeServer(self.zone_dir, reload_command='false')
+        self.assertRaises(ServerCommunicationError, server.add_zone,
+                          self._zone())
+
+        server.reload_command = 'touch %s/%%(domain)s.reloaded' \
+                                %(self.zone_dir)
+        server.rm_records('example.org', {'name': 'www.example.org'})
+        self.assertTrue(os.path.exists(os.path.join(self.zone_dir,
+                                                    'example.org.reloaded')))
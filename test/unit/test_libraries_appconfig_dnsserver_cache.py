@@ -0,0 +1,80 @@
+#!/usr/bin/env python3.2
+
+#
+# HyperNova server management framework
+#
+# DNS zone cache tests.
+#
+# Copyright (c) 2012 TDM Ltd
+#                    Luke Carrier <luke.carrier@tdm.info>
+#
+
+from unit import UnitTestCase
+
+from hypernova.libraries.appconfig.dnsserver import Record, Zone
+from hypernova.libraries.appconfig.dnsserver.cache import \
+        CachingAuthoritativeServer, ZoneCache
+import time
+
+class Server:
+    """
+    Stand-in DNS server, counting the zones it has retrieved.
+    """
+
+    def __init__(self):
+        self.loads = 0
+
+    def get_zone(self, domain):
+        self.loads += 1
+        return Zone(domain, new_records=[Record(domain, 'a', '192.0.2.1')])
+
+    def add_record(self, zone, record):
+        pass
+
+
+class TestLibrariesAppconfigDnsserverCache(UnitTestCase):
+    """
+    Test the zone cache and the caching server wrapper.
+    """
+
+    def test_read_through(self):
+        server = Server()
+        cache  = ZoneCache()
+        caching = CachingAuthoritativeServer(server, cache)
+
+        zone = caching.get_zone('example.org')
+        self.assertIs(caching.get_zone('example.org'), zone)
+        self.assertEqual(server.loads, 1)
+
+        caching.add_record('example.org', None)
+        self.assertIsNot(caching.get_zone('example.org'), zone)
+        self.assertEqual(server.loads, 2)
+
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 2))
+
+    def test_stale_load(self):
+        cache = ZoneCache()
+
+        # A zone loaded before an invalidation mustn't be stored after it
+        token = cache.begin('example.org')
+        cache.invalidate('example.org')
+        cache.put('example.org', Zone('example.org'), token)
+        self.assertIsNone(cache.get('example.org'))
+
+    def test_eviction(self):
+        server = Server()
+        cache  = ZoneCache(max_records=4, ttl=0.01)
+        caching = CachingAuthoritativeServer(server, cache)
+
+        # Each zone counts as two records: its SOA and its A record
+        for domain in ('a.org', 'b.org', 'a.org', 'c.org'):
+            caching.get_zone(domain)
+
+        self.assertIsNotNone(cache.get('a.org'))
+        self.assertIsNone(cache.get('b.org'))
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+        time.sleep(0.02)
+        self.assertIsNone(cache.get('a.org'))
+        self.assertEqual(cache.stats()['zones'], 1)
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3.2
+
+#
+# HyperNova server management framework
+#
+# SQLite DNS adapter tests.
+#
+# Copyright (c) 2012 TDM Ltd
+#                    Luke Carrier <luke.carrier@tdm.info>
+#
+
+from unit import UnitTestCase
+
+from hypernova.libraries.appconfig.dnsserver import DuplicateZoneError, \
+                                                    InvalidZoneError, \
+                                                    NonexistentZoneError, \
+                                                    Record, SoaRecord, Zone
+from hypernova.libraries.appconfig.dnsserver.sqlite import AuthoritativeServer
+import os
+import shutil
+import tempfile
+
+class TestLibrariesAppconfigDnsserverSqlite(UnitTestCase):
+    """
+    Test the SQLite adapter, and with it the queries it shares with the
+    PowerDNS adapter.
+    """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.server  = AuthoritativeServer(os.path.join(self.tmp_dir, 'dns.db'))
+
+    def tearDown(self):
+        self.server.pool.clear()
+        shutil.rmtree(self.tmp_dir)
+
+    def _zone(self):
+        return Zone('example.org', None, None,
+                    SoaRecord('ns1.example.org', 'hostmaster.example.org',
+                              2012010101, 10800, 900, 604800, 300),
+                    [Record('www.example.org', 'a', '192.0.2.1', 60),
+                     Record('mail.example.org', 'a', '192.0.2.2', 60),
+                     Record('example.org', 'mx', 'mail.example.org', 60, 10),
+                     Record('example.org', 'txt', '"100%_sure"', 60)])
+
+    def test_zone(self):
+        self.server.import_zone(self._zone())
+        self.assertRaises(DuplicateZoneError, self.server.add_zone,
+                          self._zone())
+
+        zone = self.server.get_zone('example.org')
+        self.assertEqual(int(zone.soa_record.serial), 2012010101)
+        self.assertEqual(sorted((r.name, Record.RECORD_TYPES[r.rtype],
+                                 r.priority or 0) for r in zone.records),
+                         [('example.org', 'mx', 10),
+                          ('example.org', 'txt', 0),
+                          ('mail.example.org', 'a', 0),
+                          ('www.example.org', 'a', 0)])
+
+        self.server.rm_zone('example.org')
+        self.assertRaises(NonexistentZoneError, self.server.get_zone,
+                          'example.org')
+
+    def test_page(self):
+        self.server.import_zone(self._zone())
+
+        (zone, after) = self.server.get_zone_page('example.org', {'rtype': 'a'},
+                                                  limit=1)
+        self.assertEqual([r.name for r in zone.records], ['www.example.org'])
+
+        (zone, after) = self.server.get_zone_page('example.org', {'rtype': 'a'},
+                                                  after, 1)
+        self.assertEqual([r.name for r in zone.records], ['mail.example.org'])
+        self.assertIsNone(after)
+
+        (zone, after) = self.server.get_zone_page('example.org',
+                                                  {'content': '"100%_'})
+        self.assertEqual(len(zone.records), 1)
+        (zone, after) = self.server.get_zone_page('example.org',
+                                                  {'content': '"100%x'})
+        self.assertEqual(len(zone.records), 0)
+
+    def test_change_set(self):
+        self.server.import_zone(self._zone())
+
+        changes = self.server.begin_changes('example.org')
+        changes.rm_records({'name': 'www.example.org'})
+        changes.add_record(Record('ftp.example.org', 'cname',
+                                  'www.example.net', 60))
+        serial = changes.commit()
+
+        zone = self.server.get_zone('example.org')
+        self.assertGreater(serial, 2012010101)
+        self.assertEqual(int(zone.soa_record.serial), serial)
+        self.assertEqual([r.name for r in changes.removed], ['www.example.org'])
+        self.assertEqual(sorted(r.name for r in zone.records),
+                         ['example.org', 'example.org', 'ftp.example.org',
+                          'mail.example.org'])
+
+        removed = self.server.rm_records('example.org', {'rtype': 'a'})
+        self.assertEqual([r.name for r in removed], ['mail.example.org'])
+
+    def test_sync(self):
+        self.server.import_zone(self._zone())
+        desired = self._zone().records[1:] + [
+            Record('ftp.example.org', 'a', '192.0.2.3', 60)]
+
+        changes = self.server.begin_changes('example.org')
+        changes.sync_records(desired)
+
+        # A change landing before the commit is taken into account
+        self.server.add_record(Zone('example.org'),
+                               Record('ftp.example.org', 'a', '192.0.2.3', 60))
+        changes.commit()
+
+        self.assertEqual([r.name for r in changes.removed], ['www.example.org'])
+        self.assertEqual(changes.additions, [])
+        self.assertEqual(sorted(r.name for r in
+                                self.server.get_zone('example.org').records),
+                         ['example.org', 'example.org', 'ftp.example.org',
+                          'mail.example.org'])
+
+    def test_change_set_without_soa(self):
+        self.server.import_zone(self._zone())
+        with self.server._transaction() as cursor:
+            cursor.execute("DELETE FROM `records` WHERE `type` = 'SOA'")
+
+        changes = self.server.begin_changes('example.org')
+        changes.add_record(Record('ftp.example.org', 'cname',
+                                  'www.example.net', 60))
+        self.assertRaises(InvalidZoneError, changes.commit)
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3.2
+
+#
+# HyperNova server management framework
+#
+# DNS master file tests.
+#
+# Copyright (c) 2012 TDM Ltd
+#                    Luke Carrier <luke.carrier@tdm.info>
+#
+
+from unit import UnitTestCase
+
+from hypernova.libraries.appconfig.dnsserver import InvalidZoneError, Record, \
+                                                    SoaRecord, Zone, zonefile
+
+ZONE = """
+$ORIGIN example.org.
+$TTL 1h
+@       IN  SOA ns1 hostmaster (
+                2012010101 ; serial
+                3h 15m 1w 300 )
+        IN  NS  ns1
+        IN  MX  10 mail.example.net.
+ns1     IN  A   192.0.2.1
+www 60  IN  CNAME ns1
+        IN  TXT "v=spf1 -all ; not a comment"
+_sip._udp   SRV 10 5 5060 ns1
+"""
+
+class TestLibrariesAppconfigDnsserverZonefile(UnitTestCase):
+    """
+    Test parsing and rendering of master files.
+    """
+
+    def test_parse(self):
+        zone = zonefile.parse(ZONE)
+
+        self.assertEqual(zone.domain, 'example.org')
+        self.assertEqual(zone.ttl, 3600)
+        self.assertEqual(zone.soa_record.primary_ns, 'ns1.example.org')
+        self.assertEqual(zone.soa_record.serial, 2012010101)
+        self.assertEqual(zone.soa_record.refresh, 10800)
+        self.assertEqual(zone.soa_record.expire, 604800)
+
+        records = [(r.name, Record.RECORD_TYPES[r.rtype], r.content, r.ttl,
+                    r.priority) for r in zone.records]
+        self.assertEqual(records, [
+            ('example.org', 'ns', 'ns1.example.org', 3600, None),
+            ('example.org', 'mx', 'mail.example.net', 3600, 10),
+            ('ns1.example.org', 'a', '192.0.2.1', 3600, None),
+            ('www.example.org', 'cname', 'ns1.example.org', 60, None),
+            ('www.example.org', 'txt', '"v=spf1 -all ; not a comment"', 3600,
+             None),
+            ('_sip._udp.example.org', 'srv', '5 5060 ns1.example.org', 3600,
+             10),
+        ])
+
+    def test_round_trip(self):
+        zone = zonefile.parse(ZONE)
+        again = zonefile.parse("\n".join(zonefile.render(zone)))
+
+        self.assertEqual(again.soa_record.to_encodable(),
+                         zone.soa_record.to_encodable())
+        self.assertEqual([r.to_encodable() for r in again.records],
+                         [r.to_encodable() for r in zone.records])
+
+    def test_round_trip_without_ttl(self):
+        zone = Zone('example.org', None, None,
+                    SoaRecord('ns1.example.org', 'hostmaster.example.org',
+                              2012010101, 10800, 900, 604800, 300),
+                    [Record('www.example.org', 'a', '192.0.2.1', None),
+                     Record('example.org', 'mx', 'mail.example.org', None, 10)])
+
+        # Records without a TTL take the SOA's minimum when read back
+        again = zonefile.parse("\n".join(zonefile.render(zone)))
+        self.assertEqual([(r.name, r.ttl, r.priority) for r in again.records],
+                         [('www.example.org', 300, None),
+                          ('example.org', 300, 10)])
+
+        zone.ttl = 3600
+        again = zonefile.parse("\n".join(zonefile.render(zone)))
+        self.assertEqual([r.ttl for r in again.records], [3600, 3600])
+
+    def test_render_without_soa(self):
+        zone = Zone('example.org',
+                    new_records=[Record('www.example.org', 'a', '192.0.2.1',
+                                        60)])
+
+        self.assertRaises(InvalidZoneError, list, zonefile.render(zone))
+
+    def test_invalid(self):
+        for text in ('@ IN A 192.0.2.1',
+                     '$ORIGIN example.org.\n@ IN SOA ns1 hm ( 1 2 3 4 5',
+                     '$ORIGIN example.org.\n@ IN SOA ns1 hm 1 2 3 4 5\n'
+                     'www IN HINFO x y'):
+            self.assertRaises(InvalidZoneError, zonefile.parse, text)
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3.2
+
+#
+# HyperNova server management framework
+#
+# Client library tests.
+#
+# Copyright (c) 2012 TDM Ltd
+#                    Luke Carrier <luke.carrier@tdm.info>
+#
+
+from unit import UnitTestCase
+
+import errno
+from http.client import BadStatusLine
+from hypernova.libraries.client import Client
+from hypernova.libraries.securityfilters import RESET_HEADER, \
+                                                SIGNED_HEADER, \
+                                                AuthenticationError, \
+                                                BaseSecurityFilter
+import socket
+
+class Response:
+    """
+    Stand-in HTTP response.
+    """
+
+    def __init__(self, status=200, data=b'{}', headers=[], error=None):
+        self.status     = status
+        self.will_close = False
+
+        self._data    = data
+        self._headers = headers
+        self._error   = error
+
+    def getheaders(self):
+        return self._headers
+
+    def read(self):
+        if self._error:
+            raise self._error
+
+        return self._data
+
+
+class Connection:
+    """
+    Stand-in HTTP connection, which either raises an exception or returns a
+    response once a request is made.
+    """
+
+    def __init__(self, outcome):
+        self.outcome  = outcome
+        self.requests = []
+        self.closed   = False
+
+    def request(self, method, url, body=None, headers={}):
+        self.requests.append(body)
+
+    def getresponse(self):
+        if isinstance(self.outcome, Exception):
+            raise self.outcome
+
+        return self.outcome
+
+    def close(self):
+        self.closed = True
+
+
+class Pool:
+    """
+    Stand-in connection pool, handing out a series of connections.
+    """
+
+    def __init__(self, connections):
+        self.connections = connections
+
+    def acquire(self, host, port, timeout=None):
+        return self.connections.pop(0)
+
+    def release(self, host, port, connection):
+        pass
+
+
+class SecurityFilter(BaseSecurityFilter):
+    """
+    Stand-in security filter, refusing responses marked as such and rejecting
+    signatures on those marked as forged.
+    """
+
+    resets = 0
+
+    def encrypt(self, data, sender, recipient):
+        return data
+
+    def decrypt(self, data, sender, recipient):
+        if data == 'refused':
+            raise AuthenticationError('refused')
+
+        return (data, recipient)
+
+    def verify(self, data, sender, recipient):
+        if data == 'forged':
+            raise AuthenticationError('bad signature')
+
+        return (data, sender)
+
+    def reset(self, recipient):
+        self.resets += 1
+        return True
+
+
+class TestLibrariesClient(UnitTestCase):
+    """
+    Test the client's handling of failed requests.
+    """
+
+    def setUp(self):
+        self.filter = SecurityFilter()
+        Client.security_filters[('test', '/nonexistent', ())] = self.filter
+
+        self.client = Client(gpg_dir='/nonexistent', security_filter='test')
+
+    def tearDown(self):
+        del Client.security_filters[('test', '/nonexistent', ())]
+
+    def get_connections(self, *outcomes):
+        connections = [Connection(outcome) for outcome in outcomes]
+        self.client._pool = Pool([(connection, True)
+                                  for connection in connections])
+        return connections
+
+    def test_stale_retried(self):
+        for error in (BadStatusLine(''),
+                      socket.error(errno.ECONNRESET, 'reset'),
+                      socket.error(errno.EPIPE, 'broken pipe')):
+            (stale, fresh) = self.get_connections(error, Response())
+
+            self.assertEqual(self.client._request('body')[0], 200)
+            self.assertEqual(len(stale.requests), 1)
+            self.assertEqual(len(fresh.requests), 1)
+            self.assertTrue(stale.closed)
+
+    def test_unsafe_not_retried(self):
+        for error in (socket.timeout('timed out'),
+                      BadStatusLine('HTTP/1.1 garbage'),
+                      socket.error(errno.ECONNREFUSED, 'refused')):
+            (connection, spare) = self.get_connections(error, Response())
+
+            self.assertRaises(type(error), self.client._request, 'body')
+            self.assertEqual(len(spare.requests), 0)
+
+        # Once any of the response has arrived, the request was received
+        error = socket.error(errno.ECONNRESET, 'reset')
+        (connection, spare) = self.get_connections(Response(error=error),
+                                                   Response())
+        self.assertRaises(socket.error, self.client._request, 'body')
+        self.assertEqual(len(spare.requests), 0)
+        self.assertTrue(connection.closed)
+
+    def test_reset_retried(self):
+        reset = [(RESET_HEADER, '1')]
+        (refused, accepted) = self.get_connections(
+                Response(403, b'refused', reset), Response(200, b'{"a": 1}'))
+
+        self.assertEqual(self.client.query({}, 'CLIENT', 'AGENT'), {'a': 1})
+        self.assertEqual(self.filter.resets, 1)
+        self.assertEqual(len(accepted.requests), 1)
+
+    def test_refusal_not_retried(self):
+        (refused, spare) = self.get_connections(Response(403, b'refused'),
+                                                Response(200, b'{}'))
+
+        self.assertRaises(ValueError, self.client.query, {}, 'CLIENT', 'AGENT')
+        self.assertEqual(self.filter.resets, 0)
+        self.assertEqual(len(spare.requests), 0)
+
+    def test_busy(self):
+        signed = [(SIGNED_HEADER, '1')]
+
+        self.get_connections(Response(503, b'{"a": 1}', signed))
+        self.assertEqual(self.client.query({}, 'CLIENT', 'AGENT'), {'a': 1})
+
+        # A 503 is only believed if its signature checks out
+        (forged, spare) = self.get_connections(Response(503, b'forged', signed),
+                                               Response(200, b'{}'))
+        self.assertRaises(ValueError, self.client.query, {}, 'CLIENT', 'AGENT')
+        self.assertEqual(len(spare.requests), 0)
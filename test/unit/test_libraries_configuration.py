@@ -0,0 +1,148 @@
+#!/usr/bin/env python3.2
+
+#
+# HyperNova server management framework
+#
+# Configuration loading tests.
+#
+# Copyright (c) 2012 TDM Ltd
+#                    Luke Carrier <luke.carrier@tdm.info>
+#
+
+from unit import UnitTestCase
+
+from hypernova.libraries.configuration import REQUIRED, \
+                                             ConfigurationFactory, \
+                                             ConfigurationSchema, \
+                                             ValidationError
+import os
+import shutil
+import tempfile
+
+class TestLibrariesConfiguration(UnitTestCase):
+    """
+    Test loading configuration through the compiled cache.
+    """
+
+    def setUp(self):
+        self.root_dir   = tempfile.mkdtemp()
+        self.cache_file = os.path.join(self.root_dir,
+                                       ConfigurationFactory.CACHE_FILE)
+
+        self._write('00-base.ini', "[DEFAULT]\nmode = a\n\n"
+                                   "[server]\nport = 3030\n\n[dns]\nttl = 60\n")
+        self._write('10-local.ini', "[server]\nport = 4040\n")
+
+    def tearDown(self):
+        for name in ('test', 'test.file'):
+            ConfigurationFactory.published.pop(name, None)
+            ConfigurationFactory.root_dirs.pop(name, None)
+            ConfigurationFactory.schemas.pop(name, None)
+
+        shutil.rmtree(self.root_dir)
+
+    def _write(self, name, contents):
+        with open(os.path.join(self.root_dir, name), 'w') as f:
+            f.write(contents)
+
+    def test_compiled(self):
+        os.chmod(os.path.join(self.root_dir, '00-base.ini'), 0o640)
+
+        # The cache is no more readable than the least readable file
+        parsed = ConfigurationFactory.load(self.root_dir)
+        self.assertTrue(os.path.exists(self.cache_file))
+        self.assertEqual(os.stat(self.cache_file).st_mode & 0o777, 0o640)
+
+        compiled = ConfigurationFactory._load_compiled(
+                self.cache_file, ConfigurationFactory._get_signature(
+                        ConfigurationFactory._get_files(self.root_dir)[0]))
+        for config in (parsed, compiled):
+            self.assertEqual(config.sections(), ['server', 'dns'])
+            self.assertEqual(config['server']['port'], '4040')
+            self.assertEqual(config['dns']['mode'], 'a')
+            self.assertEqual(config.defaults(), {'mode': 'a'})
+
+        # Changing a file invalidates the cache
+        self._write('10-local.ini', "[server]\nport = 5050\n")
+        self.assertEqual(ConfigurationFactory.load(self.root_dir)['server']
+                                                                 ['port'],
+                         '5050')
+
+        # Caches which others could have written are ignored
+        os.chmod(self.cache_file, 0o666)
+        self.assertIsNone(ConfigurationFactory._load_compiled(
+                self.cache_file, ConfigurationFactory._get_signature(
+                        ConfigurationFactory._get_files(self.root_dir)[0])))
+
+    def test_file(self):
+        path   = os.path.join(self.root_dir, '10-local.ini')
+        config = ConfigurationFactory.get('test.file', path)
+
+        self.assertEqual(config['server']['port'], '4040')
+        self.assertTrue(os.path.exists(
+                os.path.join(self.root_dir, '.10-local.ini.compiled')))
+
+    def test_reload(self):
+        config = ConfigurationFactory.get('test', self.root_dir)
+
+        self._write('20-extra.ini', "[server]\nport = 6060\n")
+        self.assertIs(ConfigurationFactory.get('test'), config)
+
+        reloaded = ConfigurationFactory.reload('test')
+        self.assertIs(ConfigurationFactory.get('test'), reloaded)
+        self.assertEqual(reloaded['server']['port'], '6060')
+        self.assertEqual(config['server']['port'], '4040')
+
+        # Configurations without a schema have no snapshot
+        self.assertRaises(KeyError, ConfigurationFactory.get_snapshot, 'test')
+
+    def test_snapshot(self):
+        schema = ConfigurationSchema({
+            'dns':    str,
+            'gpg':    [('pool_size', int, 0)],
+            'server': [
+                ('port',   int,  REQUIRED),
+                ('daemon', bool, False),
+            ],
+        })
+        ConfigurationFactory.get('test', self.root_dir, schema=schema)
+        snapshot = ConfigurationFactory.get_snapshot('test')
+
+        # Values are converted, and defaults filled in
+        self.assertEqual(snapshot.server.port, 4040)
+        self.assertFalse(snapshot.server.daemon)
+        self.assertEqual(dict(snapshot.dns), {'mode': 'a', 'ttl': '60'})
+        self.assertNotIn('gpg', snapshot)
+
+        with self.assertRaises(AttributeError):
+            snapshot.server = None
+        with self.assertRaises(TypeError):
+            snapshot.dns['ttl'] = '30'
+
+        # A reload publishes a new snapshot, unless it's invalid
+        self._write('20-extra.ini', "[server]\nport = 6060\n")
+        ConfigurationFactory.reload('test')
+        reloaded = ConfigurationFactory.get_snapshot('test')
+        self.assertEqual(reloaded.server.port, 6060)
+        self.assertEqual(snapshot.server.port, 4040)
+
+        # The parser and the snapshot are published together
+        (config, published) = ConfigurationFactory.published['test']
+        self.assertIs(config, ConfigurationFactory.get('test'))
+        self.assertIs(published, reloaded)
+        self.assertEqual(config['server']['port'], '6060')
+
+        self._write('20-extra.ini', "[server]\nport = sixty\n")
+        with self.assertRaises(ValidationError):
+            ConfigurationFactory.reload('test')
+        self.assertIs(ConfigurationFactory.get_snapshot('test'), reloaded)
+        self.assertEqual(ConfigurationFactory.get('test')['server']['port'],
+                         '6060')
+
+        schema = ConfigurationSchema({'server': [('address', str, REQUIRED)]})
+        with self.assertRaises(ValidationError):
+            schema.snapshot(ConfigurationFactory.get('test'))
+
+        schema = ConfigurationSchema({'gpg': [('key_store', str, REQUIRED)]})
+        with self.assertRaises(ValidationError):
+            schema.snapshot(ConfigurationFactory.get('test'))
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3.2
+
+#
+# HyperNova server management framework
+#
+# Connection pool tests.
+#
+# Copyright (c) 2012 TDM Ltd
+#                    Luke Carrier <luke.carrier@tdm.info>
+#
+
+from unit import UnitTestCase
+
+from hypernova.libraries.connectionpool import ConnectionPool, \
+                                               PoolExhaustedError
+import time
+
+class Connection:
+    """
+    Stand-in connection, recording whether or not it has been closed.
+    """
+
+    def __init__(self):
+        self.closed = False
+        self.alive  = True
+
+    def close(self):
+        self.closed = True
+
+
+class TestLibrariesConnectionpool(UnitTestCase):
+    """
+    Test the generic connection pool.
+    """
+
+    def get_pool(self, **options):
+        self.connections = []
+
+        def connect():
+            connection = Connection()
+            self.connections.append(connection)
+            return connection
+
+        return ConnectionPool(connect, **options)
+
+    def test_reuse(self):
+        pool = self.get_pool()
+
+        with pool.connection() as first:
+            pass
+        with pool.connection() as second:
+            pass
+
+        self.assertIs(first, second)
+        self.assertEqual(len(self.connections), 1)
+
+    def test_max_size(self):
+        pool = self.get_pool(max_size=2, wait_timeout=0.01)
+
+        held = [pool.acquire(), pool.acquire()]
+        self.assertRaises(PoolExhaustedError, pool.acquire)
+
+        pool.release(held.pop())
+        self.assertIsNotNone(pool.acquire())
+        self.assertEqual(pool.size(), 2)
+
+    def test_idle_eviction(self):
+        pool = self.get_pool(max_idle_time=0.01)
+
+        connection = pool.acquire()
+        pool.release(connection)
+        time.sleep(0.02)
+
+        self.assertIsNot(pool.acquire(), connection)
+        self.assertTrue(connection.closed)
+        self.assertEqual(pool.size(), 1)
+
+    def test_health_check(self):
+        pool = self.get_pool(check=lambda c: c.alive, check_interval=0)
+
+        connection = pool.acquire()
+        connection.alive = False
+        pool.release(connection)
+
+        self.assertIsNot(pool.acquire(), connection)
+        self.assertTrue(connection.closed)
+
+    def test_broken(self):
+        pool = self.get_pool(broken=(IOError,))
+
+        for exception in (ValueError, IOError):
+            try:
+                with pool.connection() as connection:
+                    raise exception()
+            except exception:
+                pass
+
+        # The connection survives the ValueError, but not the IOError
+        self.assertEqual(len(self.connections), 1)
+        self.assertTrue(connection.closed)
+        self.assertEqual(pool.size(), 0)
+
+    def test_shared(self):
+        first  = ConnectionPool.get_pool(('test', 'a'), Connection)
+        second = ConnectionPool.get_pool(('test', 'a'), Connection)
+        third  = ConnectionPool.get_pool(('test', 'b'), Connection)
+
+        self.assertIs(first, second)
+        self.assertIsNot(first, third)
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3.2
+
+#
+# HyperNova server management framework
+#
+# Event loop server tests.
+#
+# Copyright (c) 2012 TDM Ltd
+#                    Luke Carrier <luke.carrier@tdm.info>
+#
+
+from unit import UnitTestCase
+
+from http.server import BaseHTTPRequestHandler
+from hypernova.libraries.eventloop import BufferedRequestHandlerMixIn, \
+                                          EventLoopConnection, \
+                                          EventLoopHTTPServer
+import socket
+import threading
+import time
+
+REQUEST = b'POST / HTTP/1.1\r\nContent-Length: 4\r\n\r\nbody'
+
+class RequestHandler(BufferedRequestHandlerMixIn, BaseHTTPRequestHandler):
+    """
+    Responds to every request with an empty body.
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        self.send_response(200)
+        self.send_header('Content-Length', 0)
+        self.end_headers()
+        self.close_connection = False
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestLibrariesEventloop(UnitTestCase):
+    """
+    Test request framing within the event loop server.
+    """
+
+    def frame(self, data, max_header_size=65536, max_request_size=1024):
+        connection = EventLoopConnection(None, None)
+        connection.inbuf += data
+
+        return (connection.frame(max_header_size, max_request_size),
+                connection)
+
+    def test_partial(self):
+        for i in range(len(REQUEST)):
+            (ok, connection) = self.frame(REQUEST[:i])
+
+            self.assertTrue(ok)
+            self.assertEqual(len(connection.requests), 0)
+
+    def test_pipelined(self):
+        (ok, connection) = self.frame(REQUEST * 3 + REQUEST[:10])
+
+        self.assertTrue(ok)
+        self.assertEqual(list(connection.requests), [REQUEST] * 3)
+        self.assertEqual(bytes(connection.inbuf), REQUEST[:10])
+
+    def test_no_body(self):
+        request = b'GET / HTTP/1.1\r\nHost: agent\r\n\r\n'
+        (ok, connection) = self.frame(request + REQUEST)
+
+        self.assertTrue(ok)
+        self.assertEqual(list(connection.requests), [request, REQUEST])
+
+    def test_limits(self):
+        (ok, connection) = self.frame(b'POST / HTTP/1.1\r\n' + b'x' * 100,
+                                      max_header_size=64)
+        self.assertFalse(ok)
+
+        (ok, connection) = self.frame(
+                b'POST / HTTP/1.1\r\nContent-Length: 2048\r\n\r\n')
+        self.assertFalse(ok)
+
+
+class TestLibrariesEventloopTimeout(UnitTestCase):
+    """
+    Test the event loop server's request timeout.
+    """
+
+    def setUp(self):
+        self.server = EventLoopHTTPServer(('127.0.0.1', 0), RequestHandler)
+        self.server.request_timeout = 0.3
+
+        thread = threading.Thread(target=self.server.serve_forever,
+                                  args=(0.05,))
+        thread.daemon = True
+        thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def connect(self):
+        sock = socket.create_connection(self.server.server_address)
+        sock.settimeout(0.05)
+        return sock
+
+    def is_open(self, sock):
+        try:
+            return sock.recv(4096) != b''
+        except socket.timeout:
+            return True
+
+    def test_trickle(self):
+        sock = self.connect()
+
+        # A byte at a time keeps the connection active, but the request is
+        # still expected within the timeout
+        started = time.time()
+        for byte in REQUEST[:-1]:
+            if not self.is_open(sock):
+                break
+            sock.send(bytes([byte]))
+            time.sleep(0.05)
+
+        self.assertLess(time.time() - started, 2)
+        self.assertFalse(self.is_open(sock))
+        sock.close()
+
+    def test_keep_alive(self):
+        sock = self.connect()
+
+        # Requests sent promptly keep the connection open for as long as
+        # it's in use; once idle, it's closed
+        for i in range(3):
+            sock.send(REQUEST)
+            time.sleep(0.2)
+            self.assertTrue(self.is_open(sock))
+
+        time.sleep(1.5)
+        self.assertFalse(self.is_open(sock))
+        sock.close()
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3.2
+
+#
+# HyperNova server management framework
+#
+# GPG worker pool tests.
+#
+# Copyright (c) 2012 TDM Ltd
+#                    Luke Carrier <luke.carrier@tdm.info>
+#
+
+from unit import UnitTestCase
+
+from hypernova.libraries.gnupg import GPGPool
+import threading
+import time
+
+class GPG:
+    """
+    Stand-in GPG instance, whose encryption waits until it's released.
+    """
+
+    def __init__(self, pool):
+        self.pool      = pool
+        self.gnupghome = '/nonexistent'
+
+    def encrypt(self, data, recipients):
+        with self.pool.lock:
+            self.pool.running += 1
+            self.pool.max_running = max(self.pool.running,
+                                        self.pool.max_running)
+
+        self.pool.release.wait()
+
+        with self.pool.lock:
+            self.pool.running -= 1
+
+        return data.upper()
+
+    def decrypt(self, data):
+        raise ValueError(data)
+
+
+class Pool(GPGPool):
+    """
+    Pool of stand-in GPG instances.
+    """
+
+    def __init__(self, size, queue_depth):
+        self.lock    = threading.Lock()
+        self.release = threading.Event()
+
+        self.running     = 0
+        self.max_running = 0
+
+        super().__init__(size, queue_depth)
+
+    def _get_instance(self, *gpg_args):
+        return GPG(self)
+
+
+class TestLibrariesGnupg(UnitTestCase):
+    """
+    Test the GPG worker pool.
+    """
+
+    def submit(self, pool, count):
+        """
+        Encrypt from count threads at once, returning the threads and a list
+        which will contain their results.
+        """
+
+        results = []
+        threads = [threading.Thread(
+                target=lambda i: results.append(pool.encrypt('data%d' %(i),
+                                                             'KEY')),
+                args=(i,)) for i in range(count)]
+        for thread in threads:
+            thread.start()
+
+        return (threads, results)
+
+    def wait_for(self, condition):
+        """
+        Wait (briefly) for a condition to become true.
+        """
+
+        for i in range(200):
+            if condition():
+                return True
+            time.sleep(0.005)
+
+        return False
+
+    def test_queueing(self):
+        pool = Pool(2, 0)
+        (threads, results) = self.submit(pool, 5)
+
+        # Only as many operations as there are workers run at once
+        self.assertTrue(self.wait_for(lambda: pool.queue_depth() == 3))
+        self.assertEqual(pool.running, 2)
+
+        pool.release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(pool.max_running, 2)
+        self.assertEqual(sorted(results),
+                         ['DATA%d' %(i) for i in range(5)])
+
+    def test_exceptions(self):
+        pool = Pool(1, 0)
+        pool.release.set()
+
+        self.assertRaises(ValueError, pool.decrypt, 'data')
+        self.assertEqual(pool.encrypt('data', 'KEY'), 'DATA')
+
+    def test_backpressure(self):
+        pool = Pool(1, 1)
+        (threads, results) = self.submit(pool, 3)
+
+        # One operation runs and one waits in the queue; the third submitter
+        # is held back until there's room for it
+        self.assertTrue(self.wait_for(lambda: pool.running == 1
+                                      and pool.queue_depth() == 1))
+        time.sleep(0.05)
+        self.assertEqual(pool.queue_depth(), 1)
+        self.assertEqual(sum(thread.is_alive() for thread in threads), 3)
+
+        pool.release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(results), 3)
+
+    def test_attributes(self):
+        pool = Pool(1, 0)
+
+        # Only GPG's methods are submitted to workers
+        self.assertEqual(pool.gnupghome, '/nonexistent')
+        self.assertRaises(AttributeError, getattr, pool, '_secret_key')
+        self.assertRaises(AttributeError, getattr, pool, 'nonexistent')
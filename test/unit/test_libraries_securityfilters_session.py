@@ -0,0 +1,156 @@
+#!/usr/bin/env python3.2
+
+#
+# HyperNova server management framework
+#
+# Session security filter tests.
+#
+# Copyright (c) 2012 TDM Ltd
+#                    Luke Carrier <luke.carrier@tdm.info>
+#
+
+from unit import UnitTestCase
+
+from hypernova.libraries.securityfilters import AuthenticationError
+from hypernova.libraries.securityfilters.gnupg import SecurityFilter \
+                                                      as GPGSecurityFilter
+from hypernova.libraries.securityfilters.session import DIRECTION_REQUEST, \
+                                                        DIRECTION_RESPONSE, \
+                                                        HANDSHAKE_MARKER, \
+                                                        SESSION_MARKER, \
+                                                        Session, \
+                                                        SecurityFilter
+import threading
+import time
+
+class FakeGPGSecurityFilter(GPGSecurityFilter):
+    """
+    Stands in for GPG: messages are merely labelled with their signer.
+    """
+
+    def encrypt(self, data, sender, recipient):
+        return 'GPG %s\n%s' %(sender, data)
+
+    def decrypt(self, data, sender, recipient):
+        (header, sep, clear) = data.partition('\n')
+        return (clear, header.split(' ')[1])
+
+
+class FakeSecurityFilter(SecurityFilter, FakeGPGSecurityFilter):
+    """
+    Session filter using FakeGPGSecurityFilter in place of GPG.
+    """
+
+    pass
+
+
+class TestLibrariesSecurityfiltersSession(UnitTestCase):
+    """
+    Test the symmetric session primitives used by the session filter.
+    """
+
+    def get_session(self):
+        return Session(b'0123456789abcdef', b'k' * 32, 'FINGERPRINT', 60)
+
+    def test_seal_open(self):
+        session = self.get_session()
+
+        for data in ('', '{"action": "health.load_averages"}', 'x' * 1000):
+            sealed = session.seal(DIRECTION_REQUEST, 7, data)
+            blob = sealed.split(' ', 2)[2]
+            self.assertEqual((7, data), session.open(DIRECTION_REQUEST, blob))
+
+    def test_open_rejects_tampering(self):
+        session = self.get_session()
+
+        blob = session.seal(DIRECTION_REQUEST, 1, 'data').split(' ', 2)[2]
+        tampered = ('A' if blob[10] != 'A' else 'B').join((blob[:10],
+                                                           blob[11:]))
+        self.assertRaises(AuthenticationError, session.open,
+                          DIRECTION_REQUEST, tampered)
+
+    def test_open_rejects_reflection(self):
+        session = self.get_session()
+
+        blob = session.seal(DIRECTION_REQUEST, 1, 'data').split(' ', 2)[2]
+        self.assertRaises(AuthenticationError, session.open,
+                          DIRECTION_RESPONSE, blob)
+
+    def test_accept_rejects_replays(self):
+        session = self.get_session()
+
+        for seq in (0, 2, 1, 70):
+            session.accept(seq)
+
+        for seq in (0, 2, 70, 5):
+            self.assertRaises(AuthenticationError, session.accept, seq)
+
+        session.accept(69)
+
+    def test_handshake(self):
+        (client, agent) = (FakeSecurityFilter(), FakeSecurityFilter())
+
+        handshake = client.encrypt('request', 'CLIENT', 'AGENT')
+        (clear, peer) = agent.decrypt(handshake, None, 'AGENT')
+        self.assertEqual((clear, str(peer)), ('request', 'CLIENT'))
+
+        response = agent.encrypt('response', 'AGENT', peer)
+        self.assertTrue(response.startswith(SESSION_MARKER + ' '))
+        self.assertEqual(client.decrypt(response, 'AGENT', 'CLIENT')[0],
+                         'response')
+        self.assertTrue(client._outbound['AGENT'].established)
+
+    def test_handshake_rejects_replays(self):
+        (client, agent) = (FakeSecurityFilter(), FakeSecurityFilter())
+
+        handshake = client.encrypt('request', 'CLIENT', 'AGENT')
+        agent.decrypt(handshake, None, 'AGENT')
+
+        # Replays are refused, even once the session itself is gone
+        self.assertRaises(AuthenticationError, agent.decrypt, handshake, None,
+                          'AGENT')
+        agent._inbound.clear()
+        self.assertRaises(AuthenticationError, agent.decrypt, handshake, None,
+                          'AGENT')
+
+        # As are handshakes too old for their IDs to have been remembered
+        (header, sep, clear) = handshake.partition('\n')
+        fields = clear.split('\n')[0].split(' ')
+        fields[1] = '00' * 16
+        fields[4] = str(int(time.time()) - agent.lifetime - 1)
+        stale = '%s\n%s\nrequest' %(header, ' '.join(fields))
+        self.assertTrue(stale.split('\n')[1].startswith(HANDSHAKE_MARKER))
+        self.assertRaises(AuthenticationError, agent.decrypt, stale, None,
+                          'AGENT')
+
+    def test_downgrade(self):
+        client = FakeSecurityFilter()
+        plain  = FakeGPGSecurityFilter()
+
+        client.encrypt('request', 'CLIENT', 'AGENT')
+
+        # Requests sent by other threads whilst the handshake is in flight are
+        # plain GPG messages, as are the responses to them
+        messages = []
+        def concurrent():
+            messages.append(client.encrypt('request', 'CLIENT', 'AGENT'))
+            client.decrypt(plain.encrypt('response', 'AGENT', 'CLIENT'),
+                           'AGENT', 'CLIENT')
+        thread = threading.Thread(target=concurrent)
+        thread.start()
+        thread.join()
+        self.assertEqual(messages, ['GPG CLIENT\nrequest'])
+        self.assertNotIn('AGENT', client._unsupported)
+
+        # A plain response to the handshake itself is what gives it away
+        client.decrypt(plain.encrypt('response', 'AGENT', 'CLIENT'), 'AGENT',
+                       'CLIENT')
+        self.assertIn('AGENT', client._unsupported)
+
+    def test_fulfil_requires_pending(self):
+        session = self.get_session()
+
+        seq = session.next_seq()
+        session.fulfil(seq)
+        self.assertTrue(session.established)
+        self.assertRaises(AuthenticationError, session.fulfil, seq)
@@ -0,0 +1,44 @@
+#!/usr/bin/env python3.2
+
+#
+# HyperNova server management framework
+#
+# Site configuration tests.
+#
+# Copyright (c) 2012 TDM Ltd
+#                    Luke Carrier <luke.carrier@tdm.info>
+#
+
+from unit import UnitTestCase
+
+from hypernova.libraries import siteconfig
+import os
+import shutil
+import sys
+import tempfile
+
+class TestLibrariesSiteconfig(UnitTestCase):
+    """
+    Test finding site profiles.
+    """
+
+    def setUp(self):
+        self.profile_dir = tempfile.mkdtemp()
+        siteconfig.__path__.append(self.profile_dir)
+
+        with open(os.path.join(self.profile_dir, 'testbroken.py'), 'w') as f:
+            f.write("import hypernova_nonexistent_dependency\n")
+
+    def tearDown(self):
+        siteconfig.__path__.remove(self.profile_dir)
+        sys.modules.pop('hypernova.libraries.siteconfig.testbroken', None)
+
+        shutil.rmtree(self.profile_dir)
+
+    def test_get_provisioner(self):
+        self.assertRaises(KeyError, siteconfig.get_provisioner, 'testmissing')
+        self.assertRaises(KeyError, siteconfig.get_provisioner, '../wordpress')
+
+        # A profile which is present but broken mustn't pass for missing
+        self.assertRaises(ImportError, siteconfig.get_provisioner,
+                          'testbroken')
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3.2
+
+#
+# HyperNova server management framework
+#
+# Request timing statistics tests.
+#
+# Copyright (c) 2012 TDM Ltd
+#                    Luke Carrier <luke.carrier@tdm.info>
+#
+
+from unit import UnitTestCase
+
+from hypernova.libraries.stats import Histogram, StageTimer, Stats
+
+class TestLibrariesStats(UnitTestCase):
+    """
+    Test latency histograms and their registry.
+    """
+
+    def test_histogram(self):
+        histogram = Histogram()
+
+        for i in range(99):
+            histogram.record(0.001)
+        histogram.record(0.5)
+
+        summary = histogram.summary()
+        self.assertEqual(summary['count'], 100)
+        self.assertEqual(summary['min'], 0.001)
+        self.assertEqual(summary['max'], 0.5)
+
+        # Percentiles are bucket upper bounds, but never exceed the maximum
+        self.assertTrue(0.001 <= summary['p50'] < 0.002)
+        self.assertTrue(0.001 <= summary['p90'] < 0.002)
+        self.assertEqual(histogram.percentile(100), 0.5)
+
+        histogram.reset()
+        self.assertEqual(histogram.summary()['count'], 0)
+        self.assertEqual(histogram.percentile(50), 0.0)
+
+    def test_stage_timer(self):
+        timer = StageTimer('read')
+        timer.stage('decrypt')
+        timer.stage('read')
+        total = timer.stop()
+
+        self.assertEqual(set(timer.timings), set(['read', 'decrypt']))
+        self.assertAlmostEqual(sum(timer.timings.values()), total)
+        self.assertTrue(timer.format().endswith('total=%.3f' %(total * 1000)))
+
+    def test_registry(self):
+        Stats.reset()
+
+        for name in ('health.load_averages', 'dns.get_zone', 'dns.get_zone'):
+            timer = StageTimer('module')
+            timer.stop()
+            Stats.record(name, timer)
+
+        stats = Stats.get('dns')
+        self.assertEqual(list(stats), ['dns.get_zone'])
+        self.assertEqual(stats['dns.get_zone']['module']['count'], 2)
+        self.assertEqual(stats['dns.get_zone']['total']['count'], 2)
+
+        Stats.reset('dns')
+        self.assertEqual(list(Stats.get()), ['health.load_averages'])
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3.2
+
+#
+# HyperNova server management framework
+#
+# DNS management module tests.
+#
+# Copyright (c) 2012 TDM Ltd
+#                    Luke Carrier <luke.carrier@tdm.info>
+#
+
+from unit import UnitTestCase
+
+from hypernova.libraries.appconfig.dnsserver import Record, SoaRecord, Zone
+from hypernova.libraries.appconfig.dnsserver.sqlite import AuthoritativeServer
+from hypernova.modules.dns import AgentRequestHandler
+import os
+import shutil
+import tempfile
+
+class TestModulesDns(UnitTestCase):
+    """
+    Test the DNS module's agent actions, against the SQLite adapter.
+    """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.server  = AuthoritativeServer(os.path.join(self.tmp_dir, 'dns.db'))
+        self.server.import_zone(Zone(
+                'example.org', None, None,
+                SoaRecord('ns1.example.org', 'hostmaster.example.org',
+                          2012010101, 10800, 900, 604800, 300),
+                [Record('www.example.org', 'a', '192.0.2.1', 60),
+                 Record('mail.example.org', 'a', '192.0.2.2', 60),
+                 Record('example.org', 'mx', 'mail.example.org', 60, 10)]))
+
+        self._get_server = AgentRequestHandler._get_server
+        AgentRequestHandler._get_server = lambda: self.server
+
+    def tearDown(self):
+        AgentRequestHandler._get_server = self._get_server
+
+        self.server.pool.clear()
+        shutil.rmtree(self.tmp_dir)
+
+    def get_names(self):
+        return sorted(r.name for r in
+                      self.server.get_zone('example.org').records)
+
+    def test_add_records(self):
+        response = AgentRequestHandler.do_add_records({
+            'zone':    'example.org',
+            'records': [
+                {'name': 'ftp.example.org', 'type': 'cname',
+                 'content': 'www.example.org', 'ttl': '60', 'priority': ''},
+                {'name': 'smtp.example.org', 'type': 'cname',
+                 'content': 'mail.example.org', 'ttl': '60', 'priority': '-1'},
+                {'name': 'bad.example.org', 'type': 'a',
+                 'content': '192.0.2.3'},
+                {'name': 'example.org', 'type': 'soa', 'content': 'x',
+                 'ttl': 60},
+            ],
+        })
+
+        # The valid records are added, and each invalid one is reported
+        # without affecting the others
+        self.assertTrue(response['status']['successful'])
+        results = response['response']['results']
+        self.assertEqual([r['successful'] for r in results],
+                         [True, True, False, False])
+        self.assertEqual(results[2]['explanation'], 'missing ttl')
+        self.assertEqual(results[3]['error'], 'ValidationError')
+        self.assertGreater(response['response']['serial'], 2012010101)
+        self.assertEqual(self.get_names(),
+                         ['example.org', 'ftp.example.org', 'mail.example.org',
+                          'smtp.example.org', 'www.example.org'])
+
+        # Empty and -1 priorities (as read from CSV files) mean there's none
+        records = self.server.get_zone('example.org').records
+        for name in ('ftp.example.org', 'smtp.example.org'):
+            (record, ) = [r for r in records if r.name == name]
+            self.assertIsNone(record.priority)
+
+    def test_rm_records(self):
+        response = AgentRequestHandler.do_rm_records({
+            'zone':    'example.org',
+            'records': [
+                {'name': 'www.example.org'},
+                {'type': 'a'},
+                {'name': 'nonexistent.example.org'},
+                {'name': '', 'content': ''},
+            ],
+        })
+
+        # A record matched by several sets of filters is attributed to the
+        # first of them only
+        results = response['response']['results']
+        self.assertEqual([r.get('removed') for r in results], [1, 1, 0, None])
+        self.assertEqual([r['successful'] for r in results],
+                         [True, True, False, False])
+        self.assertEqual(results[2]['error'], 'NoMatchingRecords')
+        self.assertEqual(results[3]['error'], 'ValidationError')
+        self.assertEqual(self.get_names(), ['example.org'])
+
+    def test_bulk_nonexistent_zone(self):
+        response = AgentRequestHandler.do_rm_records({
+            'zone':    'example.net',
+            'records': [{'type': 'a'}],
+        })
+
+        self.assertFalse(response['status']['successful'])
+        self.assertEqual(response['response']['error'], 'NonexistentZone')
+
+    def test_export_without_soa(self):
+        with self.server._transaction() as cursor:
+            cursor.execute("DELETE FROM `records` WHERE `type` = 'SOA'")
+
+        response = AgentRequestHandler.do_export_zone({'domain': 'example.org'})
+        self.assertFalse(response['status']['successful'])
+        self.assertEqual(response['response']['error'], 'ValidationError')
+
+    def test_sync_zone(self):
+        zone = "\n".join([
+            '$ORIGIN example.org.',
+            '@ IN SOA ns1 hostmaster ( 1 10800 900 604800 300 )',
+            'www 60 IN A 192.0.2.1',
+            'ftp 60 IN A 192.0.2.3',
+            '@ 60 IN MX 10 mail',
+        ])
+
+        for dry_run in (True, False):
+            response = AgentRequestHandler.do_sync_zone({'zone':    zone,
+                                                         'dry_run': dry_run})
+            result = response['response']
+            self.assertEqual([r['name'] for r in result['removed']],
+                             ['mail.example.org'])
+            self.assertEqual([r['name'] for r in result['added']],
+                             ['ftp.example.org'])
+            self.assertEqual(result['unchanged'], 2)
+
+        self.assertGreater(result['serial'], 2012010101)
+        self.assertEqual(self.get_names(),
+                         ['example.org', 'ftp.example.org', 'www.example.org'])